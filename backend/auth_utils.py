@@ -1,18 +1,42 @@
 import hashlib
 import hmac
 import json
-import os
+import time
+from datetime import datetime
+from functools import lru_cache
 from urllib.parse import unquote, parse_qs
 
+import jwt
+
 # TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN") # Removed module-level variable
 
-def validate_init_data(init_data_str: str, bot_token: str) -> dict | None:
+SESSION_TOKEN_ALGORITHM = "HS256"
+SESSION_TOKEN_TYPE = "tgwall_session"
+
+@lru_cache(maxsize=8)
+def webapp_secret_key(bot_token: str) -> bytes:
+    """HMAC-SHA256("WebAppData", bot_token): constant per bot token, so computed once."""
+    return hmac.new("WebAppData".encode(), bot_token.encode(), hashlib.sha256).digest()
+
+@lru_cache(maxsize=8)
+def session_secret(bot_token: str, configured: str | None = None) -> bytes:
+    """
+    Key used to sign session tokens. A configured secret (Settings.session_secret,
+    from SESSION_SECRET) wins; otherwise a key is derived from the bot token so a
+    fresh deployment works without extra config.
+    """
+    if configured:
+        return configured.encode()
+    return hmac.new("TgWallSession".encode(), bot_token.encode(), hashlib.sha256).digest()
+
+def validate_init_data(init_data_str: str, bot_token: str, max_age_seconds: int | None = None) -> dict | None:
     """
     Validates the initData string received from Telegram Mini App.
 
     Args:
         init_data_str: The raw initData string.
         bot_token: The Telegram bot token (should be passed from the caller after loading from env).
+        max_age_seconds: If set, reject initData whose auth_date is older than this.
 
     Returns:
         A dictionary containing user data if validation is successful, otherwise None.
@@ -43,10 +67,19 @@ def validate_init_data(init_data_str: str, bot_token: str) -> dict | None:
             
     data_check_string = "\n".join(data_check_arr)
 
-    secret_key = hmac.new("WebAppData".encode(), bot_token.encode(), hashlib.sha256).digest()
+    secret_key = webapp_secret_key(bot_token)
     calculated_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
 
-    if calculated_hash == received_hash:
+    if hmac.compare_digest(calculated_hash, received_hash):
+        if max_age_seconds is not None:
+            try:
+                auth_date = int(parsed_data["auth_date"][0])
+            except (KeyError, IndexError, ValueError):
+                print("Error: 'auth_date' missing or invalid in initData")
+                return None
+            if time.time() - auth_date > max_age_seconds:
+                print("Error: initData is too old (auth_date outside the allowed window)")
+                return None
         if "user" in parsed_data and parsed_data["user"]:
             try:
                 user_data_str = unquote(parsed_data["user"][0])
@@ -79,6 +112,38 @@ def validate_init_data(init_data_str: str, bot_token: str) -> dict | None:
         print("Error: initData validation failed. Hashes do not match.")
         return None
 
+def issue_session_token(user_id: str, telegram_id: str, secret: bytes, ttl_seconds: int = 3600) -> tuple[str, datetime]:
+    """
+    Issues a short-lived signed session token for an authenticated user.
+
+    Returns:
+        The encoded token and its expiry time (UTC).
+    """
+    issued_at = int(time.time())
+    claims = {
+        "sub": user_id,
+        "tg": telegram_id,
+        "typ": SESSION_TOKEN_TYPE,
+        "iat": issued_at,
+        "exp": issued_at + ttl_seconds,
+    }
+    return jwt.encode(claims, secret, algorithm=SESSION_TOKEN_ALGORITHM), datetime.utcfromtimestamp(claims["exp"])
+
+def decode_session_token(token: str, secret: bytes) -> dict | None:
+    """
+    Verifies a session token's signature and expiry.
+
+    Returns:
+        The claims (`sub` is the internal user id, `tg` the telegram id) if valid, otherwise None.
+    """
+    try:
+        claims = jwt.decode(token, secret, algorithms=[SESSION_TOKEN_ALGORITHM], options={"require": ["sub", "tg", "exp"]})
+    except jwt.PyJWTError:
+        return None
+    if claims.get("typ") != SESSION_TOKEN_TYPE:
+        return None
+    return claims
+
 if __name__ == '__main__':
     print("To test validate_init_data, provide a real initData string and ensure TELEGRAM_BOT_TOKEN is set in the calling environment and passed to the function.")
     # Example:
@@ -0,0 +1,246 @@
+"""
+Content-addressed blob storage for post media.
+
+Blobs are keyed by the SHA-256 of their bytes plus an extension derived from the
+content type (e.g. `3a7bd3...e5.png`), so identical uploads are stored once and a
+key never changes meaning, which makes it safe to cache forever.
+
+BLOB_BACKEND selects the backend: `local` (default, files under BLOB_DIR) or `s3`
+(BLOB_S3_BUCKET, optional BLOB_S3_PREFIX / BLOB_S3_ENDPOINT_URL for S3-compatible
+stores; needs boto3).
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+CONTENT_TYPE_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+    "image/gif": "gif",
+    "image/avif": "avif",
+}
+EXTENSION_CONTENT_TYPES = {ext: ctype for ctype, ext in CONTENT_TYPE_EXTENSIONS.items()}
+
+BLOB_KEY_RE = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+DATA_URL_RE = re.compile(r"^data:(?P<mime>[\w/+.-]+);base64,(?P<data>.*)$", re.DOTALL)
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobError(ValueError):
+    pass
+
+
+@dataclass
+class BlobInfo:
+    key: str
+    size: int
+    content_type: str
+
+    @property
+    def etag(self) -> str:
+        # The key already is the content hash.
+        return f'"{self.key.split(".", 1)[0]}"'
+
+
+def decode_data_url(data_url: str) -> Tuple[bytes, str]:
+    """Decode a `data:<mime>;base64,...` URL into (bytes, content_type)."""
+    match = DATA_URL_RE.match(data_url)
+    if not match:
+        raise BlobError("Content is not a base64 data URL.")
+    content_type = match.group("mime").lower()
+    if content_type not in CONTENT_TYPE_EXTENSIONS:
+        raise BlobError(f"Unsupported content type: {content_type}")
+    try:
+        data = base64.b64decode(match.group("data"), validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise BlobError(f"Invalid base64 payload: {e}")
+    return data, content_type
+
+
+def blob_key_for(data: bytes, content_type: str) -> str:
+    return f"{hashlib.sha256(data).hexdigest()}.{CONTENT_TYPE_EXTENSIONS[content_type]}"
+
+
+def content_type_for_key(key: str) -> str:
+    return EXTENSION_CONTENT_TYPES.get(key.rsplit(".", 1)[-1], "application/octet-stream")
+
+
+def blob_url(key: str) -> str:
+    return f"/api/blobs/{key}"
+
+
+class BlobStore:
+    async def put(self, data: bytes, content_type: str) -> str:
+        """Store `data` (no-op if already present) and return its key."""
+        raise NotImplementedError
+
+    async def stat(self, key: str) -> Optional[BlobInfo]:
+        raise NotImplementedError
+
+    def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        """Yield bytes `start..end` (inclusive) of the blob in chunks."""
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key[2:4] / key
+
+    def _write(self, path: Path, data: bytes) -> None:
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # A unique temp file per write: identical uploads racing in one process
+        # (the dedup case) must not share it. Whichever rename lands last
+        # replaces the file with the same bytes.
+        fd, tmp = tempfile.mkstemp(prefix=f"{path.name}.", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            if not path.exists():
+                raise
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        key = blob_key_for(data, content_type)
+        await asyncio.to_thread(self._write, self._path(key), data)
+        return key
+
+    async def stat(self, key: str) -> Optional[BlobInfo]:
+        try:
+            size = (await asyncio.to_thread(self._path(key).stat)).st_size
+        except FileNotFoundError:
+            return None
+        return BlobInfo(key=key, size=size, content_type=content_type_for_key(key))
+
+    async def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(open, self._path(key), "rb")
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+
+class S3BlobStore(BlobStore):
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None):
+        if boto3 is None:
+            raise RuntimeError("BLOB_BACKEND=s3 requires boto3 to be installed.")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3 = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.s3.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def _put(self, key: str, data: bytes, content_type: str) -> None:
+        if self._head(key) is not None:
+            return
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self._object_key(key),
+            Body=data,
+            ContentType=content_type,
+            CacheControl="public, max-age=31536000, immutable",
+        )
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        key = blob_key_for(data, content_type)
+        await asyncio.to_thread(self._put, key, data, content_type)
+        return key
+
+    async def stat(self, key: str) -> Optional[BlobInfo]:
+        head = await asyncio.to_thread(self._head, key)
+        if head is None:
+            return None
+        return BlobInfo(key=key, size=head["ContentLength"], content_type=content_type_for_key(key))
+
+    async def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        obj = await asyncio.to_thread(
+            self.s3.get_object, Bucket=self.bucket, Key=self._object_key(key), Range=f"bytes={start}-{end}"
+        )
+        body = obj["Body"]
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+
+def blob_store_from_env() -> BlobStore:
+    backend = os.getenv("BLOB_BACKEND", "local")
+    if backend == "s3":
+        return S3BlobStore(
+            bucket=os.environ["BLOB_S3_BUCKET"],
+            prefix=os.getenv("BLOB_S3_PREFIX", ""),
+            endpoint_url=os.getenv("BLOB_S3_ENDPOINT_URL") or None,
+        )
+    if backend != "local":
+        raise RuntimeError(f"Unknown BLOB_BACKEND: {backend}")
+    return LocalBlobStore(Path(os.getenv("BLOB_DIR", Path(__file__).parent / "blobs")))
+
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=` range into inclusive (start, end). Returns None when
+    the header is absent, not a single byte range or invalid (last < first),
+    meaning serve the whole blob as RFC 9110 asks, and raises BlobError for
+    ranges that are valid but unsatisfiable.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_s, _, end_s = range_header[len("bytes="):].strip().partition("-")
+    try:
+        first = int(start_s) if start_s else None
+        last = int(end_s) if end_s else None
+    except ValueError:
+        return None
+    if first is None:
+        # Suffix range: the last `last` bytes.
+        if last is None:
+            return None
+        if last <= 0 or size == 0:
+            raise BlobError("Unsatisfiable range")
+        return max(size - last, 0), size - 1
+    if first < 0 or (last is not None and last < first):
+        return None
+    if first >= size:
+        raise BlobError("Unsatisfiable range")
+    return first, size - 1 if last is None else min(last, size - 1)
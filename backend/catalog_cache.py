@@ -0,0 +1,143 @@
+"""
+In-process cache of the store catalog (`store_items`).
+
+The catalog is small and rarely written, so each worker keeps the whole thing in
+memory together with pre-serialized JSON bodies and their ETags. Freshness:
+
+* every write goes through `invalidate()`, which `$inc`s a version counter in
+  `cache_versions`; workers compare it at most every CATALOG_VERSION_CHECK_SECONDS
+  (one `_id` lookup) and reload when it moved, so all uvicorn workers converge
+  without restarts;
+* independently, a snapshot older than CATALOG_CACHE_TTL_SECONDS is reloaded, which
+  also picks up edits made directly in Mongo;
+* a catalog larger than CATALOG_CACHE_MAX_ITEMS is not cached at all; reads then
+  go straight to Mongo.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+VERSIONS_COLLECTION = "cache_versions"
+CATALOG_VERSION_ID = "store_items"
+
+
+def _json_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@dataclass
+class CatalogView:
+    """One serialized listing (all items or active items only)."""
+    items: List[Dict[str, Any]]
+    body: bytes
+    etag: str
+
+    @classmethod
+    def build(cls, items: List[Dict[str, Any]]) -> "CatalogView":
+        body = json.dumps(items, default=_json_default, separators=(",", ":")).encode()
+        return cls(items=items, body=body, etag=f'"{hashlib.sha1(body).hexdigest()}"')
+
+
+@dataclass
+class CatalogSnapshot:
+    version: int
+    loaded_at: float
+    by_id: Dict[str, Dict[str, Any]]
+    views: Dict[bool, CatalogView] = field(default_factory=dict)
+
+
+class CatalogCache:
+    def __init__(self, db, ttl: float = 300.0, version_check_interval: float = 2.0, max_items: int = 1000):
+        self.db = db
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self.max_items = max_items
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._checked_at = 0.0
+        self._uncached_until = 0.0
+        self._lock = asyncio.Lock()
+        self.reloads = 0
+
+    @classmethod
+    def from_env(cls, db) -> "CatalogCache":
+        return cls(
+            db,
+            ttl=float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300")),
+            version_check_interval=float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", "2")),
+            max_items=int(os.getenv("CATALOG_CACHE_MAX_ITEMS", "1000")),
+        )
+
+    async def _current_version(self) -> int:
+        doc = await self.db[VERSIONS_COLLECTION].find_one({"_id": CATALOG_VERSION_ID})
+        return doc["version"] if doc else 0
+
+    async def _load(self, version: int) -> Optional[CatalogSnapshot]:
+        docs = await self.db.store_items.find({}, {"_id": 0}).sort("created_at", 1).to_list(length=self.max_items + 1)
+        self.reloads += 1
+        if len(docs) > self.max_items:
+            logging.warning(f"Store catalog exceeds {self.max_items} items; serving it uncached.")
+            self._uncached_until = time.monotonic() + self.ttl
+            return None
+        return CatalogSnapshot(
+            version=version,
+            loaded_at=time.monotonic(),
+            by_id={doc["id"]: doc for doc in docs},
+            views={
+                False: CatalogView.build(docs),
+                True: CatalogView.build([doc for doc in docs if doc.get("is_active")]),
+            },
+        )
+
+    async def snapshot(self) -> Optional[CatalogSnapshot]:
+        """Return a fresh-enough snapshot, reloading it if needed (single-flight)."""
+        now = time.monotonic()
+        snap = self._snapshot
+        if snap and now - snap.loaded_at < self.ttl and now - self._checked_at < self.version_check_interval:
+            return snap
+        if snap is None and now < self._uncached_until:
+            return None
+        async with self._lock:
+            now = time.monotonic()
+            snap = self._snapshot
+            if snap and now - snap.loaded_at < self.ttl and now - self._checked_at < self.version_check_interval:
+                return snap
+            version = await self._current_version()
+            self._checked_at = time.monotonic()
+            if snap is None or version != snap.version or now - snap.loaded_at >= self.ttl:
+                snap = self._snapshot = await self._load(version)
+            return snap
+
+    async def view(self, active_only: bool) -> CatalogView:
+        snap = await self.snapshot()
+        if snap is not None:
+            return snap.views[active_only]
+        query = {"is_active": True} if active_only else {}
+        return CatalogView.build(await self.db.store_items.find(query, {"_id": 0}).sort("created_at", 1).to_list(length=None))
+
+    async def get_item(self, item_id: str, active_only: bool = True) -> Optional[Dict[str, Any]]:
+        snap = await self.snapshot()
+        if snap is not None:
+            item = snap.by_id.get(item_id)
+        else:
+            item = await self.db.store_items.find_one({"id": item_id}, {"_id": 0})
+        if item is None or (active_only and not item.get("is_active")):
+            return None
+        return item
+
+    async def invalidate(self) -> int:
+        """Bump the shared catalog version after a write; returns the new version."""
+        doc = await self.db[VERSIONS_COLLECTION].find_one_and_update(
+            {"_id": CATALOG_VERSION_ID}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        self._snapshot = None
+        self._uncached_until = 0.0
+        return doc["version"]
@@ -0,0 +1,29 @@
+from typing import Any, Dict
+
+# How many comments are embedded in the post document as a preview, unless
+# Settings.comment_preview_count (COMMENT_PREVIEW_COUNT) says otherwise. The
+# full thread lives in the `comments` collection.
+COMMENT_PREVIEW_COUNT = 3
+
+
+async def add_comment(db, comment: Dict[str, Any], preview_count: int = COMMENT_PREVIEW_COUNT) -> bool:
+    """
+    Insert `comment` and bump its post's counters. Returns False (and removes the
+    comment again) if the post does not exist.
+
+    The post update is a single atomic `$inc` + capped `$push`, so concurrent
+    comments never lose counts and the embedded preview never grows past
+    `preview_count` entries.
+    """
+    await db.comments.insert_one(dict(comment))
+    result = await db.posts.update_one(
+        {"id": comment["post_id"]},
+        {
+            "$inc": {"comment_count": 1},
+            "$push": {"comments": {"$each": [comment], "$slice": preview_count}},
+        },
+    )
+    if result.matched_count == 0:
+        await db.comments.delete_one({"id": comment["id"]})
+        return False
+    return True
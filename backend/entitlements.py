@@ -0,0 +1,104 @@
+"""
+Entitlement checks: which store items a user owns.
+
+Each worker keeps an LRU of user_id -> frozenset of owned store_item_ids, loaded
+with one `distinct` over the (user_profile_id, store_item_id) index. After that
+`has_item` is a set membership test.
+
+Purchases only ever add items, so a cached "yes" stays true. A cached "no" may be
+stale when the grant ran in another worker; a miss on an entry older than
+ENTITLEMENT_NEGATIVE_RECHECK_SECONDS reloads that user once before answering.
+Fulfilment in this worker calls `invalidate` once the grant has committed, and
+every entry is dropped after ENTITLEMENT_CACHE_TTL_SECONDS regardless. A load
+that was already running when `invalidate` came in still answers its callers
+but does not cache what it read.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional, Tuple
+
+
+class EntitlementService:
+    def __init__(self, db, max_users: int = 10000, ttl: float = 300.0, negative_recheck: float = 5.0):
+        self.db = db
+        self.max_users = max_users
+        self.ttl = ttl
+        self.negative_recheck = negative_recheck
+        self._cache: "OrderedDict[str, Tuple[FrozenSet[str], float]]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Bumped by invalidate(); only users with a load in flight have an entry.
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.loads = 0
+
+    @classmethod
+    def from_env(cls, db) -> "EntitlementService":
+        return cls(
+            db,
+            max_users=int(os.getenv("ENTITLEMENT_CACHE_MAX_USERS", "10000")),
+            ttl=float(os.getenv("ENTITLEMENT_CACHE_TTL_SECONDS", "300")),
+            negative_recheck=float(os.getenv("ENTITLEMENT_NEGATIVE_RECHECK_SECONDS", "5")),
+        )
+
+    def _cached(self, user_id: str) -> Optional[Tuple[FrozenSet[str], float]]:
+        entry = self._cache.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] >= self.ttl:
+            del self._cache[user_id]
+            return None
+        self._cache.move_to_end(user_id)
+        return entry
+
+    async def _load(self, user_id: str) -> FrozenSet[str]:
+        # Single-flight per user: concurrent misses share one query.
+        pending = self._loading.get(user_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        self._generations[user_id] = 0
+        try:
+            items = frozenset(await self.db.user_inventory.distinct("store_item_id", {"user_profile_id": user_id}))
+            self.loads += 1
+            if self._generations[user_id] == 0:
+                self._cache[user_id] = (items, time.monotonic())
+                self._cache.move_to_end(user_id)
+                while len(self._cache) > self.max_users:
+                    self._cache.popitem(last=False)
+            future.set_result(items)
+            return items
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be awaiting it; don't warn about an unretrieved exception.
+            future.exception()
+            raise
+        finally:
+            del self._loading[user_id]
+            del self._generations[user_id]
+
+    async def owned_items(self, user_id: str) -> FrozenSet[str]:
+        entry = self._cached(user_id)
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+        return await self._load(user_id)
+
+    async def has_item(self, user_id: str, store_item_id: str) -> bool:
+        entry = self._cached(user_id)
+        if entry is not None:
+            items, loaded_at = entry
+            if store_item_id in items or time.monotonic() - loaded_at < self.negative_recheck:
+                self.hits += 1
+                return store_item_id in items
+        return store_item_id in await self._load(user_id)
+
+    def invalidate(self, user_id: str) -> None:
+        self._cache.pop(user_id, None)
+        if user_id in self._generations:
+            self._generations[user_id] += 1
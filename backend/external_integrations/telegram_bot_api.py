@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401 - only needed to enable HTTP/2 in httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_API_BASE_URL = "https://api.telegram.org"
+# Telegram cancels a payment whose pre-checkout query isn't answered within 10s.
+DEFAULT_METHOD_DEADLINES = {"answerPreCheckoutQuery": 8.0}
+
+
+class TelegramAPIError(Exception):
+    """Raised when the Bot API returns an error that survived all retries."""
+
+    def __init__(self, method: str, status_code: int, description: str):
+        super().__init__(f"Telegram API error for method {method}: {status_code} - {description}")
+        self.method = method
+        self.status_code = status_code
+        self.description = description
+
+
+@dataclass
+class TelegramClientConfig:
+    bot_token: str
+    base_url: str = DEFAULT_API_BASE_URL
+    connect_timeout: float = 3.0
+    read_timeout: float = 8.0
+    write_timeout: float = 5.0
+    pool_timeout: float = 2.0
+    max_connections: int = 50
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0
+    max_retries: int = 3
+    backoff_base: float = 0.25
+    backoff_max: float = 5.0
+    max_retry_after: float = 5.0
+    call_deadline: float = 15.0 # Overall budget for one call, retries and backoff included
+    method_deadlines: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_METHOD_DEADLINES))
+    http2: bool = True
+
+    @classmethod
+    def from_env(cls, bot_token: str) -> "TelegramClientConfig":
+        return cls(
+            bot_token=bot_token,
+            base_url=os.getenv("TELEGRAM_API_BASE_URL", DEFAULT_API_BASE_URL),
+            connect_timeout=float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "3.0")),
+            read_timeout=float(os.getenv("TELEGRAM_READ_TIMEOUT", "8.0")),
+            max_connections=int(os.getenv("TELEGRAM_MAX_CONNECTIONS", "50")),
+            max_retries=int(os.getenv("TELEGRAM_MAX_RETRIES", "3")),
+            backoff_base=float(os.getenv("TELEGRAM_BACKOFF_BASE", "0.25")),
+            backoff_max=float(os.getenv("TELEGRAM_BACKOFF_MAX", "5.0")),
+            max_retry_after=float(os.getenv("TELEGRAM_MAX_RETRY_AFTER", "5.0")),
+            call_deadline=float(os.getenv("TELEGRAM_CALL_DEADLINE", "15.0")),
+            method_deadlines={"answerPreCheckoutQuery": float(os.getenv("TELEGRAM_PRE_CHECKOUT_DEADLINE", "8.0"))},
+            http2=os.getenv("TELEGRAM_HTTP2", "1") not in ("0", "false", "False"),
+        )
+
+    def deadline_for(self, method: str) -> float:
+        return self.method_deadlines.get(method, self.call_deadline)
+
+
+@dataclass
+class MethodStats:
+    calls: int = 0
+    errors: int = 0
+    retries: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def observe(self, elapsed: float, ok: bool, retries: int) -> None:
+        self.calls += 1
+        self.retries += retries
+        if not ok:
+            self.errors += 1
+        self.total_seconds += elapsed
+        if elapsed > self.max_seconds:
+            self.max_seconds = elapsed
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_ms": round(self.total_seconds / self.calls * 1000, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 3),
+        }
+
+
+class TelegramBotAPIClient:
+    """
+    App-lifetime Bot API client backed by one pooled httpx.AsyncClient.
+
+    Create it once in the startup hook and `await client.aclose()` on shutdown.
+    Retries 429 responses (honouring `parameters.retry_after` or Retry-After), 5xx
+    responses and transport errors with capped exponential backoff, and keeps
+    per-method latency counters in `stats`. Every call has an overall deadline
+    (`call_deadline`, or the method's entry in `method_deadlines`): each attempt as
+    a whole is cancelled when it runs out (httpx's own timeouts are per phase and
+    per socket read, so a slowly trickling response could outlive them), and no
+    retry starts that would end past it.
+    """
+
+    def __init__(self, config: TelegramClientConfig, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.config = config
+        self.stats: Dict[str, MethodStats] = {}
+        http2 = config.http2 and HTTP2_AVAILABLE and transport is None
+        self._client = httpx.AsyncClient(
+            base_url=f"{config.base_url.rstrip('/')}/bot{config.bot_token}/",
+            timeout=httpx.Timeout(
+                connect=config.connect_timeout,
+                read=config.read_timeout,
+                write=config.write_timeout,
+                pool=config.pool_timeout,
+            ),
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+            http2=http2,
+            transport=transport,
+        )
+
+    @property
+    def is_closed(self) -> bool:
+        return self._client.is_closed
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.config.backoff_max, self.config.backoff_base * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    async def call(self, method: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Call a Bot API method and return the decoded JSON body."""
+        started = time.perf_counter()
+        deadline = started + self.config.deadline_for(method)
+        attempt = 0
+        ok = False
+        try:
+            while True:
+                try:
+                    response = await self._post(method, data, deadline)
+                except httpx.RequestError as e:
+                    delay = self._backoff(attempt)
+                    if attempt >= self.config.max_retries or not self._retry_fits(deadline, delay):
+                        raise
+                    logging.warning(f"Request error calling Telegram API method {method}: {e}; retrying in {delay:.2f}s")
+                else:
+                    if response.status_code == 429 or response.status_code >= 500:
+                        delay = self._retry_after(response) if response.status_code == 429 else None
+                        if delay is None:
+                            delay = self._backoff(attempt)
+                        elif delay > self.config.max_retry_after:
+                            # Waiting that long would blow Telegram's own deadlines
+                            # (e.g. 10s for answerPreCheckoutQuery), so give up now.
+                            raise TelegramAPIError(method, response.status_code, response.text)
+                        if attempt >= self.config.max_retries or not self._retry_fits(deadline, delay):
+                            raise TelegramAPIError(method, response.status_code, response.text)
+                        logging.warning(f"Telegram API {method} returned {response.status_code}; retrying in {delay:.2f}s")
+                    elif response.status_code >= 400:
+                        raise TelegramAPIError(method, response.status_code, response.text)
+                    else:
+                        ok = True
+                        return response.json()
+                attempt += 1
+                await asyncio.sleep(delay)
+        finally:
+            self.stats.setdefault(method, MethodStats()).observe(time.perf_counter() - started, ok, attempt)
+
+    async def _post(self, method: str, data: Optional[Dict[str, Any]], deadline: float) -> httpx.Response:
+        remaining = max(0.001, deadline - time.perf_counter())
+        try:
+            return await asyncio.wait_for(
+                self._client.post(method, json=data, timeout=self._attempt_timeout(deadline)), timeout=remaining)
+        except asyncio.TimeoutError:
+            # Same path as an httpx timeout: retried only if the deadline allows.
+            raise httpx.TimeoutException(f"{method} did not complete within the call deadline") from None
+
+    def _attempt_timeout(self, deadline: float) -> httpx.Timeout:
+        remaining = max(0.001, deadline - time.perf_counter())
+        config = self.config
+        return httpx.Timeout(
+            connect=min(config.connect_timeout, remaining),
+            read=min(config.read_timeout, remaining),
+            write=min(config.write_timeout, remaining),
+            pool=min(config.pool_timeout, remaining),
+        )
+
+    @staticmethod
+    def _retry_fits(deadline: float, delay: float) -> bool:
+        # A retry that only starts at the deadline can't finish before it.
+        return time.perf_counter() + delay < deadline
+
+    def _retry_after(self, response: httpx.Response) -> Optional[float]:
+        retry_after = None
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            retry_after = (body.get("parameters") or {}).get("retry_after")
+        if retry_after is None:
+            retry_after = response.headers.get("Retry-After")
+        try:
+            return float(retry_after) if retry_after is not None else None
+        except ValueError:
+            return None
+
+    def stats_snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {method: stats.as_dict() for method, stats in self.stats.items()}
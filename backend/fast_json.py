@@ -0,0 +1,86 @@
+"""
+Fast JSON bodies for read endpoints.
+
+List endpoints used to build a Pydantic model per Mongo document and let
+FastAPI validate and serialize the whole page again through `response_model`.
+Documents read back from our own collections were validated when they were
+written, so read paths now shape them to the response model's fields and
+encode them in one call. Write paths keep full validation.
+
+`DocumentShape` copies a model's fields out of a document and fills in the
+model's defaults for fields that older documents don't have. Anything else in
+the document, such as `_id` or internal bookkeeping, is dropped. Values are not
+coerced.
+
+orjson is used when installed. Without it, the standard library json module
+produces the same output, only slower. Naive datetimes are encoded as
+`isoformat()`, which is what Pydantic emits as well.
+"""
+import json
+from typing import Any, Dict, Iterable, List, Optional, Type
+
+from pydantic import BaseModel
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised by the fallback test
+    orjson = None
+
+
+def _json_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_json_default)
+    return json.dumps(content, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(Response):
+    """JSONResponse for trusted content: no jsonable_encoder pass, just `dumps`."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+_MISSING = object()
+
+
+class DocumentShape:
+    """The output fields of a response model, resolved once per model."""
+
+    def __init__(self, model: Type[BaseModel]):
+        self.fields = []
+        for name, info in model.model_fields.items():
+            if info.default_factory is not None:
+                default = info.default_factory
+            elif info.is_required():
+                default = _MISSING
+            else:
+                default = info.default
+            self.fields.append((name, default, info.default_factory is not None))
+
+    def shape(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        out = {}
+        for name, default, is_factory in self.fields:
+            value = doc.get(name, _MISSING)
+            if value is _MISSING:
+                if default is _MISSING:
+                    continue
+                value = default() if is_factory else default
+            out[name] = value
+        return out
+
+    def shape_all(self, docs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [self.shape(doc) for doc in docs]
+
+
+def page_response(shape: Optional[DocumentShape], docs: List[Dict[str, Any]], next_cursor: Optional[str]) -> FastJSONResponse:
+    """A `{"items": [...], "next_cursor": ...}` page. With no shape the documents are sent as they are."""
+    items = shape.shape_all(docs) if shape is not None else docs
+    return FastJSONResponse({"items": items, "next_cursor": next_cursor})
@@ -0,0 +1,210 @@
+"""
+Home feed: follows plus precomputed per-user timelines.
+
+Each user has one `timelines` document holding the newest FEED_TIMELINE_MAX
+entries ({post_id, author_id, created_at}) of the accounts they follow, their own
+posts included. A new post is fanned out to those documents by background
+workers (`fanout_post`, run from a durable job queue), so reading a feed page
+reads one timeline document and then fetches the page's posts by id.
+
+Authors with at least FEED_CELEBRITY_THRESHOLD followers are not fanned out.
+Their posts are merged in at read time from the `posts` collection instead
+(fan-out-on-read), which keeps a single post from turning into millions of
+writes. The same read path covers paging past the end of a full timeline.
+"""
+import heapq
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from pagination import decode_cursor, encode_cursor, keyset_filter, KEYSET_SORT
+
+TIMELINES_COLLECTION = "timelines"
+FOLLOWS_COLLECTION = "follows"
+
+
+def _entry_key(entry: Dict[str, Any]) -> Tuple[datetime, str]:
+    return entry["created_at"], entry["post_id"]
+
+
+class FeedService:
+    def __init__(
+        self,
+        db,
+        timeline_max: int = 500,
+        celebrity_threshold: int = 10000,
+        fanout_batch_size: int = 1000,
+        celebrity_cache_seconds: float = 60.0,
+        backfill_posts: int = 20,
+    ):
+        self.db = db
+        self.timeline_max = timeline_max
+        self.celebrity_threshold = celebrity_threshold
+        self.fanout_batch_size = fanout_batch_size
+        self.celebrity_cache_seconds = celebrity_cache_seconds
+        self.backfill_posts = backfill_posts
+        self._celebrities: Optional[frozenset] = None
+        self._celebrities_loaded_at = 0.0
+
+    @classmethod
+    def from_env(cls, db) -> "FeedService":
+        return cls(
+            db,
+            timeline_max=int(os.getenv("FEED_TIMELINE_MAX", "500")),
+            celebrity_threshold=int(os.getenv("FEED_CELEBRITY_THRESHOLD", "10000")),
+            fanout_batch_size=int(os.getenv("FEED_FANOUT_BATCH_SIZE", "1000")),
+            celebrity_cache_seconds=float(os.getenv("FEED_CELEBRITY_CACHE_SECONDS", "60")),
+            backfill_posts=int(os.getenv("FEED_FOLLOW_BACKFILL_POSTS", "20")),
+        )
+
+    @property
+    def timelines(self):
+        return self.db[TIMELINES_COLLECTION]
+
+    @property
+    def follows(self):
+        return self.db[FOLLOWS_COLLECTION]
+
+    # --- Follow graph ---
+    async def follow(self, follower_id: str, followee_id: str) -> bool:
+        """Returns False if the follow already existed."""
+        try:
+            await self.follows.insert_one({"follower_id": follower_id, "followee_id": followee_id, "created_at": datetime.utcnow()})
+        except DuplicateKeyError:
+            return False
+        # updated_at: user search re-ranks by follower count on its next sync.
+        await self.db.users.update_one({"id": followee_id}, {"$inc": {"follower_count": 1}, "$set": {"updated_at": datetime.utcnow()}})
+        await self.db.users.update_one({"id": follower_id}, {"$inc": {"following_count": 1}})
+        if not await self.is_celebrity(followee_id):
+            # Seed the timeline with the followee's latest posts so the feed isn't
+            # empty until they post again.
+            posts = await self.db.posts.find(
+                {"user_id": followee_id}, {"_id": 0, "id": 1, "user_id": 1, "created_at": 1}
+            ).sort(KEYSET_SORT).limit(self.backfill_posts).to_list(length=self.backfill_posts)
+            await self._push([follower_id], [self.timeline_entry(p) for p in posts])
+        return True
+
+    async def unfollow(self, follower_id: str, followee_id: str) -> bool:
+        """Returns False if there was no follow to remove."""
+        result = await self.follows.delete_one({"follower_id": follower_id, "followee_id": followee_id})
+        if result.deleted_count == 0:
+            return False
+        await self.db.users.update_one({"id": followee_id}, {"$inc": {"follower_count": -1}, "$set": {"updated_at": datetime.utcnow()}})
+        await self.db.users.update_one({"id": follower_id}, {"$inc": {"following_count": -1}})
+        await self.timelines.update_one({"_id": follower_id}, {"$pull": {"entries": {"author_id": followee_id}}})
+        return True
+
+    async def celebrities(self) -> frozenset:
+        now = time.monotonic()
+        if self._celebrities is None or now - self._celebrities_loaded_at >= self.celebrity_cache_seconds:
+            docs = await self.db.users.find(
+                {"follower_count": {"$gte": self.celebrity_threshold}}, {"_id": 0, "id": 1}
+            ).to_list(length=None)
+            self._celebrities = frozenset(doc["id"] for doc in docs)
+            self._celebrities_loaded_at = now
+        return self._celebrities
+
+    async def is_celebrity(self, user_id: str) -> bool:
+        user = await self.db.users.find_one({"id": user_id}, {"_id": 0, "follower_count": 1})
+        return bool(user) and user.get("follower_count", 0) >= self.celebrity_threshold
+
+    # --- Fan-out on write ---
+    @staticmethod
+    def timeline_entry(post: Dict[str, Any]) -> Dict[str, Any]:
+        """Timeline entry for a post document; also the payload of a fan-out job."""
+        return {"post_id": post["id"], "author_id": post["user_id"], "created_at": post["created_at"]}
+
+    async def _push(self, user_ids: List[str], entries: List[Dict[str, Any]]) -> None:
+        if not user_ids or not entries:
+            return
+        post_ids = [e["post_id"] for e in entries]
+        # The `$nin` guard makes redelivered jobs no-ops. For a timeline that
+        # already has the entry the filter misses, the upsert's insert hits the
+        # _id and fails with a duplicate key, which is exactly "already there".
+        ops = [
+            UpdateOne(
+                {"_id": user_id, "entries.post_id": {"$nin": post_ids}},
+                {"$push": {"entries": {"$each": entries, "$sort": {"created_at": -1, "post_id": -1}, "$slice": self.timeline_max}},
+                 "$set": {"updated_at": datetime.utcnow()}},
+                upsert=True,
+            )
+            for user_id in user_ids
+        ]
+        try:
+            await self.timelines.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+    async def fanout_post(self, job: Dict[str, Any]) -> int:
+        """Push a post into its author's and followers' timelines; returns timelines written."""
+        entry = {"post_id": job["post_id"], "author_id": job["author_id"], "created_at": job["created_at"]}
+        await self._push([job["author_id"]], [entry])
+        if await self.is_celebrity(job["author_id"]):
+            return 1
+        written = 1
+        batch: List[str] = []
+        cursor = self.follows.find({"followee_id": job["author_id"]}, {"_id": 0, "follower_id": 1})
+        async for follow in cursor:
+            batch.append(follow["follower_id"])
+            if len(batch) >= self.fanout_batch_size:
+                await self._push(batch, [entry])
+                written += len(batch)
+                batch = []
+        await self._push(batch, [entry])
+        written += len(batch)
+        return written
+
+    # --- Reads ---
+    async def _pulled_posts(self, author_ids: List[str], cursor: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        if not author_ids:
+            return []
+        docs = await self.db.posts.find(
+            keyset_filter({"user_id": {"$in": author_ids}}, cursor), {"_id": 0, "id": 1, "user_id": 1, "created_at": 1}
+        ).sort(KEYSET_SORT).limit(limit).to_list(length=limit)
+        return [self.timeline_entry(doc) for doc in docs]
+
+    async def read_page(self, user_id: str, cursor: Optional[str], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Return (posts, next_cursor) for one page of the user's home feed, newest first."""
+        after = decode_cursor(cursor) if cursor else None
+        timeline = await self.timelines.find_one({"_id": user_id}) or {"entries": []}
+        entries = timeline["entries"]
+        candidates = [e for e in entries if after is None or _entry_key(e) < after]
+
+        # Fan-out-on-read for followed celebrities, whose posts were never pushed.
+        pulled: List[Dict[str, Any]] = []
+        celebrities = await self.celebrities()
+        if celebrities:
+            follows = await self.follows.find(
+                {"follower_id": user_id, "followee_id": {"$in": list(celebrities)}}, {"_id": 0, "followee_id": 1}
+            ).to_list(length=None)
+            pulled += await self._pulled_posts([f["followee_id"] for f in follows], cursor, limit + 1)
+        # Past the end of a timeline trimmed to timeline_max, older posts of
+        # everyone followed are read directly as well.
+        if len(candidates) <= limit and len(entries) >= self.timeline_max:
+            oldest = min(entries, key=_entry_key)
+            start_after = after if after is not None and after < _entry_key(oldest) else _entry_key(oldest)
+            follows = await self.follows.find({"follower_id": user_id}, {"_id": 0, "followee_id": 1}).to_list(length=None)
+            pulled += await self._pulled_posts([f["followee_id"] for f in follows] + [user_id], encode_cursor(*start_after), limit + 1)
+        seen = {e["post_id"] for e in candidates}
+        for entry in pulled:
+            if entry["post_id"] not in seen:
+                seen.add(entry["post_id"])
+                candidates.append(entry)
+
+        page = heapq.nlargest(limit + 1, candidates, key=_entry_key)
+        next_cursor = encode_cursor(*_entry_key(page[limit - 1])) if len(page) > limit else None
+        page = page[:limit]
+        if not page:
+            return [], None
+        posts = await self.db.posts.find({"id": {"$in": [e["post_id"] for e in page]}}, {"_id": 0}).to_list(length=limit)
+        by_id = {post["id"]: post for post in posts}
+        missing = [e["post_id"] for e in page if e["post_id"] not in by_id]
+        if missing:
+            logging.info(f"Feed for {user_id} skipped {len(missing)} posts that no longer exist.")
+        return [by_id[e["post_id"]] for e in page if e["post_id"] in by_id], next_cursor
@@ -0,0 +1,72 @@
+"""
+Gifts: one document per gift in the `gifts` collection. A receiver's gifts are
+listed newest first with one keyset query on the
+(receiver_id, status, created_at, id) index.
+
+Sends can be charged in stars. GIFT_PRICES (Settings.gift_prices) prices gift
+types ("flower=5,candy=3,star=25"); types it doesn't list are free. The sender is
+debited through the stars ledger (stars_ledger.py), whose guarded account
+update means concurrent sends can never take a balance below zero. One ledger
+entry covers a whole send, and its ref lists the gift ids. Gifts that are
+charged but then not inserted are refunded with a second entry.
+
+A bulk send writes all of its gifts with one `insert_many(ordered=False)`.
+Every gift carries a `client_ref` that is unique per sender: the client's
+idempotency key (suffixed with the receiver for bulk sends), or the gift id.
+When a request is retried, the gifts it already delivered are found with one
+lookup on that index and skipped before charging, and the unique index catches
+concurrent retries. The rest still go through.
+"""
+import logging
+from typing import Any, Dict, List, Mapping, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from stars_ledger import StarsLedger
+
+
+def gift_price(prices: Mapping[str, int], gift_type: str) -> int:
+    return prices.get(gift_type, 0)
+
+
+async def send_gifts(db, ledger: StarsLedger, gifts: List[Dict[str, Any]], price: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Charge the sender `price` per new gift and insert `gifts` (all from one
+    sender). Returns (inserted, duplicates). Raises stars_ledger.InsufficientStars
+    before writing anything if the balance can't cover the new gifts.
+    """
+    if not gifts:
+        return [], []
+    sender_id = gifts[0]["sender_id"]
+    # Skip gifts an earlier attempt already delivered before charging; the
+    # unique index still catches a retry racing this one.
+    sent = await db.gifts.find(
+        {"sender_id": sender_id, "client_ref": {"$in": [gift["client_ref"] for gift in gifts]}}, {"_id": 0, "client_ref": 1}
+    ).to_list(length=None)
+    sent_refs = {doc["client_ref"] for doc in sent}
+    duplicates = [gift for gift in gifts if gift["client_ref"] in sent_refs]
+    pending = [gift for gift in gifts if gift["client_ref"] not in sent_refs]
+    if not pending:
+        return [], duplicates
+
+    cost = price * len(pending)
+    if cost:
+        await ledger.post(sender_id, -cost, "gift_sent", [gift["id"] for gift in pending])
+
+    failed: Dict[int, int] = {}
+    try:
+        await db.gifts.insert_many([dict(gift) for gift in pending], ordered=False)
+    except BulkWriteError as e:
+        failed = {err["index"]: err.get("code") for err in e.details.get("writeErrors", [])}
+        if cost and failed:
+            await ledger.post(sender_id, price * len(failed), "gift_refund", [pending[i]["id"] for i in sorted(failed)])
+        if any(code != 11000 for code in failed.values()):
+            raise
+    except Exception:
+        # The batch may be partly written; leave the charge for reconciliation
+        # rather than refunding gifts that might exist.
+        logging.error(f"Gift insert for {sender_id} failed after charging {cost} stars.")
+        raise
+    inserted = [gift for i, gift in enumerate(pending) if i not in failed]
+    duplicates += [gift for i, gift in enumerate(pending) if i in failed]
+    return inserted, duplicates
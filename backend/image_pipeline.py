@@ -0,0 +1,163 @@
+"""
+Ingest pipeline for image/drawing posts: validates uploads, re-encodes them to
+WebP (or AVIF where the installed Pillow supports it) and renders thumbnail
+variants. Encoding is CPU bound, so it runs in a process pool and never on the
+event loop. The pool uses the "spawn" start method: by the time the first
+upload arrives the API process already runs Motor and httpx threads, and
+forking a threaded process can copy a held lock into the child.
+
+Configuration (env):
+    IMAGE_FORMAT          webp (default) or avif
+    IMAGE_QUALITY         encoder quality, default 85
+    IMAGE_MAX_BYTES       max decoded upload size, default 5 MiB
+    IMAGE_MAX_DIMENSION   max width/height of an upload, default 4096
+    IMAGE_VARIANTS        name:box pairs, default "thumb:160,small:480,medium:960"
+    IMAGE_WORKERS         process pool size, default 2
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+FULL_VARIANT = "full"
+# Only what blob_store accepts; keeps Pillow's other (less hardened) decoders out.
+ALLOWED_FORMATS = ("PNG", "JPEG", "WEBP", "GIF", "AVIF")
+
+
+class ImageRejected(ValueError):
+    def __init__(self, message: str, status_code: int = 422):
+        super().__init__(message)
+        self.status_code = status_code
+
+    def __reduce__(self):
+        # Keep status_code when the error crosses the process pool boundary.
+        return (type(self), (str(self), self.status_code))
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    format: str = "webp"
+    quality: int = 85
+    max_bytes: int = 5 * 1024 * 1024
+    max_dimension: int = 4096
+    variants: Tuple[Tuple[str, int], ...] = (("thumb", 160), ("small", 480), ("medium", 960))
+    workers: int = 2
+
+    @classmethod
+    def from_env(cls) -> "PipelineConfig":
+        fmt = os.getenv("IMAGE_FORMAT", "webp").lower()
+        if fmt == "avif":
+            from PIL import features
+            if not features.check("avif"):
+                logging.warning("IMAGE_FORMAT=avif but this Pillow build has no AVIF encoder; using webp.")
+                fmt = "webp"
+        variants = tuple(
+            (name.strip(), int(box))
+            for name, box in (pair.split(":") for pair in os.getenv("IMAGE_VARIANTS", "thumb:160,small:480,medium:960").split(",") if pair)
+        )
+        return cls(
+            format=fmt,
+            quality=int(os.getenv("IMAGE_QUALITY", "85")),
+            max_bytes=int(os.getenv("IMAGE_MAX_BYTES", str(5 * 1024 * 1024))),
+            max_dimension=int(os.getenv("IMAGE_MAX_DIMENSION", "4096")),
+            variants=variants,
+            workers=int(os.getenv("IMAGE_WORKERS", "2")),
+        )
+
+    @property
+    def content_type(self) -> str:
+        return f"image/{self.format}"
+
+
+@dataclass
+class EncodedImage:
+    data: bytes
+    content_type: str
+    width: int
+    height: int
+
+
+@dataclass
+class ProcessedImage:
+    variants: Dict[str, EncodedImage] = field(default_factory=dict)
+
+    @property
+    def full(self) -> EncodedImage:
+        return self.variants[FULL_VARIANT]
+
+
+def _encode(image: "Image.Image", config: PipelineConfig) -> EncodedImage:
+    options = {"quality": config.quality}
+    if config.format == "webp":
+        options["method"] = 4
+    out = io.BytesIO()
+    image.save(out, format=config.format.upper(), **options)
+    return EncodedImage(out.getvalue(), config.content_type, image.width, image.height)
+
+
+def transcode(data: bytes, config: PipelineConfig) -> ProcessedImage:
+    """Validate and re-encode one upload. Runs inside the worker process."""
+    # Imported here so only the pool workers pay for loading Pillow.
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    if len(data) > config.max_bytes:
+        raise ImageRejected(f"Image is larger than {config.max_bytes} bytes.", status_code=413)
+    try:
+        image = Image.open(io.BytesIO(data), formats=ALLOWED_FORMATS)
+        # Only the header has been read so far; reject oversized images before
+        # decoding the pixel data.
+        if image.width > config.max_dimension or image.height > config.max_dimension:
+            raise ImageRejected(
+                f"Image is {image.width}x{image.height}; the maximum is {config.max_dimension}px per side.",
+                status_code=413,
+            )
+        image.load()
+        # Phone cameras store rotation in EXIF; bake it into the pixels, since
+        # the re-encoded output carries no EXIF.
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ImageRejected(f"Could not decode image: {e}")
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+
+    processed = ProcessedImage()
+    processed.variants[FULL_VARIANT] = _encode(image, config)
+    for name, box in config.variants:
+        if image.width <= box and image.height <= box:
+            continue
+        thumb = image.copy()
+        thumb.thumbnail((box, box), Image.Resampling.LANCZOS)
+        processed.variants[name] = _encode(thumb, config)
+    return processed
+
+
+class ImagePipeline:
+    """Owns the process pool; create in the startup hook, `close()` on shutdown."""
+
+    def __init__(self, config: Optional[PipelineConfig] = None):
+        self.config = config or PipelineConfig.from_env()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.config.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def process(self, data: bytes) -> ProcessedImage:
+        if len(data) > self.config.max_bytes:
+            # Cheap check before paying for the inter-process copy.
+            raise ImageRejected(f"Image is larger than {self.config.max_bytes} bytes.", status_code=413)
+        self.start()
+        return await asyncio.get_running_loop().run_in_executor(self._pool, transcode, data, self.config)
@@ -0,0 +1,217 @@
+"""
+Pre-generated invoice links for store items.
+
+Creating an invoice link is a synchronous round trip to Telegram. To keep it off
+the purchase path, a background refiller keeps up to INVOICE_POOL_SIZE ready links
+per active store item in the `invoice_pool` collection, each with its own reserved
+payload. `create_invoice_link` then only claims one with an atomic
+find_one_and_update and records the pending transaction for the buyer.
+
+Entries carry a fingerprint of the item's invoice-relevant fields, so a price or
+title change makes old links unclaimable; they are removed by `expire_stale`
+along with ready links older than INVOICE_POOL_TTL_SECONDS. Pending transactions
+created from pooled links are expired by the payment reaper like any other.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+POOL_COLLECTION = "invoice_pool"
+LOCKS_COLLECTION = "invoice_pool_locks"
+
+CreateLink = Callable[[Dict[str, Any], str], Awaitable[str]]
+
+
+def item_fingerprint(item: Dict[str, Any]) -> str:
+    relevant = {k: item.get(k) for k in ("name", "description", "price_stars", "image_url")}
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+
+def pool_payload(item_id: str) -> str:
+    return f"tgwall_item_{item_id}_pool_{uuid.uuid4().hex[:12]}"
+
+
+class InvoicePool:
+    def __init__(
+        self,
+        db,
+        create_link: CreateLink,
+        target_size: int = 5,
+        concurrency: int = 4,
+        ttl_seconds: float = 6 * 3600,
+        refill_interval: float = 30.0,
+        refill_on_claim: bool = True,
+    ):
+        self.db = db
+        self.create_link = create_link
+        self.target_size = target_size
+        self.ttl_seconds = ttl_seconds
+        self.refill_interval = refill_interval
+        self.refill_on_claim = refill_on_claim
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._refilling: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.links_created = 0
+        self.claims = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, db, create_link: CreateLink) -> "InvoicePool":
+        return cls(
+            db,
+            create_link,
+            target_size=int(os.getenv("INVOICE_POOL_SIZE", "5")),
+            concurrency=int(os.getenv("INVOICE_POOL_CONCURRENCY", "4")),
+            ttl_seconds=float(os.getenv("INVOICE_POOL_TTL_SECONDS", str(6 * 3600))),
+            refill_interval=float(os.getenv("INVOICE_POOL_REFILL_SECONDS", "30")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.target_size > 0
+
+    @property
+    def collection(self):
+        return self.db[POOL_COLLECTION]
+
+    async def claim(self, item: Dict[str, Any], user_profile_id: str) -> Optional[Dict[str, Any]]:
+        """Atomically take a ready link for `item`, or None if the pool is empty."""
+        now = datetime.utcnow()
+        entry = await self.collection.find_one_and_update(
+            {"store_item_id": item["id"], "status": "ready", "fingerprint": item_fingerprint(item), "expires_at": {"$gt": now}},
+            {"$set": {"status": "claimed", "claimed_by": user_profile_id, "claimed_at": now}},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if entry:
+            self.claims += 1
+        else:
+            self.misses += 1
+        self.schedule_refill(item)
+        return entry
+
+    def schedule_refill(self, item: Dict[str, Any]) -> None:
+        if not self.enabled or not self.refill_on_claim:
+            return
+        task = self._refilling.get(item["id"])
+        if task is None or task.done():
+            self._refilling[item["id"]] = asyncio.create_task(self._refill_logged(item))
+
+    async def _refill_logged(self, item: Dict[str, Any]) -> None:
+        try:
+            await self.refill_item(item)
+        except Exception as e:
+            logging.error(f"Invoice pool refill failed for item {item['id']}: {e!r}")
+
+    async def _acquire_lock(self, item_id: str) -> Optional[str]:
+        # A short per-item lease so several workers don't all top up the same item.
+        # Returns the owner token to release it with, or None if someone holds it.
+        now = datetime.utcnow()
+        owner = uuid.uuid4().hex
+        try:
+            await self.db[LOCKS_COLLECTION].update_one(
+                {"_id": item_id, "locked_until": {"$lt": now}},
+                {"$set": {"locked_until": now + timedelta(seconds=max(self.refill_interval, 10)), "owner": owner}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return None
+        return owner
+
+    async def _release_lock(self, item_id: str, owner: str) -> None:
+        # Only our own lease: if it ran out, another worker may hold the lock now.
+        await self.db[LOCKS_COLLECTION].delete_one({"_id": item_id, "owner": owner})
+
+    async def refill_item(self, item: Dict[str, Any]) -> int:
+        """Top the item's pool up to target_size; returns the number of links created."""
+        if not self.enabled or not item.get("is_active", True):
+            return 0
+        fingerprint = item_fingerprint(item)
+        # Cheap check first so a full pool costs no lock write.
+        if await self._missing(item, fingerprint) <= 0:
+            return 0
+        owner = await self._acquire_lock(item["id"])
+        if owner is None:
+            return 0
+        try:
+            # Counted again under the lock: the previous holder may have just
+            # topped the pool up.
+            missing = await self._missing(item, fingerprint)
+            if missing <= 0:
+                return 0
+            results = await asyncio.gather(*(self._create_entry(item, fingerprint) for _ in range(missing)), return_exceptions=True)
+        finally:
+            await self._release_lock(item["id"], owner)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            logging.warning(f"Invoice pool: {len(errors)} of {missing} links for item {item['id']} failed: {errors[0]!r}")
+        created = missing - len(errors)
+        self.links_created += created
+        return created
+
+    async def _missing(self, item: Dict[str, Any], fingerprint: str) -> int:
+        ready = await self.collection.count_documents(
+            {"store_item_id": item["id"], "status": "ready", "fingerprint": fingerprint, "expires_at": {"$gt": datetime.utcnow()}}
+        )
+        return self.target_size - ready
+
+    async def _create_entry(self, item: Dict[str, Any], fingerprint: str) -> None:
+        payload = pool_payload(item["id"])
+        async with self._semaphore:
+            invoice_url = await self.create_link(item, payload)
+        now = datetime.utcnow()
+        await self.collection.insert_one({
+            "_id": payload,
+            "store_item_id": item["id"],
+            "fingerprint": fingerprint,
+            "invoice_url": invoice_url,
+            "status": "ready",
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=self.ttl_seconds),
+        })
+
+    async def refill_all(self, items: Iterable[Dict[str, Any]]) -> int:
+        counts = await asyncio.gather(*(self.refill_item(item) for item in items if item.get("is_active")))
+        return sum(counts)
+
+    async def expire_stale(self, items: Iterable[Dict[str, Any]]) -> int:
+        """Drop ready links that expired or no longer match their item."""
+        now = datetime.utcnow()
+        current = {item["id"]: item_fingerprint(item) for item in items if item.get("is_active")}
+        removed = await self.collection.delete_many({"status": "ready", "$or": [
+            {"expires_at": {"$lte": now}},
+            {"store_item_id": {"$nin": list(current)}},
+            *({"store_item_id": item_id, "fingerprint": {"$ne": fp}} for item_id, fp in current.items()),
+        ]})
+        claimed = await self.collection.delete_many({"status": "claimed", "claimed_at": {"$lte": now - timedelta(seconds=self.ttl_seconds)}})
+        return removed.deleted_count + claimed.deleted_count
+
+    async def _run(self, load_items: Callable[[], Awaitable[List[Dict[str, Any]]]]) -> None:
+        while True:
+            try:
+                items = await load_items()
+                await self.expire_stale(items)
+                await self.refill_all(items)
+            except Exception as e:
+                logging.error(f"Invoice pool maintenance failed: {e!r}")
+            await asyncio.sleep(self.refill_interval)
+
+    def start(self, load_items: Callable[[], Awaitable[List[Dict[str, Any]]]]) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run(load_items))
+
+    async def close(self) -> None:
+        tasks = [t for t in [self._task, *self._refilling.values()] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._refilling = {}
@@ -0,0 +1,159 @@
+"""
+Likes: one document per (post_id, user_id) in the `likes` collection, guarded by
+a unique index so a user can like a post at most once, plus an atomic `$inc` on
+`posts.likes`.
+
+With LIKES_WRITE_BEHIND=1 the `$inc`s go through a LikeCounterBuffer instead: the
+per-user like documents are still written synchronously (they are the source of
+truth for dedup), but counter increments for the same post are coalesced in
+memory and flushed as one bulk_write every LIKES_FLUSH_INTERVAL seconds. A viral
+post then costs one counter write per flush instead of one per like. A failed
+flush puts back only the increments that provably weren't applied (per-op
+errors from a step-down, or no server reachable at all); anything ambiguous is
+dropped and logged rather than risk counting a like twice.
+"""
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ServerSelectionTimeoutError
+
+# Per-operation error codes worth retrying on the next flush: the update was
+# refused by a server that is stepping down or shutting down, not applied.
+RETRYABLE_WRITE_CODES = frozenset({6, 7, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436})
+
+
+class LikeCounterBuffer:
+    def __init__(self, db, flush_interval: float = 0.5, max_pending_posts: int = 10000):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_pending_posts = max_pending_posts
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.flushed_writes = 0
+        self.dropped_writes = 0
+
+    @classmethod
+    def from_env(cls, db) -> "LikeCounterBuffer":
+        return cls(
+            db,
+            flush_interval=float(os.getenv("LIKES_FLUSH_INTERVAL", "0.5")),
+            max_pending_posts=int(os.getenv("LIKES_MAX_PENDING_POSTS", "10000")),
+        )
+
+    def add(self, post_id: str, delta: int) -> None:
+        self._pending[post_id] += delta
+        if len(self._pending) >= self.max_pending_posts and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._flush_logged())
+
+    def pending(self, post_id: str) -> int:
+        return self._pending.get(post_id, 0)
+
+    async def flush(self) -> int:
+        """Write all coalesced increments; returns the number of posts updated."""
+        async with self._lock:
+            batch, self._pending = self._pending, defaultdict(int)
+            deltas = [(post_id, delta) for post_id, delta in batch.items() if delta]
+            ops = [UpdateOne({"id": post_id}, {"$inc": {"likes": delta}}) for post_id, delta in deltas]
+            if not ops:
+                return 0
+            try:
+                await self.db.posts.bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                # Unordered: every op without a write error was applied, so only
+                # the failed ones may go back, or their likes would count twice.
+                failed = {err["index"]: err for err in e.details.get("writeErrors", [])}
+                for index, err in failed.items():
+                    if err.get("code") in RETRYABLE_WRITE_CODES:
+                        self._requeue(*deltas[index])
+                    else:
+                        self._drop(*deltas[index], err.get("errmsg"))
+                self.flushed_writes += len(ops) - len(failed)
+                raise
+            except ServerSelectionTimeoutError:
+                # Nothing reached a server; the whole batch is still to do.
+                for post_id, delta in deltas:
+                    self._requeue(post_id, delta)
+                raise
+            except Exception as e:
+                # Unknown how much was applied; retrying could double count.
+                # posts.likes can be rebuilt from the likes collection.
+                for post_id, delta in deltas:
+                    self._drop(post_id, delta, repr(e))
+                raise
+            self.flushed_writes += len(ops)
+            return len(ops)
+
+    def _requeue(self, post_id: str, delta: int) -> None:
+        self._pending[post_id] += delta
+
+    def _drop(self, post_id: str, delta: int, reason: Optional[str]) -> None:
+        self.dropped_writes += 1
+        logging.error(f"Dropped like counter delta {delta:+d} for post {post_id}: {reason}")
+
+    async def _flush_logged(self) -> None:
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Failed to flush like counters: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logged()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flush_task is not None:
+            await self._flush_task
+            self._flush_task = None
+        await self.flush()
+
+
+async def _bump(db, post_id: str, delta: int, buffer: Optional[LikeCounterBuffer]) -> None:
+    if buffer is not None:
+        buffer.add(post_id, delta)
+    else:
+        await db.posts.update_one({"id": post_id}, {"$inc": {"likes": delta}})
+
+
+async def like_post(db, post_id: str, user_id: str, buffer: Optional[LikeCounterBuffer] = None) -> bool:
+    """Record a like; returns False if this user had already liked the post."""
+    try:
+        await db.likes.insert_one({"post_id": post_id, "user_id": user_id, "created_at": datetime.utcnow()})
+    except DuplicateKeyError:
+        return False
+    await _bump(db, post_id, 1, buffer)
+    return True
+
+
+async def unlike_post(db, post_id: str, user_id: str, buffer: Optional[LikeCounterBuffer] = None) -> bool:
+    """Remove a like; returns False if there was nothing to remove."""
+    result = await db.likes.delete_one({"post_id": post_id, "user_id": user_id})
+    if result.deleted_count == 0:
+        return False
+    await _bump(db, post_id, -1, buffer)
+    return True
+
+
+async def like_count(db, post_id: str, buffer: Optional[LikeCounterBuffer] = None) -> Optional[int]:
+    post = await db.posts.find_one({"id": post_id}, {"_id": 0, "likes": 1})
+    if post is None:
+        return None
+    return post.get("likes", 0) + (buffer.pending(post_id) if buffer else 0)
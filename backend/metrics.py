@@ -0,0 +1,373 @@
+"""
+Process metrics exposed as Prometheus text on /metrics.
+
+Three sources feed the registry:
+- `MetricsMiddleware`: per-route request counts, latency histograms and the
+  number of requests in flight, labelled by the route template ("/api/posts/{post_id}")
+  so path parameters don't explode the label set.
+- `MongoCommandMetrics`: a pymongo CommandListener timing every command per
+  collection and command name. Commands slower than MONGO_SLOW_QUERY_MS are
+  counted separately and logged.
+- `call_telegram_api` in server.py, which counts Bot API calls per method and
+  outcome.
+
+The metric types are deliberately minimal (no prometheus_client dependency):
+recording is a dict lookup, a bisect and a few additions under a lock, since
+Motor runs pymongo - and so the command listener - on executor threads.
+Gauges that describe state owned elsewhere (queue depth, cache counters) are
+read at scrape time through `Registry.add_collector` instead of being pushed on
+every change.
+
+Every uvicorn worker is its own process with its own `REGISTRY`, and a scrape
+lands on whichever worker the kernel hands the connection to. With METRICS_DIR
+set (entrypoint.sh sets it whenever WORKERS > 1), `SharedMetricsDir` has each
+worker write its samples to `<METRICS_DIR>/<pid>.json` every
+METRICS_FLUSH_SECONDS, and `/metrics` renders the merge of all the files, so
+every worker answers with the same totals. Counters and histograms are summed,
+and those of workers that have exited stay in the sum so totals never go
+backwards. Gauges are not summed (each worker holds its own copy of e.g. the
+search index) but get a `worker` label instead, and a worker's gauges are
+dropped once its file is older than three flush intervals. The directory
+is emptied at container start, and a scrape can trail the other workers by up
+to one flush interval.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+# A collector returns (name, type, help, [(labels, value), ...]) families.
+Sample = Tuple[Dict[str, str], float]
+Family = Tuple[str, str, str, List[Sample]]
+# What Registry.collect() returns: histograms need several sample names per family.
+NamedSample = Tuple[str, Dict[str, str], float]
+CollectedFamily = Tuple[str, str, str, List[NamedSample]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in labels.items()]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def collect(self) -> CollectedFamily:
+        return (self.name, self.type_name, self.help, self.samples())
+
+    def samples(self) -> List[NamedSample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> List[NamedSample]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, k)), v) for k, v in items]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> List[NamedSample]:
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        samples = []
+        for values, (counts, total) in items:
+            labels = dict(zip(self.labelnames, values))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                samples.append((f"{self.name}_bucket", {**labels, "le": _number(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def collect(self) -> List[CollectedFamily]:
+        families = [metric.collect() for metric in self._metrics]
+        for collector in self._collectors:
+            try:
+                collected = list(collector())
+            except Exception as e:
+                logging.error(f"Metrics collector {collector!r} failed: {e!r}")
+                continue
+            for name, type_name, help_text, samples in collected:
+                families.append((name, type_name, help_text, [(name, dict(labels), value) for labels, value in samples]))
+        return families
+
+    def render(self) -> str:
+        return render_families(self.collect())
+
+
+def render_families(families: Iterable[CollectedFamily]) -> str:
+    lines: List[str] = []
+    for name, type_name, help_text, samples in families:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {type_name}"]
+        for sample_name, labels, value in samples:
+            lines.append(f"{sample_name}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class SharedMetricsDir:
+    """Merges the registries of all workers through one JSON file per worker in `directory`."""
+
+    def __init__(self, registry: "Registry", directory: str, worker_id: Optional[str] = None, flush_interval: float = 5.0):
+        self.registry = registry
+        self.directory = Path(directory)
+        self.worker_id = worker_id or str(os.getpid())
+        self.flush_interval = flush_interval
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def path(self) -> Path:
+        return self.directory / f"{self.worker_id}.json"
+
+    def flush(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.directory / f".{self.worker_id}.tmp"
+        tmp.write_text(json.dumps(self.registry.collect()))
+        os.replace(tmp, self.path)
+
+    def merged(self) -> List[CollectedFamily]:
+        families: Dict[str, Tuple[str, str, Dict[Tuple[str, str], Tuple[NamedSample, float]]]] = {}
+        stale_before = time.time() - 3 * self.flush_interval
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                live = path == self.path or path.stat().st_mtime >= stale_before
+                collected = json.loads(path.read_text())
+            except (OSError, ValueError) as e:
+                # A worker replaced or removed its file mid-read; it is complete next scrape.
+                logging.warning(f"Skipping metrics file {path.name}: {e!r}")
+                continue
+            for name, type_name, help_text, samples in collected:
+                if type_name == "gauge":
+                    if not live:
+                        continue
+                    samples = [(sample_name, {**labels, "worker": path.stem}, value) for sample_name, labels, value in samples]
+                _, _, merged = families.setdefault(name, (type_name, help_text, {}))
+                for sample_name, labels, value in samples:
+                    key = (sample_name, json.dumps(labels, sort_keys=True))
+                    sample, total = merged.get(key, ((sample_name, labels, 0), 0.0))
+                    merged[key] = (sample, total + value)
+        return [
+            (name, type_name, help_text, [(sample_name, labels, total) for (sample_name, labels, _), total in merged.values()])
+            for name, (type_name, help_text, merged) in families.items()
+        ]
+
+    def render(self) -> str:
+        self.flush()
+        return render_families(self.merged())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logging.error(f"Metrics flush to {self.directory} failed: {e!r}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            self.flush()
+        except OSError as e:
+            logging.error(f"Metrics flush to {self.directory} failed: {e!r}")
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUESTS = REGISTRY.counter("tgwall_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_LATENCY = REGISTRY.histogram("tgwall_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+HTTP_IN_FLIGHT = REGISTRY.gauge("tgwall_http_requests_in_flight", "HTTP requests currently being served.")
+
+MONGO_COMMANDS = REGISTRY.counter("tgwall_mongo_commands_total", "MongoDB commands by collection, command and outcome.", ("collection", "command", "outcome"))
+MONGO_LATENCY = REGISTRY.histogram("tgwall_mongo_command_duration_seconds", "MongoDB command latency.", ("collection", "command"), MONGO_BUCKETS)
+MONGO_SLOW = REGISTRY.counter("tgwall_mongo_slow_commands_total", "MongoDB commands slower than MONGO_SLOW_QUERY_MS.", ("collection", "command"))
+
+TELEGRAM_CALLS = REGISTRY.counter("tgwall_telegram_api_calls_total", "Bot API calls by method and outcome.", ("method", "outcome"))
+TELEGRAM_LATENCY = REGISTRY.histogram("tgwall_telegram_api_duration_seconds", "Bot API call latency, retries included.", ("method",))
+
+RATE_LIMITED = REGISTRY.counter("tgwall_rate_limited_total", "Requests rejected by the rate limiter.", ("route", "scope"))
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware; doesn't wrap the body stream like BaseHTTPMiddleware does.
+
+    Records into this worker's REGISTRY only; see the module docstring for how
+    several workers are merged on /metrics.
+    """
+
+    def __init__(self, app, skip_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            # The router stores the matched route in the (shared) scope, so its
+            # template is available once the app has run.
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method, template, str(status[0]))
+            HTTP_LATENCY.observe(elapsed, method, template)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command; pass it to the client through `event_listeners`."""
+
+    def __init__(self, slow_ms: float = 100.0):
+        self.slow_seconds = slow_ms / 1000.0
+        # request_id -> collection; the collection is only present on the started event.
+        self._pending: Dict[Tuple[int, object], str] = {}
+
+    @classmethod
+    def from_env(cls) -> "MongoCommandMetrics":
+        return cls(slow_ms=float(os.getenv("MONGO_SLOW_QUERY_MS", "100")))
+
+    @staticmethod
+    def _collection(event: monitoring.CommandStartedEvent) -> str:
+        # getMore carries the cursor id under its own name and the collection separately.
+        target = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        return target if isinstance(target, str) else ""
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        self._pending[(event.request_id, event.connection_id)] = self._collection(event)
+
+    def _finish(self, event, outcome: str) -> None:
+        collection = self._pending.pop((event.request_id, event.connection_id), "")
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMANDS.inc(collection, event.command_name, outcome)
+        MONGO_LATENCY.observe(seconds, collection, event.command_name)
+        if seconds >= self.slow_seconds:
+            MONGO_SLOW.inc(collection, event.command_name)
+            logging.warning(f"Slow MongoDB {event.command_name} on {collection or '-'}: {seconds * 1000:.1f} ms ({outcome})")
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, "ok")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, "error")
@@ -0,0 +1,429 @@
+"""
+Versioned index/migration runner for the collections used by server.py.
+
+Each migration is an async function registered with `@migration(version, description)`.
+Applied versions are recorded in the `schema_migrations` collection, so reruns
+only apply what is new; the index builders themselves are idempotent as well.
+A migration that fails is not recorded and the runner stops there, so the next
+run retries it before anything later.
+
+Runs at startup (unless RUN_MIGRATIONS_ON_STARTUP=0) or from the CLI:
+
+    python migrations.py migrate   # apply pending migrations
+    python migrations.py status    # list applied / pending versions
+    python migrations.py stats     # $indexStats usage counters per collection
+"""
+import asyncio
+import logging
+import sys
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from comments import COMMENT_PREVIEW_COUNT
+
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[Any], Awaitable[None]]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    def register(fn: Callable[[Any], Awaitable[None]]):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append(Migration(version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+    return register
+
+
+class MigrationError(RuntimeError):
+    """A migration can't proceed without manual intervention; nothing was recorded."""
+
+
+async def duplicate_groups(collection, key: str, sort_field: str = "created_at") -> List[Dict[str, Any]]:
+    """Groups of documents sharing `key`, each listing `_id`s oldest first."""
+    pipeline = [
+        {"$match": {key: {"$exists": True}}},
+        {"$sort": {sort_field: ASCENDING, "_id": ASCENDING}},
+        {"$group": {"_id": f"${key}", "docs": {"$push": {"_id": "$_id", "id": "$id"}}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    return await collection.aggregate(pipeline).to_list(length=None)
+
+
+async def require_unique(collection, key: str) -> None:
+    groups = await duplicate_groups(collection, key)
+    if groups:
+        sample = ", ".join(repr(g["_id"]) for g in groups[:5])
+        raise MigrationError(
+            f"{collection.name} has {len(groups)} duplicated {key} values (e.g. {sample}); "
+            f"remove the duplicates before the unique index on {key} can be built."
+        )
+
+
+async def merge_duplicate_users(db) -> int:
+    """
+    Concurrent first logins before the telegram_id index existed could create
+    several users for one Telegram account. Keep the oldest, point the others'
+    posts, payments and inventory at it and delete them. Returns users removed.
+    """
+    removed = 0
+    for group in await duplicate_groups(db.users, "telegram_id"):
+        keeper, *dupes = [doc["id"] for doc in group["docs"]]
+        await db.posts.update_many({"user_id": {"$in": dupes}}, {"$set": {"user_id": keeper}})
+        await db.payment_transactions.update_many({"user_profile_id": {"$in": dupes}}, {"$set": {"user_profile_id": keeper}})
+        await db.user_inventory.update_many({"user_profile_id": {"$in": dupes}}, {"$set": {"user_profile_id": keeper}})
+        removed += (await db.users.delete_many({"_id": {"$in": [doc["_id"] for doc in group["docs"][1:]]}})).deleted_count
+        logging.warning(f"Merged {len(dupes)} duplicate user(s) for telegram_id {group['_id']} into {keeper}")
+    return removed
+
+
+# --- Migrations ---
+@migration(1, "Initial indexes for users, posts, store_items, payment_transactions, user_inventory")
+async def initial_indexes(db):
+    # Unique index builds fail on existing duplicates. Duplicate users are a
+    # known result of the old login race and are merged; anything else is
+    # reported instead of guessed at.
+    await merge_duplicate_users(db)
+    for collection, key in ((db.users, "id"), (db.posts, "id"), (db.store_items, "id"),
+                            (db.payment_transactions, "invoice_payload"), (db.payment_transactions, "id")):
+        await require_unique(collection, key)
+    await db.users.create_indexes([
+        IndexModel([("telegram_id", ASCENDING)], unique=True, name="telegram_id_unique"),
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ])
+    await db.posts.create_indexes([
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_wall"),
+    ])
+    await db.store_items.create_indexes([
+        # Serves find_one({"id": ..., "is_active": True}) as well.
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ])
+    await db.payment_transactions.create_indexes([
+        # PaymentTransaction.invoice_payload's Field(unique=True) is only schema
+        # metadata; this is what actually enforces it. Being unique, it also
+        # serves the webhook's {"invoice_payload", "status": "pending"} lookups.
+        IndexModel([("invoice_payload", ASCENDING)], unique=True, name="invoice_payload_unique"),
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ])
+    await db.user_inventory.create_indexes([
+        IndexModel([("user_profile_id", ASCENDING), ("purchase_date", DESCENDING)], name="user_purchases"),
+    ])
+
+
+@migration(2, "Move embedded post comments into the comments collection")
+async def split_comments(db):
+    await db.comments.create_indexes([
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("post_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="post_thread"),
+    ])
+    # Resumable: posts already carrying comment_count were migrated (or created
+    # after the split) and are skipped.
+    cursor = db.posts.find({"comment_count": {"$exists": False}}, {"_id": 0, "id": 1, "comments": 1, "created_at": 1})
+    comment_ops, post_ops = [], []
+    async for post in cursor:
+        embedded = post.get("comments") or []
+        previews = []
+        for raw in embedded:
+            comment = {
+                "id": raw.get("id") or str(uuid.uuid4()),
+                "post_id": post["id"],
+                "user_id": raw.get("user_id"),
+                "text": raw.get("text") or raw.get("content") or "",
+                "created_at": raw.get("created_at") or post.get("created_at") or datetime.utcnow(),
+            }
+            comment_ops.append(UpdateOne({"id": comment["id"]}, {"$setOnInsert": comment}, upsert=True))
+            # The default preview size: migrations get no Settings, and the next
+            # add_comment re-caps the preview at the configured size anyway.
+            if len(previews) < COMMENT_PREVIEW_COUNT:
+                previews.append(comment)
+        post_ops.append(UpdateOne({"id": post["id"]}, {"$set": {"comment_count": len(embedded), "comments": previews}}))
+        if len(post_ops) >= 500:
+            if comment_ops:
+                await db.comments.bulk_write(comment_ops, ordered=False)
+            await db.posts.bulk_write(post_ops, ordered=False)
+            comment_ops, post_ops = [], []
+    if comment_ops:
+        await db.comments.bulk_write(comment_ops, ordered=False)
+    if post_ops:
+        await db.posts.bulk_write(post_ops, ordered=False)
+
+
+@migration(3, "Unique (post_id, user_id) index on likes")
+async def likes_indexes(db):
+    await db.likes.create_indexes([
+        IndexModel([("post_id", ASCENDING), ("user_id", ASCENDING)], unique=True, name="post_user_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_likes"),
+    ])
+
+
+@migration(4, "Webhook update queue indexes")
+async def webhook_queue_indexes(db):
+    await db.webhook_updates.create_indexes([
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="claim_order"),
+        IndexModel([("status", ASCENDING), ("locked_until", ASCENDING)], name="expired_leases"),
+        # Processed updates are kept for a day for debugging, then dropped.
+        IndexModel([("completed_at", ASCENDING)], expireAfterSeconds=86400, name="completed_ttl"),
+    ])
+    await db.webhook_dead_letters.create_indexes([
+        IndexModel([("failed_at", DESCENDING)], name="failed_at"),
+    ])
+
+
+@migration(5, "Unique payment charge / update ids for idempotent fulfillment")
+async def payment_idempotency_indexes(db):
+    await db.payment_transactions.create_indexes([
+        IndexModel(
+            [("telegram_payment_charge_id", ASCENDING)], unique=True, name="charge_id_unique",
+            partialFilterExpression={"telegram_payment_charge_id": {"$type": "string"}},
+        ),
+        IndexModel(
+            [("update_id", ASCENDING)], unique=True, name="update_id_unique",
+            partialFilterExpression={"update_id": {"$type": "number"}},
+        ),
+    ])
+    await db.user_inventory.create_indexes([
+        IndexModel([("telegram_payment_charge_id", ASCENDING)], unique=True, name="charge_id_unique"),
+    ])
+
+
+@migration(6, "Invoice link pool and pending transaction expiry")
+async def invoice_pool_indexes(db):
+    await db.invoice_pool.create_indexes([
+        IndexModel(
+            [("store_item_id", ASCENDING), ("status", ASCENDING), ("fingerprint", ASCENDING), ("created_at", ASCENDING)],
+            name="claim_order",
+        ),
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expiry"),
+    ])
+    await db.payment_transactions.create_indexes([
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created"),
+    ])
+
+
+@migration(7, "Partial pending index and payment archive")
+async def payment_reaper_indexes(db):
+    # The expiry sweep only looks at pending transactions; a partial index keeps
+    # it proportional to the pending set instead of the whole history.
+    if "status_created" in await db.payment_transactions.index_information():
+        await db.payment_transactions.drop_index("status_created")
+    await db.payment_transactions.create_indexes([
+        IndexModel(
+            [("created_at", ASCENDING)], name="pending_by_age",
+            partialFilterExpression={"status": "pending"},
+        ),
+        IndexModel([("status", ASCENDING), ("updated_at", ASCENDING)], name="status_updated"),
+    ])
+    await db.payment_transactions_archive.create_indexes([
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_profile_id", ASCENDING), ("created_at", DESCENDING)], name="user_history"),
+    ])
+
+
+@migration(8, "Inventory listing and entitlement indexes")
+async def inventory_indexes(db):
+    # (user_profile_id, purchase_date, id) supersedes user_purchases and gives the
+    # inventory listing a keyset tie-breaker; (user_profile_id, store_item_id)
+    # covers the entitlement `distinct`.
+    await db.user_inventory.create_indexes([
+        IndexModel(
+            [("user_profile_id", ASCENDING), ("purchase_date", DESCENDING), ("id", DESCENDING)],
+            name="user_purchases_keyset",
+        ),
+        IndexModel([("user_profile_id", ASCENDING), ("store_item_id", ASCENDING)], name="user_items"),
+    ])
+    if "user_purchases" in await db.user_inventory.index_information():
+        await db.user_inventory.drop_index("user_purchases")
+
+
+@migration(9, "Follow graph, home timelines and feed fan-out queue")
+async def feed_indexes(db):
+    await db.follows.create_indexes([
+        IndexModel([("follower_id", ASCENDING), ("followee_id", ASCENDING)], unique=True, name="follower_followee_unique"),
+        # Fan-out walks a user's followers.
+        IndexModel([("followee_id", ASCENDING), ("follower_id", ASCENDING)], name="followers"),
+    ])
+    await db.users.create_indexes([
+        IndexModel(
+            [("follower_count", ASCENDING)], name="follower_count",
+            partialFilterExpression={"follower_count": {"$gt": 0}},
+        ),
+    ])
+    await db.feed_fanout_jobs.create_indexes([
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="claim_order"),
+        IndexModel([("status", ASCENDING), ("locked_until", ASCENDING)], name="expired_leases"),
+        IndexModel([("completed_at", ASCENDING)], expireAfterSeconds=86400, name="completed_ttl"),
+    ])
+    await db.feed_fanout_dead_letters.create_indexes([
+        IndexModel([("failed_at", DESCENDING)], name="failed_at"),
+    ])
+
+
+@migration(10, "users.updated_at for incremental search index sync")
+async def user_search_indexes(db):
+    await db.users.create_indexes([
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ])
+
+
+@migration(11, "rate_limits TTL for idle token buckets")
+async def rate_limit_indexes(db):
+    await db.rate_limits.create_indexes([
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_ttl"),
+    ])
+
+
+@migration(12, "gifts receiver timeline and per-sender idempotency keys")
+async def gift_indexes(db):
+    await db.gifts.create_indexes([
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel(
+            [("receiver_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="receiver_timeline",
+        ),
+        IndexModel([("sender_id", ASCENDING), ("client_ref", ASCENDING)], unique=True, name="sender_client_ref"),
+    ])
+
+
+@migration(13, "stars ledger indexes; opening ledger entries for existing users.stars_balance")
+async def stars_ledger_setup(db):
+    await db.stars_ledger.create_indexes([
+        IndexModel([("user_id", ASCENDING), ("seq", ASCENDING)], unique=True, name="user_seq_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_history"),
+    ])
+    await db.stars_accounts.create_indexes([
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ])
+    # Balances kept on the user document so far become each account's first
+    # entry. Accounts are only created if missing, and the (user_id, seq) index
+    # turns a rerun's entries into duplicates, so this is safe to repeat.
+    now = datetime.utcnow()
+    batch = []
+    async for user in db.users.find({"stars_balance": {"$gt": 0}}, {"_id": 0, "id": 1, "stars_balance": 1}):
+        entry = {
+            "id": str(uuid.uuid4()), "user_id": user["id"], "seq": 1, "delta": user["stars_balance"],
+            "balance_after": user["stars_balance"], "reason": "opening_balance", "ref": None, "created_at": now,
+        }
+        batch.append(entry)
+        if len(batch) >= 1000:
+            await _open_stars_accounts(db, batch)
+            batch = []
+    await _open_stars_accounts(db, batch)
+
+
+async def _open_stars_accounts(db, entries) -> None:
+    if not entries:
+        return
+    await db.stars_accounts.bulk_write([
+        UpdateOne(
+            {"_id": e["user_id"]},
+            {"$setOnInsert": {"balance": e["delta"], "seq": 1, "updated_at": e["created_at"], "last_entry": e}},
+            upsert=True,
+        )
+        for e in entries
+    ], ordered=False)
+    try:
+        await db.stars_ledger.insert_many([dict(e) for e in entries], ordered=False)
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+
+# --- Runner ---
+async def applied_versions(db) -> Dict[int, Dict[str, Any]]:
+    docs = await db[MIGRATIONS_COLLECTION].find({}).to_list(length=None)
+    return {doc["_id"]: doc for doc in docs}
+
+
+async def run_migrations(db) -> List[int]:
+    """Apply pending migrations in version order and return the versions applied."""
+    done = await applied_versions(db)
+    applied = []
+    for m in MIGRATIONS:
+        if m.version in done:
+            continue
+        logging.info(f"Applying migration {m.version}: {m.description}")
+        await m.apply(db)
+        await db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": m.version},
+            {"$set": {"description": m.description, "applied_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        applied.append(m.version)
+    return applied
+
+
+async def migration_status(db) -> List[Dict[str, Any]]:
+    done = await applied_versions(db)
+    return [
+        {
+            "version": m.version,
+            "description": m.description,
+            "applied_at": done[m.version]["applied_at"] if m.version in done else None,
+        }
+        for m in MIGRATIONS
+    ]
+
+
+async def index_usage_stats(db) -> Dict[str, List[Dict[str, Any]]]:
+    """Per-collection `$indexStats` (operations served by each index since `since`)."""
+    stats = {}
+    for name in sorted(await db.list_collection_names()):
+        if name.startswith("system."):
+            continue
+        rows = await db[name].aggregate([{"$indexStats": {}}]).to_list(length=None)
+        stats[name] = [
+            {"index": row["name"], "ops": row["accesses"]["ops"], "since": row["accesses"]["since"]}
+            for row in rows
+        ]
+    return stats
+
+
+async def _cli(command: str) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from settings import Settings, load_env_file
+
+    load_env_file(Path(__file__).parent / ".env")
+    settings = Settings.from_env()
+    client = AsyncIOMotorClient(settings.mongo_url)
+    db = client[settings.db_name]
+    try:
+        if command == "migrate":
+            applied = await run_migrations(db)
+            print(f"Applied migrations: {applied or 'none (up to date)'}")
+        elif command == "status":
+            for row in await migration_status(db):
+                state = f"applied {row['applied_at']:%Y-%m-%d %H:%M:%S}" if row["applied_at"] else "pending"
+                print(f"{row['version']:>4}  {state:<28} {row['description']}")
+        elif command == "stats":
+            for collection, rows in (await index_usage_stats(db)).items():
+                print(collection)
+                for row in rows:
+                    print(f"    {row['index']:<32} ops={row['ops']:<10} since={row['since']}")
+        else:
+            print(__doc__)
+            return 2
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_cli(sys.argv[1] if len(sys.argv) > 1 else "")))
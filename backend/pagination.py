@@ -0,0 +1,91 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, doc_id: str) -> str:
+    """Opaque keyset cursor pointing at the last document of a page."""
+    raw = json.dumps({"t": created_at.isoformat(), "i": doc_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(data["t"]), str(data["i"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f"Malformed cursor: {cursor!r}") from e
+
+
+def keyset_filter(base_filter: Dict[str, Any], cursor: Optional[str], ascending: bool = False,
+                  time_field: str = "created_at") -> Dict[str, Any]:
+    """
+    Extend `base_filter` so it only matches documents strictly after `cursor` in
+    (time_field, id) order (descending unless `ascending`). Paired with a compound
+    index ending in (time_field, id) this is an index range scan whatever the
+    page depth.
+    """
+    if not cursor:
+        return base_filter
+    created_at, doc_id = decode_cursor(cursor)
+    op = "$gt" if ascending else "$lt"
+    return {
+        **base_filter,
+        "$or": [
+            {time_field: {op: created_at}},
+            {time_field: created_at, "id": {op: doc_id}},
+        ],
+    }
+
+
+def keyset_sort(ascending: bool = False, time_field: str = "created_at") -> List[Tuple[str, int]]:
+    direction = 1 if ascending else -1
+    return [(time_field, direction), ("id", direction)]
+
+
+KEYSET_SORT = keyset_sort()
+KEYSET_SORT_ASC = keyset_sort(ascending=True)
+
+
+def clamp_page_size(limit: Optional[int]) -> int:
+    if not limit:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def build_projection(fields: Optional[str], allowed: List[str], always: List[str]) -> Dict[str, int]:
+    """Turn a comma separated `fields` query parameter into a Mongo projection."""
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in allowed]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    else:
+        requested = list(allowed)
+    projection = {name: 1 for name in always + requested}
+    projection["_id"] = 0
+    return projection
+
+
+async def fetch_page(collection, base_filter: Dict[str, Any], cursor: Optional[str], limit: int,
+                     projection: Optional[Dict[str, int]] = None,
+                     ascending: bool = False,
+                     time_field: str = "created_at") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Run one keyset query and return (documents, next_cursor)."""
+    query = collection.find(keyset_filter(base_filter, cursor, ascending, time_field), projection)
+    docs = await query.sort(keyset_sort(ascending, time_field)).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last[time_field], last["id"])
+    return docs, next_cursor
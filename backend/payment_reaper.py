@@ -0,0 +1,163 @@
+"""
+Scheduled maintenance for `payment_transactions`.
+
+Every checkout inserts a `pending` transaction, and abandoned ones used to stay
+pending forever. The reaper keeps the hot set small:
+
+* pending transactions older than PENDING_TRANSACTION_TTL_SECONDS are marked
+  `expired` (pre-checkout then refuses them; a payment that already passed
+  pre-checkout is still fulfilled);
+* completed / failed / expired transactions untouched for PAYMENT_ARCHIVE_AFTER_DAYS
+  are moved to `payment_transactions_archive` in batches. Completed transactions
+  whose inventory grant has not landed yet are left alone.
+
+Archiving copies a batch with upserts and only then deletes it, so a crash in
+between just repeats the batch on the next run. Runs every
+PAYMENT_REAPER_INTERVAL_SECONDS in each worker (all steps are idempotent), or once
+from the CLI:
+
+    python payment_reaper.py run
+"""
+import asyncio
+import logging
+import os
+import sys
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from pymongo import ReplaceOne
+
+ARCHIVE_COLLECTION = "payment_transactions_archive"
+ARCHIVABLE_STATUSES = ["completed", "failed", "expired"]
+
+
+@dataclass
+class ReaperStats:
+    runs: int = 0
+    expired: int = 0
+    archived: int = 0
+    errors: int = 0
+    last_run_at: Optional[datetime] = None
+
+
+class PaymentReaper:
+    def __init__(
+        self,
+        db,
+        pending_ttl_seconds: float = 3600,
+        archive_after_days: float = 30,
+        batch_size: int = 500,
+        interval: float = 300.0,
+    ):
+        self.db = db
+        self.pending_ttl_seconds = pending_ttl_seconds
+        self.archive_after_days = archive_after_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.stats = ReaperStats()
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, db) -> "PaymentReaper":
+        return cls(
+            db,
+            pending_ttl_seconds=float(os.getenv("PENDING_TRANSACTION_TTL_SECONDS", "3600")),
+            archive_after_days=float(os.getenv("PAYMENT_ARCHIVE_AFTER_DAYS", "30")),
+            batch_size=int(os.getenv("PAYMENT_REAPER_BATCH_SIZE", "500")),
+            interval=float(os.getenv("PAYMENT_REAPER_INTERVAL_SECONDS", "300")),
+        )
+
+    async def expire_pending(self) -> int:
+        now = datetime.utcnow()
+        result = await self.db.payment_transactions.update_many(
+            {"status": "pending", "created_at": {"$lte": now - timedelta(seconds=self.pending_ttl_seconds)}},
+            {"$set": {"status": "expired", "updated_at": now}},
+        )
+        self.stats.expired += result.modified_count
+        return result.modified_count
+
+    async def archive(self) -> int:
+        """Move old finished transactions to the archive; returns how many moved."""
+        cutoff = datetime.utcnow() - timedelta(days=self.archive_after_days)
+        query = {
+            "status": {"$in": ARCHIVABLE_STATUSES},
+            "updated_at": {"$lte": cutoff},
+            "$or": [{"status": {"$ne": "completed"}}, {"inventory_granted": {"$ne": False}}],
+        }
+        moved = 0
+        while True:
+            batch = await self.db.payment_transactions.find(query).limit(self.batch_size).to_list(length=self.batch_size)
+            if not batch:
+                return moved
+            archived_at = datetime.utcnow()
+            await self.db[ARCHIVE_COLLECTION].bulk_write(
+                [ReplaceOne({"_id": doc["_id"]}, {**doc, "archived_at": archived_at}, upsert=True) for doc in batch],
+                ordered=False,
+            )
+            result = await self.db.payment_transactions.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}, **query})
+            moved += result.deleted_count
+            self.stats.archived += result.deleted_count
+            if len(batch) < self.batch_size:
+                return moved
+
+    async def run_once(self) -> Dict[str, int]:
+        expired = await self.expire_pending()
+        archived = await self.archive()
+        self.stats.runs += 1
+        self.stats.last_run_at = datetime.utcnow()
+        if expired or archived:
+            logging.info(f"Payment reaper: expired {expired} pending, archived {archived} transactions.")
+        return {"expired": expired, "archived": archived}
+
+    def stats_snapshot(self) -> Dict[str, Any]:
+        return asdict(self.stats)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.stats.errors += 1
+                logging.error(f"Payment reaper run failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def _cli(command: str) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from settings import Settings, load_env_file
+
+    load_env_file(Path(__file__).parent / ".env")
+    settings = Settings.from_env()
+    client = AsyncIOMotorClient(settings.mongo_url)
+    db = client[settings.db_name]
+    try:
+        if command == "run":
+            result = await PaymentReaper.from_env(db).run_once()
+            print(f"Expired {result['expired']} pending, archived {result['archived']} transactions")
+        else:
+            print(__doc__)
+            return 2
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_cli(sys.argv[1] if len(sys.argv) > 1 else "")))
@@ -0,0 +1,171 @@
+"""
+Token-bucket rate limiting for expensive writes (post creation, invoice links).
+
+Each route has a budget "capacity/seconds": a bucket holds up to `capacity`
+tokens, refills at capacity/seconds tokens per second and every request takes
+one. A request is checked against two buckets, one keyed by the authenticated
+user and a looser one keyed by client IP (many accounts behind one address).
+Budgets come from RATE_LIMIT_<ROUTE> and RATE_LIMIT_<ROUTE>_IP; "0" or "off"
+disables that bucket.
+
+Backends:
+* `MemoryRateLimitBackend` (default): per-worker, no I/O. With N uvicorn workers
+  a client effectively gets up to N times the budget.
+* `MongoRateLimitBackend` (RATE_LIMIT_BACKEND=mongo): one `rate_limits` document
+  per bucket, refilled and debited by a single pipeline find_one_and_update so
+  all workers share the budget. Idle buckets are removed by a TTL index. If Mongo
+  errors the request is let through (failing open) rather than taking writes down.
+"""
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+RATE_LIMITS_COLLECTION = "rate_limits"
+
+
+@dataclass(frozen=True)
+class Budget:
+    capacity: float
+    per_seconds: float
+
+    @property
+    def refill_rate(self) -> float:
+        return self.capacity / self.per_seconds
+
+    @classmethod
+    def parse(cls, spec: Optional[str]) -> Optional["Budget"]:
+        """"10/60" -> 10 requests per 60 seconds; "", "0" or "off" -> no limit."""
+        if not spec or spec.strip().lower() in ("0", "off", "none"):
+            return None
+        capacity, _, seconds = spec.partition("/")
+        budget = cls(float(capacity), float(seconds or 1))
+        if budget.capacity <= 0 or budget.per_seconds <= 0:
+            raise ValueError(f"Invalid rate limit budget: {spec!r}")
+        return budget
+
+
+@dataclass(frozen=True)
+class Decision:
+    allowed: bool
+    remaining: float
+    retry_after: float = 0.0
+    scope: Optional[str] = None
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def _decide(tokens: float, budget: Budget, cost: float) -> Decision:
+    if tokens >= cost:
+        return Decision(True, tokens - cost)
+    return Decision(False, tokens, (cost - tokens) / budget.refill_rate)
+
+
+class MemoryRateLimitBackend:
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, budget: Budget, cost: float = 1.0) -> Decision:
+        now = time.monotonic()
+        entry = self._buckets.get(key)
+        if entry is None:
+            tokens = budget.capacity
+        else:
+            tokens = min(budget.capacity, entry[0] + (now - entry[1]) * budget.refill_rate)
+        decision = _decide(tokens, budget, cost)
+        self._buckets[key] = (tokens - cost if decision.allowed else tokens, now)
+        self._buckets.move_to_end(key)
+        # Evicting the least recently used bucket only ever forgives a client.
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return decision
+
+
+class MongoRateLimitBackend:
+    def __init__(self, db, idle_ttl_seconds: float = 3600.0):
+        self.db = db
+        self.idle_ttl_seconds = idle_ttl_seconds
+
+    @property
+    def collection(self):
+        return self.db[RATE_LIMITS_COLLECTION]
+
+    def _pipeline(self, budget: Budget, cost: float, now: datetime):
+        elapsed_seconds = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$add": [{"$ifNull": ["$tokens", budget.capacity]}, {"$multiply": [elapsed_seconds, budget.refill_rate]}]}
+        return [
+            {"$set": {"tokens": {"$min": [budget.capacity, {"$max": [0, refilled]}]}}},
+            {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+            {"$set": {
+                "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                "updated_at": now,
+                "expires_at": now + timedelta(seconds=max(self.idle_ttl_seconds, budget.per_seconds)),
+            }},
+        ]
+
+    async def take(self, key: str, budget: Budget, cost: float = 1.0) -> Decision:
+        for attempt in range(2):
+            try:
+                doc = await self.collection.find_one_and_update(
+                    {"_id": key}, self._pipeline(budget, cost, datetime.utcnow()),
+                    projection={"tokens": 1, "allowed": 1}, upsert=True, return_document=ReturnDocument.AFTER,
+                )
+            except DuplicateKeyError:
+                # Two workers created the same bucket at once; the loser retries as an update.
+                if attempt:
+                    raise
+                continue
+            if doc["allowed"]:
+                return Decision(True, doc["tokens"])
+            return Decision(False, doc["tokens"], (cost - doc["tokens"]) / budget.refill_rate)
+
+
+class RateLimiter:
+    def __init__(self, backend, budgets: Dict[str, Tuple[Optional[Budget], Optional[Budget]]], enabled: bool = True):
+        self.backend = backend
+        # route -> (per-user budget, per-IP budget)
+        self.budgets = budgets
+        self.enabled = enabled
+
+    @classmethod
+    def from_env(cls, db, defaults: Dict[str, Tuple[str, str]]) -> "RateLimiter":
+        budgets = {
+            route: (
+                Budget.parse(os.getenv(f"RATE_LIMIT_{route.upper()}", user_default)),
+                Budget.parse(os.getenv(f"RATE_LIMIT_{route.upper()}_IP", ip_default)),
+            )
+            for route, (user_default, ip_default) in defaults.items()
+        }
+        if os.getenv("RATE_LIMIT_BACKEND", "memory") == "mongo":
+            backend = MongoRateLimitBackend(db, idle_ttl_seconds=float(os.getenv("RATE_LIMIT_IDLE_TTL_SECONDS", "3600")))
+        else:
+            backend = MemoryRateLimitBackend(max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+        return cls(backend, budgets, enabled=os.getenv("RATE_LIMIT_ENABLED", "1") != "0")
+
+    async def check(self, route: str, user_id: Optional[str], client_ip: Optional[str], cost: float = 1.0) -> Decision:
+        """Take from the route's user bucket, then its IP bucket; the first denial wins."""
+        user_budget, ip_budget = self.budgets.get(route, (None, None))
+        decision = Decision(True, math.inf)
+        if not self.enabled:
+            return decision
+        for scope, ident, budget in (("user", user_id, user_budget), ("ip", client_ip, ip_budget)):
+            if budget is None or not ident:
+                continue
+            try:
+                decision = await self.backend.take(f"{route}:{scope}:{ident}", budget, cost)
+            except PyMongoError as e:
+                logging.error(f"Rate limiter backend failed for {route}:{scope}, allowing request: {e!r}")
+                continue
+            if not decision.allowed:
+                return replace(decision, scope=scope)
+        return decision
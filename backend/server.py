@@ -1,46 +1,54 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Body, Request
-from dotenv import load_dotenv
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Body, Request, Query, Header
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import os
+import asyncio
 import logging
+from contextlib import asynccontextmanager
+from functools import partial
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import uuid
+import time
 from datetime import datetime
 import json
+import hmac
 import httpx # For making requests to Telegram Bot API
 
 # Import the new validation utility
-from auth_utils import validate_init_data
+from auth_utils import decode_session_token, issue_session_token, session_secret, validate_init_data
+from pagination import MAX_PAGE_SIZE, InvalidCursor, build_projection, clamp_page_size, fetch_page
+from migrations import run_migrations
+from comments import add_comment
+from catalog_cache import CatalogCache
+from webhook_queue import WebhookQueue
+from invoice_pool import InvoicePool
+from payment_reaper import PaymentReaper
+from entitlements import EntitlementService
+from feed import FeedService
+from user_search import InvalidSearchCursor, UserSearchIndex, decode_offset, encode_offset
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, RATE_LIMITED, REGISTRY, TELEGRAM_CALLS, TELEGRAM_LATENCY, MetricsMiddleware, MongoCommandMetrics, SharedMetricsDir
+from rate_limit import RateLimiter
+from gifts import gift_price, send_gifts
+from fast_json import DocumentShape, FastJSONResponse, page_response
+from stars_ledger import ENTRY_FIELDS, InsufficientStars, StarsLedger, StarsSnapshotter
+from likes import LikeCounterBuffer, like_count, like_post, unlike_post
+from image_pipeline import FULL_VARIANT, ImagePipeline, ImageRejected
+from blob_store import BLOB_KEY_RE, BlobError, BlobStore, blob_store_from_env, blob_url, decode_data_url, parse_range_header
+from external_integrations.telegram_bot_api import TelegramAPIError, TelegramBotAPIClient, TelegramClientConfig
+from settings import Settings, load_env_file
 
-# Root directory and env
 ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / ".env")
-
-# Debug: Log environment variables after loading .env
-logging.basicConfig(level=logging.INFO) # Ensure logging is configured
-logging.info(f"[DEBUG_ENV] TELEGRAM_BOT_TOKEN from os.getenv: {os.getenv('TELEGRAM_BOT_TOKEN')}")
-logging.info(f"[DEBUG_ENV] MONGO_URL from os.getenv: {os.getenv('MONGO_URL')}")
-
-# MongoDB connection
-mongo_url = os.getenv("MONGO_URL")
-if not mongo_url:
-    logging.error("MONGO_URL not set in environment variables")
-    # For now, we proceed, but it will fail if mongo_url is truly needed and not set
-
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.getenv("DB_NAME", "telewall_db")]
-
-# Create the main app without a prefix
-app = FastAPI()
 
 # Routers
 api_router = APIRouter(prefix="/api")
 auth_router = APIRouter(prefix="/api/auth")
 payments_router = APIRouter(prefix="/api/payments") # New router for payments
+root_router = APIRouter()
 
 # --- Pydantic Models ---
 class TelegramUserFromInitData(BaseModel):
@@ -54,6 +62,10 @@ class TelegramUserFromInitData(BaseModel):
 class InitDataRequest(BaseModel):
     init_data_str: str
 
+class SessionUser(BaseModel):
+    user_id: str # Internal UserProfile.id
+    telegram_id: str
+
 class UserPrivacy(BaseModel):
     wall_visibility: str = Field(default="all", pattern="^(all|friends|nobody)$")
     can_post: str = Field(default="all", pattern="^(all|friends|nobody)$")
@@ -66,10 +78,16 @@ class UserProfile(BaseModel):
     photo_url: Optional[str] = None
     description: Optional[str] = None
     privacy: UserPrivacy = Field(default_factory=UserPrivacy)
-    stars_balance: int = Field(default=0) # User's balance of stars (managed by app logic, not directly by TG Stars API for user balance)
+    stars_balance: int = Field(default=0) # Last snapshot of the user's stars_accounts balance (see stars_ledger.py)
+    follower_count: int = 0
+    following_count: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class TelegramLoginResponse(UserProfile):
+    session_token: str # Send as `Authorization: Bearer <token>` on later requests
+    session_expires_at: datetime
+
 class UserProfileCreate(BaseModel):
     telegram_id: str
     username: Optional[str] = None
@@ -87,11 +105,75 @@ class PostCreate(PostBase):
 class Post(PostBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str # This is the internal UserProfile.id
+    blob_key: Optional[str] = None # Set for image/drawing posts; content then holds the blob URL
+    variants: Optional[Dict[str, str]] = None # Variant name (full, thumb, small, ...) -> blob URL
     likes: int = 0
-    comments: List[Dict[str, Any]] = Field(default_factory=list)
+    comment_count: int = 0
+    comments: List[Dict[str, Any]] = Field(default_factory=list) # First Settings.comment_preview_count comments only
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class CommentCreate(BaseModel):
+    user_id: str # Internal UserProfile.id
+    text: str = Field(min_length=1, max_length=2000)
+
+class Comment(CommentCreate):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    post_id: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CommentPage(BaseModel):
+    items: List[Comment]
+    next_cursor: Optional[str] = None
+
+# Fields a wall page may project. `id` and `created_at` are always returned
+# because the keyset cursor is built from them.
+WALL_POST_FIELDS = ["user_id", "type", "content", "blob_key", "variants", "likes", "comment_count", "comments", "updated_at"]
+WALL_POST_ALWAYS = ["id", "created_at"]
+
+class WallPost(BaseModel):
+    id: str
+    created_at: datetime
+    user_id: Optional[str] = None
+    type: Optional[str] = None
+    content: Optional[str] = None
+    blob_key: Optional[str] = None
+    variants: Optional[Dict[str, str]] = None
+    likes: Optional[int] = None
+    comment_count: Optional[int] = None
+    comments: Optional[List[Dict[str, Any]]] = None
+    updated_at: Optional[datetime] = None
+
+class WallPage(BaseModel):
+    items: List[WallPost]
+    next_cursor: Optional[str] = None
+
+class LikeResponse(BaseModel):
+    post_id: str
+    liked: bool
+    changed: bool # False if the like/unlike was a no-op
+    likes: int
+
+class FollowResponse(BaseModel):
+    user_id: str # The followed user
+    following: bool
+    changed: bool # False if the follow/unfollow was a no-op
+
+class UserSearchResult(BaseModel):
+    id: str
+    name: str
+    username: Optional[str] = None
+    photo_url: Optional[str] = None
+    follower_count: int = 0
+
+class UserSearchPage(BaseModel):
+    items: List[UserSearchResult]
+    next_cursor: Optional[str] = None
+
+class FeedPage(BaseModel):
+    items: List[Post]
+    next_cursor: Optional[str] = None
+
 class GiftBase(BaseModel):
     type: str
     message: Optional[str] = None
@@ -99,14 +181,55 @@ class GiftBase(BaseModel):
 class GiftCreate(GiftBase):
     sender_id: str # Internal UserProfile.id
     receiver_id: str # Internal UserProfile.id
+    client_ref: Optional[str] = None # Idempotency key: a retry with the same key neither resends nor recharges
+
+class GiftBulkCreate(GiftBase):
+    sender_id: str
+    receiver_ids: List[str] = Field(..., min_length=1) # At most Settings.gift_bulk_max_receivers
+    client_ref: Optional[str] = None
 
 class Gift(GiftBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     sender_id: str
+    sender_name: Optional[str] = None # Copied at send time so profile pages need no users lookup
     receiver_id: str
+    price_stars: int = 0
+    client_ref: Optional[str] = None
     status: str = "active"
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class GiftPage(BaseModel):
+    items: List[Gift]
+    next_cursor: Optional[str] = None
+
+class StarsBalance(BaseModel):
+    user_id: str
+    balance: int
+
+class StarsLedgerEntry(BaseModel):
+    id: str
+    seq: int
+    delta: int
+    balance_after: int
+    reason: str
+    ref: Optional[Any] = None
+    created_at: datetime
+
+class StarsLedgerPage(BaseModel):
+    items: List[StarsLedgerEntry]
+    next_cursor: Optional[str] = None
+
+class StarsAdjustment(BaseModel):
+    delta: int
+    reason: str = "adjustment"
+    ref: Optional[str] = None
+
+class GiftBulkResponse(BaseModel):
+    items: List[Gift]
+    duplicate_receiver_ids: List[str] = Field(default_factory=list) # Already sent by an earlier attempt with this client_ref
+    unknown_receiver_ids: List[str] = Field(default_factory=list)
+    charged_stars: int = 0
+
 # --- Payment Specific Models ---
 class StoreItem(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -119,6 +242,15 @@ class StoreItem(BaseModel):
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class StoreItemUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price_stars: Optional[int] = None
+    item_type: Optional[str] = None
+    image_url: Optional[str] = None
+    metadata: Optional[Dict[str, Any]] = None
+    is_active: Optional[bool] = None
+
 class UserInventoryItem(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_profile_id: str # Link to UserProfile.id
@@ -128,12 +260,26 @@ class UserInventoryItem(BaseModel):
     telegram_payment_charge_id: str # From successful payment
     metadata: Optional[Dict[str, Any]] = None # e.g., activation details
 
+class InventoryPage(BaseModel):
+    items: List[UserInventoryItem]
+    next_cursor: Optional[str] = None
+
+# Read endpoints send trusted Mongo documents shaped to these models without
+# re-validating them (see fast_json.py).
+POST_SHAPE = DocumentShape(Post)
+COMMENT_SHAPE = DocumentShape(Comment)
+GIFT_SHAPE = DocumentShape(Gift)
+LEDGER_ENTRY_SHAPE = DocumentShape(StarsLedgerEntry)
+INVENTORY_SHAPE = DocumentShape(UserInventoryItem)
+
 class PaymentTransaction(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_profile_id: str
     store_item_id: str
     invoice_payload: str = Field(unique=True) # Unique payload for this transaction
     telegram_payment_charge_id: Optional[str] = None
+    update_id: Optional[int] = None # Telegram update that completed the payment
+    inventory_granted: bool = False
     amount_stars: int
     currency: str = "XTR"
     status: str = "pending"  # pending, completed, failed, refunded
@@ -152,100 +298,402 @@ class LabeledPrice(BaseModel):
     label: str
     amount: int # In the smallest units of the currency (for XTR, 1 star = 1 unit)
 
-# --- Telegram API Helper ---
-async def call_telegram_api(method: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not bot_token:
-        logging.error("TELEGRAM_BOT_TOKEN is not configured.")
-        raise HTTPException(status_code=500, detail="Telegram Bot Token not configured.")
-    
-    url = f"https://api.telegram.org/bot{bot_token}/{method}"
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=data)
-            response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            logging.error(f"Telegram API error for method {method}: {e.response.status_code} - {e.response.text}")
-            raise HTTPException(status_code=e.response.status_code, detail=f"Telegram API error: {e.response.text}")
-        except httpx.RequestError as e:
-            logging.error(f"Request error calling Telegram API method {method}: {e}")
-            raise HTTPException(status_code=503, detail=f"Telegram API request failed: {e}")
+MEDIA_POST_TYPES = ("image", "drawing")
+BLOB_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
-# --- Authentication Endpoint --- 
-@auth_router.post("/telegram_login", response_model=UserProfile)
-async def login_with_telegram(request_body: InitDataRequest = Body(...)):
-    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
+# --- Application Resources ---
+class Resources:
+    """
+    What one app instance holds on to: its settings, the Mongo and Bot API
+    clients and the services built on them. Every handle is created on first
+    use, so nothing is opened at import and each worker process opens its own.
+    `start()` and `close()` run in the app's lifespan. Request handlers get
+    these handles through the `get_db`/`get_telegram`/`get_resources`
+    dependencies. Background workers are bound to the instance that built them.
+    """
+
+    def __init__(self, settings: Settings, db: Optional[AsyncIOMotorDatabase] = None):
+        self.settings = settings
+        self.client: Optional[AsyncIOMotorClient] = None
+        self._db = db # Given by tests and tools; otherwise connected on first use
+        self.telegram_client: Optional[TelegramBotAPIClient] = None
+        self.blob_store: Optional[BlobStore] = None # Content-addressed storage for image/drawing post payloads
+        self.image_pipeline: Optional[ImagePipeline] = None # Pillow transcoding/thumbnailing, backed by a process pool
+        self.like_buffer: Optional[LikeCounterBuffer] = None # Write-behind like counters, only with LIKES_WRITE_BEHIND=1
+        self.catalog_cache: Optional[CatalogCache] = None
+        self.webhook_queue: Optional[WebhookQueue] = None # Webhook updates other than pre-checkout queries
+        self.invoice_pool: Optional[InvoicePool] = None
+        self.payment_reaper: Optional[PaymentReaper] = None
+        self.entitlements: Optional[EntitlementService] = None
+        self.feed_service: Optional[FeedService] = None
+        self.feed_fanout_queue: Optional[WebhookQueue] = None
+        self.user_search: Optional[UserSearchIndex] = None
+        self.rate_limiter: Optional[RateLimiter] = None
+        self.stars_ledger: Optional[StarsLedger] = None
+        self.stars_snapshotter: Optional[StarsSnapshotter] = None
+        self.shared_metrics: Optional[SharedMetricsDir] = None # Only with METRICS_DIR, i.e. several workers
+        # Whether the deployment supports multi-document transactions (replica
+        # set / mongos). Detected on first use; standalone servers fall back to
+        # the idempotent, non-transactional path.
+        self.mongo_transactions_supported: Optional[bool] = None
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        if self._db is None:
+            self.connect_mongo()
+        return self._db
+
+    def connect_mongo(self) -> AsyncIOMotorDatabase:
+        if self._db is None:
+            if not self.settings.mongo_url:
+                logging.error("MONGO_URL not set; connecting to the driver default.")
+            self.client = AsyncIOMotorClient(self.settings.mongo_url, event_listeners=[MongoCommandMetrics.from_env()])
+            self._db = self.client[self.settings.db_name]
+        return self._db
+
+    def get_telegram_client(self) -> TelegramBotAPIClient:
+        if self.telegram_client is None or self.telegram_client.is_closed:
+            if not self.settings.telegram_bot_token:
+                logging.error("TELEGRAM_BOT_TOKEN is not configured.")
+                raise HTTPException(status_code=500, detail="Telegram Bot Token not configured.")
+            self.telegram_client = TelegramBotAPIClient(TelegramClientConfig.from_env(self.settings.telegram_bot_token))
+        return self.telegram_client
+
+    def get_blob_store(self) -> BlobStore:
+        if self.blob_store is None:
+            self.blob_store = blob_store_from_env()
+        return self.blob_store
+
+    def get_image_pipeline(self) -> ImagePipeline:
+        if self.image_pipeline is None:
+            self.image_pipeline = ImagePipeline()
+        return self.image_pipeline
+
+    def get_catalog_cache(self) -> CatalogCache:
+        if self.catalog_cache is None:
+            self.catalog_cache = CatalogCache.from_env(self.db)
+        return self.catalog_cache
+
+    def get_webhook_queue(self) -> WebhookQueue:
+        if self.webhook_queue is None:
+            self.webhook_queue = WebhookQueue.from_env(self.db, partial(process_webhook_update, self))
+        return self.webhook_queue
+
+    def get_invoice_pool(self) -> InvoicePool:
+        if self.invoice_pool is None:
+            self.invoice_pool = InvoicePool.from_env(self.db, self.request_invoice_link)
+        return self.invoice_pool
+
+    async def request_invoice_link(self, store_item_doc: Dict[str, Any], invoice_payload: str) -> str:
+        return await request_invoice_link(self.get_telegram_client(), store_item_doc, invoice_payload)
+
+    async def active_store_items(self) -> List[Dict[str, Any]]:
+        return (await self.get_catalog_cache().view(active_only=True)).items
+
+    def get_payment_reaper(self) -> PaymentReaper:
+        if self.payment_reaper is None:
+            self.payment_reaper = PaymentReaper.from_env(self.db)
+        return self.payment_reaper
+
+    def get_entitlements(self) -> EntitlementService:
+        if self.entitlements is None:
+            self.entitlements = EntitlementService.from_env(self.db)
+        return self.entitlements
+
+    def get_feed(self) -> FeedService:
+        if self.feed_service is None:
+            self.feed_service = FeedService.from_env(self.db)
+        return self.feed_service
+
+    async def fanout_post(self, job: Dict[str, Any]) -> None:
+        await self.get_feed().fanout_post(job)
+
+    def get_feed_fanout_queue(self) -> WebhookQueue:
+        if self.feed_fanout_queue is None:
+            self.feed_fanout_queue = WebhookQueue(
+                self.db,
+                self.fanout_post,
+                workers=self.settings.feed_fanout_workers,
+                collection_name="feed_fanout_jobs",
+                dead_letter_collection="feed_fanout_dead_letters",
+            )
+        return self.feed_fanout_queue
+
+    def get_user_search(self) -> UserSearchIndex:
+        if self.user_search is None:
+            self.user_search = UserSearchIndex.from_env()
+        return self.user_search
+
+    def get_rate_limiter(self) -> RateLimiter:
+        if self.rate_limiter is None:
+            self.rate_limiter = RateLimiter.from_env(self.db, RATE_LIMIT_DEFAULTS)
+        return self.rate_limiter
+
+    def get_stars_ledger(self) -> StarsLedger:
+        if self.stars_ledger is None:
+            self.stars_ledger = StarsLedger(self.db)
+        return self.stars_ledger
+
+    def get_shared_metrics(self) -> Optional[SharedMetricsDir]:
+        if self.shared_metrics is None and self.settings.metrics_dir:
+            self.shared_metrics = SharedMetricsDir(REGISTRY, self.settings.metrics_dir, flush_interval=self.settings.metrics_flush_seconds)
+        return self.shared_metrics
+
+    def get_stars_snapshotter(self) -> StarsSnapshotter:
+        if self.stars_snapshotter is None:
+            self.stars_snapshotter = StarsSnapshotter.from_env(self.get_stars_ledger())
+        return self.stars_snapshotter
+
+    async def start(self) -> None:
+        settings = self.settings
+        db = self.connect_mongo()
+        logging.info(f"MongoDB client initialized (pid {os.getpid()}).")
+        if settings.run_migrations_on_startup:
+            applied = await run_migrations(db)
+            if applied:
+                logging.info(f"Applied migrations: {applied}")
+        if settings.telegram_bot_token:
+            self.get_telegram_client()
+            logging.info("Telegram Bot API client initialized.")
+            self.get_invoice_pool().start(self.active_store_items)
+        self.get_image_pipeline().start()
+        self.get_webhook_queue().start()
+        self.get_feed_fanout_queue().start()
+        self.get_user_search().start(db)
+        if settings.payment_reaper_enabled:
+            self.get_payment_reaper().start()
+        if settings.stars_snapshotter_enabled:
+            self.get_stars_snapshotter().start()
+        if settings.likes_write_behind:
+            self.like_buffer = LikeCounterBuffer.from_env(db)
+            self.like_buffer.start()
+        REGISTRY.add_collector(self.service_metrics)
+        if self.get_shared_metrics():
+            self.shared_metrics.start()
+
+    async def close(self) -> None:
+        if self.shared_metrics:
+            await self.shared_metrics.close()
+        REGISTRY.remove_collector(self.service_metrics)
+        if self.telegram_client:
+            await self.telegram_client.aclose()
+            logging.info("Telegram Bot API client closed.")
+        if self.image_pipeline:
+            self.image_pipeline.close()
+        if self.like_buffer:
+            await self.like_buffer.close()
+        if self.webhook_queue:
+            await self.webhook_queue.close()
+        if self.feed_fanout_queue:
+            await self.feed_fanout_queue.close()
+        if self.user_search:
+            await self.user_search.close()
+        if self.invoice_pool:
+            await self.invoice_pool.close()
+        if self.payment_reaper:
+            await self.payment_reaper.close()
+        if self.stars_snapshotter:
+            await self.stars_snapshotter.close()
+        if self.client:
+            self.client.close()
+            logging.info("MongoDB client closed.")
+
+    def service_metrics(self):
+        """Counters kept by the per-worker services, read at scrape time."""
+        if self.entitlements:
+            yield ("tgwall_entitlement_cache_total", "counter", "Entitlement lookups by result.",
+                   [({"result": "hit"}, self.entitlements.hits), ({"result": "load"}, self.entitlements.loads)])
+        if self.invoice_pool:
+            pool = self.invoice_pool
+            yield ("tgwall_invoice_pool_total", "counter", "Invoice pool events.",
+                   [({"event": "claim"}, pool.claims), ({"event": "miss"}, pool.misses),
+                    ({"event": "link_created"}, pool.links_created)])
+        if self.payment_reaper:
+            stats = self.payment_reaper.stats
+            yield ("tgwall_payment_reaper_total", "counter", "Payment reaper runs and the transactions they touched.",
+                   [({"event": "run"}, stats.runs), ({"event": "expired"}, stats.expired),
+                    ({"event": "archived"}, stats.archived), ({"event": "error"}, stats.errors)])
+        if self.catalog_cache:
+            yield ("tgwall_catalog_reloads_total", "counter", "Store catalog cache reloads.", [({}, self.catalog_cache.reloads)])
+        if self.user_search:
+            yield ("tgwall_user_search_indexed_users", "gauge", "Users in the search index.", [({}, len(self.user_search))])
+        if self.telegram_client:
+            stats = self.telegram_client.stats_snapshot()
+            yield ("tgwall_telegram_api_retries_total", "counter", "Bot API retries by method.",
+                   [({"method": method}, s["retries"]) for method, s in sorted(stats.items())])
+
+def get_resources(request: Request) -> Resources:
+    return request.app.state.resources
+
+def get_db(resources: Resources = Depends(get_resources)) -> AsyncIOMotorDatabase:
+    return resources.db
+
+def get_telegram(resources: Resources = Depends(get_resources)) -> TelegramBotAPIClient:
+    return resources.get_telegram_client()
+
+async def has_item(resources: Resources, user_id: str, store_item_id: str) -> bool:
+    """Whether the user owns the store item; cached, safe to call on hot paths."""
+    return await resources.get_entitlements().has_item(user_id, store_item_id)
+
+# --- Session Auth ---
+def _require_bot_token(settings: Settings) -> str:
+    bot_token = settings.telegram_bot_token
     if not bot_token:
         logging.error("TELEGRAM_BOT_TOKEN is not configured on the server.")
         raise HTTPException(status_code=500, detail="Server configuration error: Bot token missing.")
+    return bot_token
+
+async def get_current_user(
+    authorization: Optional[str] = Header(None),
+    x_telegram_init_data: Optional[str] = Header(None),
+    resources: Resources = Depends(get_resources),
+) -> SessionUser:
+    """
+    Resolves the calling user. The session token issued by /api/auth/telegram_login
+    is verified locally (signature + expiry), without touching Mongo. Clients that
+    still send raw initData in X-Telegram-Init-Data are validated against the cached
+    secret key and looked up by telegram_id.
+    """
+    bot_token = _require_bot_token(resources.settings)
+    if authorization and authorization.lower().startswith("bearer "):
+        claims = decode_session_token(authorization[7:].strip(), session_secret(bot_token, resources.settings.session_secret))
+        if not claims:
+            raise HTTPException(status_code=401, detail="Invalid or expired session token.", headers={"WWW-Authenticate": "Bearer"})
+        return SessionUser(user_id=claims["sub"], telegram_id=claims["tg"])
+    if x_telegram_init_data:
+        telegram_user_data = validate_init_data(x_telegram_init_data, bot_token, resources.settings.init_data_max_age_seconds)
+        if telegram_user_data:
+            user_doc = await resources.db.users.find_one({"telegram_id": telegram_user_data["id"]}, {"_id": 0, "id": 1})
+            if user_doc:
+                return SessionUser(user_id=user_doc["id"], telegram_id=telegram_user_data["id"])
+    raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+
+def require_admin(x_admin_token: Optional[str] = Header(None), resources: Resources = Depends(get_resources)) -> None:
+    admin_token = resources.settings.admin_api_token
+    if not admin_token or not x_admin_token or not hmac.compare_digest(admin_token, x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required.")
+
+def ensure_same_user(current_user: SessionUser, user_id: str) -> None:
+    if current_user.user_id != user_id:
+        raise HTTPException(status_code=403, detail="Cannot act on behalf of another user.")
+
+# --- Rate Limiting ---
+# route -> (per-user budget, per-IP budget), "capacity/seconds"; overridable
+# through RATE_LIMIT_<ROUTE> and RATE_LIMIT_<ROUTE>_IP.
+RATE_LIMIT_DEFAULTS = {
+    "posts": ("10/60", "60/60"),
+    "invoices": ("20/60", "100/60"),
+    "gifts": ("30/60", "120/60"),
+}
 
-    telegram_user_data = validate_init_data(request_body.init_data_str, bot_token)
+def client_ip(request: Request, settings: Settings) -> Optional[str]:
+    # Only trust proxy headers when a proxy in front of us sets them. nginx puts
+    # the peer it saw in X-Real-IP; failing that, the right-most X-Forwarded-For
+    # hop is the one our proxy appended. Entries left of it come from the client
+    # and can be anything.
+    if settings.trust_forwarded_for:
+        real_ip = request.headers.get("x-real-ip")
+        if real_ip:
+            return real_ip.strip()
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else None
+
+def rate_limited(route: str):
+    """Dependency rejecting the request with 429 + Retry-After once the caller's budget for `route` is spent."""
+    async def check_rate_limit(
+        request: Request,
+        current_user: SessionUser = Depends(get_current_user),
+        resources: Resources = Depends(get_resources),
+    ) -> None:
+        decision = await resources.get_rate_limiter().check(route, current_user.user_id, client_ip(request, resources.settings))
+        if not decision.allowed:
+            RATE_LIMITED.inc(route, decision.scope)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, please retry later.",
+                headers={"Retry-After": decision.retry_after_header},
+            )
+    return check_rate_limit
+
+# --- Telegram API Helper ---
+async def call_telegram_api(telegram: TelegramBotAPIClient, method: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        return await telegram.call(method, data)
+    except TelegramAPIError as e:
+        outcome = "api_error"
+        logging.error(f"Telegram API error for method {method}: {e.status_code} - {e.description}")
+        raise HTTPException(status_code=e.status_code, detail=f"Telegram API error: {e.description}")
+    except httpx.RequestError as e:
+        outcome = "network_error"
+        logging.error(f"Request error calling Telegram API method {method}: {e}")
+        raise HTTPException(status_code=503, detail=f"Telegram API request failed: {e}")
+    finally:
+        TELEGRAM_CALLS.inc(method, outcome)
+        TELEGRAM_LATENCY.observe(time.perf_counter() - started, method)
+
+# --- Authentication Endpoint --- 
+def _login_response(profile: UserProfile, settings: Settings) -> TelegramLoginResponse:
+    token, expires_at = issue_session_token(
+        profile.id, profile.telegram_id, session_secret(settings.telegram_bot_token, settings.session_secret), settings.session_ttl_seconds
+    )
+    return TelegramLoginResponse(**profile.dict(), session_token=token, session_expires_at=expires_at)
+
+@auth_router.post("/telegram_login", response_model=TelegramLoginResponse)
+async def login_with_telegram(request_body: InitDataRequest = Body(...), resources: Resources = Depends(get_resources)):
+    bot_token = _require_bot_token(resources.settings)
+
+    telegram_user_data = validate_init_data(request_body.init_data_str, bot_token, resources.settings.init_data_max_age_seconds)
 
     if not telegram_user_data:
         raise HTTPException(status_code=401, detail="Invalid or tampered initData.")
 
     tg_user = TelegramUserFromInitData(**telegram_user_data)
-    existing_user_doc = await db.users.find_one({"telegram_id": tg_user.id})
+    profile = await upsert_telegram_user(resources, tg_user)
+    return _login_response(profile, resources.settings)
+
+async def upsert_telegram_user(resources: Resources, tg_user: TelegramUserFromInitData) -> UserProfile:
+    """
+    Create or refresh the user for a Telegram login in one round trip. Fields
+    that come from Telegram are always $set; the generated id/created_at and app
+    defaults are only written on insert. The unique telegram_id index turns a
+    concurrent first login into a DuplicateKeyError for the loser, whose retry
+    then simply updates the winner's document.
+    """
     user_name = tg_user.first_name
     if tg_user.last_name:
         user_name += f" {tg_user.last_name}"
 
-    if existing_user_doc:
-        update_fields = {
-            "username": tg_user.username,
-            "name": user_name,
-            "photo_url": tg_user.photo_url,
-            "updated_at": datetime.utcnow()
-        }
-        update_fields = {k: v for k, v in update_fields.items() if v is not None or k == "photo_url" or k == "username"} # Allow None to clear photo/username
-        
-        await db.users.update_one(
-            {"telegram_id": tg_user.id},
-            {"$set": update_fields}
-        )
-        # Fetch the potentially updated document to include all fields like 'id'
-        updated_user_doc = await db.users.find_one({"telegram_id": tg_user.id})
-        return UserProfile(**updated_user_doc)
-    else:
-        new_user_profile = UserProfile(
-            telegram_id=tg_user.id,
-            username=tg_user.username,
-            name=user_name,
-            photo_url=tg_user.photo_url,
-        )
-        await db.users.insert_one(new_user_profile.dict(by_alias=True))
-        return new_user_profile
-
-# --- Payment Endpoints ---
-@payments_router.post("/create_invoice_link", response_model=CreateInvoiceLinkResponse)
-async def create_invoice_link(request_data: CreateInvoiceLinkRequest, current_user_tg_id: str = Depends(lambda x: "dummy_user_id")):
-    # TODO: Replace dummy_user_id with actual authenticated user's telegram_id from initData/session
-    # For now, we'll assume current_user_tg_id is passed or derived correctly.
-    # This dependency needs to be properly implemented for security.
-    # A placeholder for fetching user based on a validated initData or session token:
-    user_profile = await db.users.find_one({"telegram_id": current_user_tg_id}) 
-    if not user_profile:
-        # This check should be part of an authentication dependency
-        raise HTTPException(status_code=401, detail="User not authenticated or not found")
-
-    store_item_doc = await db.store_items.find_one({"id": request_data.store_item_id, "is_active": True})
-    if not store_item_doc:
-        raise HTTPException(status_code=404, detail="Store item not found or not active.")
-    
-    store_item = StoreItem(**store_item_doc)
-    invoice_payload = f"tgwall_item_{store_item.id}_user_{user_profile['id']}_{str(uuid.uuid4())[:8]}"
+    update_fields = {
+        "username": tg_user.username, # None clears a removed username/photo
+        "name": user_name,
+        "photo_url": tg_user.photo_url,
+        "updated_at": datetime.utcnow(),
+    }
+    new_user_profile = UserProfile(telegram_id=tg_user.id, **update_fields)
+    insert_only_fields = {k: v for k, v in new_user_profile.dict(by_alias=True).items() if k not in update_fields}
 
-    # Create a pending transaction record
-    new_transaction = PaymentTransaction(
-        user_profile_id=user_profile["id"],
-        store_item_id=store_item.id,
-        invoice_payload=invoice_payload,
-        amount_stars=store_item.price_stars,
-        status="pending"
-    )
-    await db.payment_transactions.insert_one(new_transaction.dict(by_alias=True))
+    for attempt in range(2):
+        try:
+            user_doc = await resources.db.users.find_one_and_update(
+                {"telegram_id": tg_user.id},
+                {"$set": update_fields, "$setOnInsert": insert_only_fields},
+                projection={"_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            resources.get_user_search().upsert(user_doc)
+            return UserProfile(**user_doc)
+        except DuplicateKeyError:
+            if attempt:
+                raise
+            logging.info(f"Concurrent first login for telegram_id {tg_user.id}; retrying as update.")
 
+# --- Payment Endpoints ---
+def build_invoice_data(store_item: StoreItem, invoice_payload: str) -> Dict[str, Any]:
     prices = [LabeledPrice(label=store_item.name, amount=store_item.price_stars)]
     invoice_data = {
         "title": store_item.name,
@@ -267,19 +715,52 @@ async def create_invoice_link(request_data: CreateInvoiceLinkRequest, current_us
         "is_flexible": False, # Not typically used with XTR simple invoices
     }
     # Remove None values from invoice_data to avoid sending empty optional fields
-    invoice_data_cleaned = {k: v for k, v in invoice_data.items() if v is not None}
+    return {k: v for k, v in invoice_data.items() if v is not None}
+
+async def request_invoice_link(telegram: TelegramBotAPIClient, store_item_doc: Dict[str, Any], invoice_payload: str) -> str:
+    """One createInvoiceLink round trip; raises HTTPException if Telegram refuses."""
+    response_json = await call_telegram_api(telegram, "createInvoiceLink", build_invoice_data(StoreItem(**store_item_doc), invoice_payload))
+    if response_json.get("ok") and response_json.get("result"):
+        return response_json["result"]
+    logging.error(f"Failed to create invoice link: {response_json}")
+    raise HTTPException(status_code=500, detail=f"Failed to create invoice link with Telegram: {response_json.get('description', 'Unknown error')}")
+
+@payments_router.post("/create_invoice_link", response_model=CreateInvoiceLinkResponse, dependencies=[Depends(rate_limited("invoices"))])
+async def create_invoice_link(
+    request_data: CreateInvoiceLinkRequest,
+    current_user: SessionUser = Depends(get_current_user),
+    resources: Resources = Depends(get_resources),
+):
+    db = resources.db
+    store_item_doc = await resources.get_catalog_cache().get_item(request_data.store_item_id)
+    if not store_item_doc:
+        raise HTTPException(status_code=404, detail="Store item not found or not active.")
+    
+    store_item = StoreItem(**store_item_doc)
+
+    # Fast path: a pre-generated link whose payload was reserved by the pool.
+    pool = resources.get_invoice_pool()
+    pooled = await pool.claim(store_item_doc, current_user.user_id) if pool.enabled else None
+    if pooled:
+        invoice_payload = pooled["_id"]
+    else:
+        invoice_payload = f"tgwall_item_{store_item.id}_user_{current_user.user_id}_{str(uuid.uuid4())[:8]}"
+
+    # Create a pending transaction record
+    new_transaction = PaymentTransaction(
+        user_profile_id=current_user.user_id,
+        store_item_id=store_item.id,
+        invoice_payload=invoice_payload,
+        amount_stars=store_item.price_stars,
+        status="pending"
+    )
+    await db.payment_transactions.insert_one(new_transaction.dict(by_alias=True))
+    if pooled:
+        return CreateInvoiceLinkResponse(invoice_url=pooled["invoice_url"], payload=invoice_payload)
 
     try:
-        response_json = await call_telegram_api("createInvoiceLink", invoice_data_cleaned)
-        if response_json.get("ok") and response_json.get("result"):
-            return CreateInvoiceLinkResponse(invoice_url=response_json["result"], payload=invoice_payload)
-        else:
-            logging.error(f"Failed to create invoice link: {response_json}")
-            await db.payment_transactions.update_one(
-                {"invoice_payload": invoice_payload},
-                {"$set": {"status": "failed", "updated_at": datetime.utcnow()}}
-            )
-            raise HTTPException(status_code=500, detail=f"Failed to create invoice link with Telegram: {response_json.get('description', 'Unknown error')}")
+        invoice_url = await resources.request_invoice_link(store_item_doc, invoice_payload)
+        return CreateInvoiceLinkResponse(invoice_url=invoice_url, payload=invoice_payload)
     except HTTPException as e:
         # Propagate HTTPExceptions from call_telegram_api or others
         await db.payment_transactions.update_one(
@@ -295,8 +776,13 @@ async def create_invoice_link(request_data: CreateInvoiceLinkRequest, current_us
         )
         raise HTTPException(status_code=500, detail="Unexpected error creating invoice link.")
 
+@payments_router.get("/maintenance", dependencies=[Depends(require_admin)])
+async def payment_maintenance_stats(resources: Resources = Depends(get_resources)):
+    pending = await resources.db.payment_transactions.count_documents({"status": "pending"})
+    return {"pending": pending, "reaper": resources.get_payment_reaper().stats_snapshot()}
+
 @payments_router.post("/telegram_webhook")
-async def telegram_webhook(request: Request):
+async def telegram_webhook(request: Request, resources: Resources = Depends(get_resources)):
     # It's crucial to validate that this request comes from Telegram, 
     # e.g., by checking a secret token in the URL or headers if Telegram supports it for webhooks.
     # For now, we assume the webhook URL is secret enough.
@@ -304,6 +790,8 @@ async def telegram_webhook(request: Request):
     logging.info(f"Received Telegram webhook: {update_data}")
 
     if "pre_checkout_query" in update_data:
+        # Fast path: Telegram needs the answer within 10 seconds, so it is not
+        # queued behind other updates.
         pre_checkout_query = update_data["pre_checkout_query"]
         query_id = pre_checkout_query["id"]
         invoice_payload = pre_checkout_query["invoice_payload"]
@@ -311,122 +799,575 @@ async def telegram_webhook(request: Request):
         # currency = pre_checkout_query["currency"]
 
         # Validate the payload and if the order can be fulfilled
-        transaction = await db.payment_transactions.find_one({"invoice_payload": invoice_payload, "status": "pending"})
+        transaction = await resources.db.payment_transactions.find_one({"invoice_payload": invoice_payload, "status": "pending"})
         if not transaction:
             logging.warning(f"PreCheckoutQuery for unknown or non-pending transaction payload: {invoice_payload}")
-            await call_telegram_api("answerPreCheckoutQuery", {"pre_checkout_query_id": query_id, "ok": False, "error_message": "Transaction not found or already processed."})
+            await call_telegram_api(resources.get_telegram_client(), "answerPreCheckoutQuery", {"pre_checkout_query_id": query_id, "ok": False, "error_message": "Transaction not found or already processed."})
             return JSONResponse(content={"status": "error", "message": "Transaction not found"})
         
         # Additional checks: e.g., item still available, user can purchase, etc.
         # For now, assume ok if transaction is found and pending.
-        await call_telegram_api("answerPreCheckoutQuery", {"pre_checkout_query_id": query_id, "ok": True})
+        await call_telegram_api(resources.get_telegram_client(), "answerPreCheckoutQuery", {"pre_checkout_query_id": query_id, "ok": True})
         logging.info(f"Responded OK to PreCheckoutQuery ID: {query_id} for payload: {invoice_payload}")
         return JSONResponse(content={"status": "ok"})
 
-    elif "successful_payment" in update_data:
-        successful_payment = update_data["successful_payment"]
-        invoice_payload = successful_payment["invoice_payload"]
-        telegram_payment_charge_id = successful_payment["telegram_payment_charge_id"]
-        # total_amount = successful_payment["total_amount"]
-        # currency = successful_payment["currency"]
+    if extract_successful_payment(update_data) is not None:
+        # Fulfillment does several Mongo writes; persist the update and ack right
+        # away so Telegram's deliveries never back up behind it.
+        queued = await resources.get_webhook_queue().enqueue(update_data)
+        return JSONResponse(content={"status": "queued" if queued else "duplicate"})
 
-        transaction_doc = await db.payment_transactions.find_one({"invoice_payload": invoice_payload, "status": "pending"})
-        if not transaction_doc:
-            logging.warning(f"SuccessfulPayment for unknown or non-pending transaction payload: {invoice_payload}. Charge ID: {telegram_payment_charge_id}")
-            # This might indicate a duplicate notification or an issue. Log and investigate.
-            return JSONResponse(content={"status": "error", "message": "Transaction not found or already processed for successful payment."})
+    # Acknowledge everything else: Telegram redelivers any update that gets a
+    # non-2xx answer, and messages, commands etc. reach this webhook too.
+    return JSONResponse(content={"status": "unhandled_update_type"})
 
-        transaction = PaymentTransaction(**transaction_doc)
+def extract_successful_payment(update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    # Telegram delivers successful_payment inside a message; older callers of
+    # this endpoint sent it at the top level.
+    if "successful_payment" in update_data:
+        return update_data["successful_payment"]
+    return (update_data.get("message") or {}).get("successful_payment")
 
-        # Update transaction status
-        await db.payment_transactions.update_one(
-            {"invoice_payload": invoice_payload},
-            {"$set": {"status": "completed", "telegram_payment_charge_id": telegram_payment_charge_id, "updated_at": datetime.utcnow()}}
-        )
+async def process_webhook_update(resources: Resources, update_data: Dict[str, Any]) -> None:
+    """Queue handler: runs in a webhook worker, exceptions trigger a retry."""
+    successful_payment = extract_successful_payment(update_data)
+    if successful_payment is None:
+        logging.warning(f"Dropping queued webhook update with no handler: {update_data.get('update_id')}")
+        return
 
-        # Grant item to user
-        store_item_doc = await db.store_items.find_one({"id": transaction.store_item_id})
-        if store_item_doc:
-            inventory_item = UserInventoryItem(
-                user_profile_id=transaction.user_profile_id,
-                store_item_id=transaction.store_item_id,
-                item_name=store_item_doc.get("name", "Unknown Item"),
-                telegram_payment_charge_id=telegram_payment_charge_id
-            )
-            await db.user_inventory.insert_one(inventory_item.dict(by_alias=True))
-            logging.info(f"Item {store_item_doc.get('name')} granted to user {transaction.user_profile_id} via inventory.")
-        else:
-            logging.error(f"Store item with ID {transaction.store_item_id} not found after successful payment for payload {invoice_payload}.")
+    invoice_payload = successful_payment["invoice_payload"]
+    telegram_payment_charge_id = successful_payment["telegram_payment_charge_id"]
+    # total_amount = successful_payment["total_amount"]
+    # currency = successful_payment["currency"]
+    await fulfill_successful_payment(resources, invoice_payload, telegram_payment_charge_id, update_data.get("update_id"))
+
+async def run_in_transaction(resources: Resources, fn) -> Any:
+    """
+    Run `fn(session)` inside a multi-document transaction when the server
+    supports one, otherwise run `fn(None)` directly. `fn` must be idempotent:
+    the transactional path retries it on transient errors.
+    """
+    if resources.mongo_transactions_supported is not False:
+        try:
+            async with await resources.db.client.start_session() as session:
+                result = await session.with_transaction(fn)
+            resources.mongo_transactions_supported = True
+            return result
+        except NotImplementedError:
+            resources.mongo_transactions_supported = False
+        except OperationFailure as e:
+            if e.code != 20: # IllegalOperation: transactions need a replica set member or mongos
+                raise
+            resources.mongo_transactions_supported = False
+        logging.warning("MongoDB transactions unavailable; payment fulfillment runs without them.")
+    return await fn(None)
+
+async def fulfill_successful_payment(resources: Resources, invoice_payload: str, telegram_payment_charge_id: str, update_id: Optional[int] = None) -> bool:
+    """
+    Complete a pending transaction and grant its item exactly once.
+
+    The pending -> completed transition is a conditional find_one_and_update, so
+    of any number of duplicate or concurrent deliveries only one wins. The
+    transition and the inventory grant share a transaction where available.
+    Without transactions, the grant is an upsert keyed by the unique
+    telegram_payment_charge_id and `inventory_granted` records that it landed,
+    so a redelivery after a crash between the two steps finishes the grant.
+    Returns True if this call completed the transaction.
+    """
+    db = resources.db
+
+    async def complete(session):
+        now = datetime.utcnow()
+        update_fields = {
+            "status": "completed",
+            "telegram_payment_charge_id": telegram_payment_charge_id,
+            "inventory_granted": False,
+            "updated_at": now,
+        }
+        if update_id is not None:
+            update_fields["update_id"] = update_id
+        transaction_doc = await db.payment_transactions.find_one_and_update(
+            # "expired" too: the payer may have passed pre-checkout just before the sweep.
+            {"invoice_payload": invoice_payload, "status": {"$in": ["pending", "expired"]}},
+            {"$set": update_fields},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+        if transaction_doc:
+            await grant_inventory_item(resources, PaymentTransaction(**transaction_doc), session)
+        return transaction_doc
 
+    completed = await run_in_transaction(resources, complete)
+    if completed:
+        # Only once the transaction has committed: a reload triggered inside it
+        # could still read the inventory without the new item and cache that.
+        resources.get_entitlements().invalidate(completed["user_profile_id"])
         logging.info(f"Processed SuccessfulPayment for payload: {invoice_payload}, Charge ID: {telegram_payment_charge_id}")
-        return JSONResponse(content={"status": "ok"})
+        return True
 
-    return JSONResponse(content={"status": "unhandled_update_type"}, status_code=400)
+    # Not pending any more: a duplicate delivery, or a retry after a crash between
+    # completing the transaction and granting the item.
+    transaction_doc = await db.payment_transactions.find_one(
+        {"invoice_payload": invoice_payload, "telegram_payment_charge_id": telegram_payment_charge_id, "status": "completed"},
+        {"_id": 0},
+    )
+    if transaction_doc and not transaction_doc.get("inventory_granted", True):
+        await grant_inventory_item(resources, PaymentTransaction(**transaction_doc), None)
+        resources.get_entitlements().invalidate(transaction_doc["user_profile_id"])
+        logging.info(f"Finished interrupted fulfillment for payload: {invoice_payload}, Charge ID: {telegram_payment_charge_id}")
+    elif transaction_doc:
+        logging.info(f"Duplicate SuccessfulPayment ignored for payload: {invoice_payload}, Charge ID: {telegram_payment_charge_id}")
+    else:
+        logging.warning(f"SuccessfulPayment for unknown or non-pending transaction payload: {invoice_payload}. Charge ID: {telegram_payment_charge_id}")
+    return False
+
+async def grant_inventory_item(resources: Resources, transaction: PaymentTransaction, session) -> None:
+    db = resources.db
+    store_item_doc = await resources.get_catalog_cache().get_item(transaction.store_item_id, active_only=False)
+    if not store_item_doc:
+        # Leave inventory_granted False so the grant can be retried once the item is fixed.
+        logging.error(f"Store item with ID {transaction.store_item_id} not found after successful payment for payload {transaction.invoice_payload}.")
+        return
+    inventory_item = UserInventoryItem(
+        user_profile_id=transaction.user_profile_id,
+        store_item_id=transaction.store_item_id,
+        item_name=store_item_doc.get("name", "Unknown Item"),
+        telegram_payment_charge_id=transaction.telegram_payment_charge_id
+    )
+    await db.user_inventory.update_one(
+        {"telegram_payment_charge_id": transaction.telegram_payment_charge_id},
+        {"$setOnInsert": inventory_item.dict(by_alias=True)},
+        upsert=True,
+        session=session,
+    )
+    await db.payment_transactions.update_one(
+        {"invoice_payload": transaction.invoice_payload},
+        {"$set": {"inventory_granted": True}},
+        session=session,
+    )
+    logging.info(f"Item {store_item_doc.get('name')} granted to user {transaction.user_profile_id} via inventory.")
+
+# --- Store Catalog Endpoints ---
+@api_router.get("/store_items", response_model=List[StoreItem])
+async def list_store_items(request: Request, active_only: bool = True, resources: Resources = Depends(get_resources)):
+    # Served from the per-worker catalog cache as pre-serialized JSON.
+    view = await resources.get_catalog_cache().view(active_only)
+    headers = {"ETag": view.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and view.etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=view.body, media_type="application/json", headers=headers)
+
+@api_router.post("/store_items", response_model=StoreItem, status_code=201, dependencies=[Depends(require_admin)])
+async def create_store_item(item: StoreItem, resources: Resources = Depends(get_resources)):
+    await resources.db.store_items.insert_one(item.dict(by_alias=True))
+    await resources.get_catalog_cache().invalidate()
+    return item
+
+@api_router.patch("/store_items/{item_id}", response_model=StoreItem, dependencies=[Depends(require_admin)])
+async def update_store_item(item_id: str, changes: StoreItemUpdate, resources: Resources = Depends(get_resources)):
+    update_fields = changes.dict(exclude_unset=True)
+    if not update_fields:
+        raise HTTPException(status_code=400, detail="No fields to update.")
+    item_doc = await resources.db.store_items.find_one_and_update(
+        {"id": item_id}, {"$set": update_fields}, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+    )
+    if not item_doc:
+        raise HTTPException(status_code=404, detail="Store item not found.")
+    await resources.get_catalog_cache().invalidate()
+    return StoreItem(**item_doc)
 
 # --- Other API Endpoints (Posts, Gifts, Profile - to be implemented or verified) ---
 @api_router.get("/profile/{user_id}", response_model=UserProfile)
-async def get_user_profile(user_id: str):
+async def get_user_profile(user_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
     user = await db.users.find_one({"id": user_id})
     if user:
         return UserProfile(**user)
     raise HTTPException(status_code=404, detail="User not found")
 
+@api_router.get("/users/search", response_model=UserSearchPage)
+async def search_users(
+    q: str = Query(..., min_length=1, max_length=64),
+    limit: Optional[int] = Query(None, ge=1, description="Page size, capped at 100"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    resources: Resources = Depends(get_resources),
+):
+    # Served from the per-worker prefix index; Mongo is only read on first use.
+    index = resources.get_user_search()
+    await index.ensure_loaded(resources.db)
+    try:
+        offset = decode_offset(cursor)
+    except InvalidSearchCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    users, next_offset = index.search(q, clamp_page_size(limit), offset)
+    return UserSearchPage(items=users, next_cursor=encode_offset(next_offset) if next_offset is not None else None)
+
+@api_router.get("/users/{user_id}/posts", response_model=WallPage, response_model_exclude_unset=True)
+async def get_user_wall(
+    user_id: str,
+    limit: Optional[int] = Query(None, ge=1, description="Page size, capped at 100"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. type,likes"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    # One keyset query on the (user_id, created_at, id) index; an unknown user
+    # simply has an empty wall, so there is no separate users lookup.
+    try:
+        projection = build_projection(fields, WALL_POST_FIELDS, WALL_POST_ALWAYS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        docs, next_cursor = await fetch_page(db.posts, {"user_id": user_id}, cursor, clamp_page_size(limit), projection)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # The projection already limits each document to wall fields.
+    return page_response(None, docs, next_cursor)
+
+@api_router.get("/users/{user_id}/inventory", response_model=InventoryPage)
+async def get_user_inventory(
+    user_id: str,
+    limit: Optional[int] = Query(None, ge=1, description="Page size, capped at 100"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    current_user: SessionUser = Depends(get_current_user),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    # Purchases are private: only the owner can list them. Newest first, keyset
+    # paged on the (user_profile_id, purchase_date, id) index.
+    ensure_same_user(current_user, user_id)
+    try:
+        docs, next_cursor = await fetch_page(
+            db.user_inventory, {"user_profile_id": user_id}, cursor, clamp_page_size(limit),
+            {"_id": 0}, time_field="purchase_date",
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return page_response(INVENTORY_SHAPE, docs, next_cursor)
+
 @api_router.get("/posts/{user_id}", response_model=List[Post])
-async def get_user_posts(user_id: str):
-    # This should fetch posts for a UserProfile.id, not telegram_id directly unless that's the design
-    user_profile = await db.users.find_one({"id": user_id})
-    if not user_profile:
+async def get_user_posts(user_id: str, limit: Optional[int] = Query(None, ge=1), db: AsyncIOMotorDatabase = Depends(get_db)):
+    # Kept for older clients with its old contract: up to 100 newest posts, 404
+    # for an unknown user. Use /users/{user_id}/posts to page or project fields.
+    docs, _ = await fetch_page(db.posts, {"user_id": user_id}, None, clamp_page_size(limit or MAX_PAGE_SIZE), {"_id": 0})
+    # Only an empty wall needs the users lookup to tell "no posts" from "no user".
+    if not docs and not await db.users.find_one({"id": user_id}, {"_id": 1}):
         raise HTTPException(status_code=404, detail="User profile not found to fetch posts.")
-    posts = await db.posts.find({"user_id": user_profile["id"]}).to_list(length=100)
-    return [Post(**post) for post in posts]
-
-@api_router.post("/posts", response_model=Post, status_code=201)
-async def create_post(post_data: PostCreate):
-    # Assume post_data.user_id is the UserProfile.id, which should be validated/obtained from auth
-    user_profile = await db.users.find_one({"id": post_data.user_id})
-    if not user_profile:
-        raise HTTPException(status_code=404, detail="User profile not found for creating post.")
-    
+    return FastJSONResponse(POST_SHAPE.shape_all(docs))
+
+@api_router.post("/posts", response_model=Post, status_code=201, dependencies=[Depends(rate_limited("posts"))])
+async def create_post(post_data: PostCreate, current_user: SessionUser = Depends(get_current_user), resources: Resources = Depends(get_resources)):
+    # The session token already proves the user exists; no users lookup needed.
+    ensure_same_user(current_user, post_data.user_id)
     new_post = Post(**post_data.dict())
-    await db.posts.insert_one(new_post.dict(by_alias=True))
+    if new_post.type in MEDIA_POST_TYPES and new_post.content.startswith("data:"):
+        # Keep the post document small: the image is re-encoded, thumbnailed,
+        # stored in the blob store (deduplicated by hash) and the post only
+        # keeps references.
+        try:
+            data, _ = decode_data_url(new_post.content)
+            processed = await resources.get_image_pipeline().process(data)
+        except BlobError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except ImageRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        store = resources.get_blob_store()
+        keys = await asyncio.gather(*(store.put(v.data, v.content_type) for v in processed.variants.values()))
+        new_post.variants = {name: blob_url(key) for name, key in zip(processed.variants, keys)}
+        new_post.blob_key = keys[0]
+        new_post.content = new_post.variants[FULL_VARIANT]
+    await resources.db.posts.insert_one(new_post.dict(by_alias=True))
+    # Timelines are filled asynchronously by the fan-out workers.
+    await resources.get_feed_fanout_queue().enqueue(FeedService.timeline_entry(new_post.dict()), key=new_post.id)
     return new_post
 
-# Include routers
-app.include_router(api_router)
-app.include_router(auth_router)
-app.include_router(payments_router)
+@api_router.post("/posts/{post_id}/comments", response_model=Comment, status_code=201)
+async def create_comment(post_id: str, comment_data: CommentCreate, current_user: SessionUser = Depends(get_current_user), resources: Resources = Depends(get_resources)):
+    ensure_same_user(current_user, comment_data.user_id)
+    comment = Comment(post_id=post_id, **comment_data.dict())
+    if not await add_comment(resources.db, comment.dict(), resources.settings.comment_preview_count):
+        raise HTTPException(status_code=404, detail="Post not found")
+    return comment
+
+@api_router.get("/posts/{post_id}/comments", response_model=CommentPage)
+async def get_post_comments(
+    post_id: str,
+    limit: Optional[int] = Query(None, ge=1, description="Page size, capped at 100"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    # Oldest first, on the (post_id, created_at, id) index.
+    try:
+        docs, next_cursor = await fetch_page(db.comments, {"post_id": post_id}, cursor, clamp_page_size(limit), {"_id": 0}, ascending=True)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return page_response(COMMENT_SHAPE, docs, next_cursor)
+
+async def _post_exists(db: AsyncIOMotorDatabase, post_id: str) -> bool:
+    return await db.posts.find_one({"id": post_id}, {"_id": 0, "id": 1}) is not None
+
+@api_router.post("/posts/{post_id}/likes", response_model=LikeResponse)
+async def like(post_id: str, current_user: SessionUser = Depends(get_current_user), resources: Resources = Depends(get_resources)):
+    db, like_buffer = resources.db, resources.like_buffer
+    if not await _post_exists(db, post_id):
+        raise HTTPException(status_code=404, detail="Post not found")
+    changed = await like_post(db, post_id, current_user.user_id, like_buffer)
+    return LikeResponse(post_id=post_id, liked=True, changed=changed, likes=await like_count(db, post_id, like_buffer) or 0)
+
+@api_router.delete("/posts/{post_id}/likes", response_model=LikeResponse)
+async def unlike(post_id: str, current_user: SessionUser = Depends(get_current_user), resources: Resources = Depends(get_resources)):
+    db, like_buffer = resources.db, resources.like_buffer
+    if not await _post_exists(db, post_id):
+        raise HTTPException(status_code=404, detail="Post not found")
+    changed = await unlike_post(db, post_id, current_user.user_id, like_buffer)
+    return LikeResponse(post_id=post_id, liked=False, changed=changed, likes=await like_count(db, post_id, like_buffer) or 0)
+
+@api_router.post("/users/{user_id}/follow", response_model=FollowResponse)
+async def follow(user_id: str, current_user: SessionUser = Depends(get_current_user), resources: Resources = Depends(get_resources)):
+    if user_id == current_user.user_id:
+        raise HTTPException(status_code=400, detail="Cannot follow yourself")
+    if not await resources.db.users.find_one({"id": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="User not found")
+    changed = await resources.get_feed().follow(current_user.user_id, user_id)
+    return FollowResponse(user_id=user_id, following=True, changed=changed)
+
+@api_router.delete("/users/{user_id}/follow", response_model=FollowResponse)
+async def unfollow(user_id: str, current_user: SessionUser = Depends(get_current_user), resources: Resources = Depends(get_resources)):
+    changed = await resources.get_feed().unfollow(current_user.user_id, user_id)
+    return FollowResponse(user_id=user_id, following=False, changed=changed)
+
+@api_router.get("/feed", response_model=FeedPage)
+async def get_home_feed(
+    limit: Optional[int] = Query(None, ge=1, description="Page size, capped at 100"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    current_user: SessionUser = Depends(get_current_user),
+    resources: Resources = Depends(get_resources),
+):
+    # Posts from followed accounts and the user's own, newest first.
+    try:
+        docs, next_cursor = await resources.get_feed().read_page(current_user.user_id, cursor, clamp_page_size(limit))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return page_response(POST_SHAPE, docs, next_cursor)
 
-# CORS Middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allows all origins
-    allow_credentials=True,
-    allow_methods=["*"],  # Allows all methods
-    allow_headers=["*"],  # Allows all headers
-)
+# --- Stars ---
+@api_router.get("/users/{user_id}/stars", response_model=StarsBalance)
+async def get_stars_balance(user_id: str, current_user: SessionUser = Depends(get_current_user), resources: Resources = Depends(get_resources)):
+    ensure_same_user(current_user, user_id)
+    return StarsBalance(user_id=user_id, balance=await resources.get_stars_ledger().balance(user_id))
+
+@api_router.get("/users/{user_id}/stars/ledger", response_model=StarsLedgerPage)
+async def get_stars_ledger_page(
+    user_id: str,
+    limit: Optional[int] = Query(None, ge=1, description="Page size, capped at 100"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    current_user: SessionUser = Depends(get_current_user),
+    resources: Resources = Depends(get_resources),
+):
+    ensure_same_user(current_user, user_id)
+    try:
+        docs, next_cursor = await fetch_page(resources.get_stars_ledger().entries, {"user_id": user_id}, cursor, clamp_page_size(limit), ENTRY_FIELDS)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return page_response(LEDGER_ENTRY_SHAPE, docs, next_cursor)
+
+@api_router.post("/users/{user_id}/stars/adjustments", response_model=StarsLedgerEntry, status_code=201, dependencies=[Depends(require_admin)])
+async def adjust_stars(user_id: str, adjustment: StarsAdjustment, resources: Resources = Depends(get_resources)):
+    if adjustment.delta == 0:
+        raise HTTPException(status_code=400, detail="delta must be non-zero")
+    if not await resources.db.users.find_one({"id": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="User not found")
+    try:
+        return await resources.get_stars_ledger().post(user_id, adjustment.delta, adjustment.reason, adjustment.ref)
+    except InsufficientStars as e:
+        raise HTTPException(status_code=402, detail=str(e))
+
+# --- Gifts ---
+def new_gift(gift_data: GiftBase, sender: Dict[str, Any], receiver_id: str, client_ref: Optional[str], price: int) -> Gift:
+    gift = Gift(
+        type=gift_data.type, message=gift_data.message, sender_id=sender["id"], sender_name=sender.get("name"),
+        receiver_id=receiver_id, price_stars=price,
+    )
+    gift.client_ref = client_ref or gift.id
+    return gift
+
+async def load_gift_parties(db: AsyncIOMotorDatabase, sender_id: str, receiver_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    docs = await db.users.find({"id": {"$in": [sender_id] + receiver_ids}}, {"_id": 0, "id": 1, "name": 1}).to_list(length=None)
+    return {doc["id"]: doc for doc in docs}
+
+@api_router.post("/gifts", response_model=Gift, status_code=201, dependencies=[Depends(rate_limited("gifts"))])
+async def send_gift(gift_data: GiftCreate, current_user: SessionUser = Depends(get_current_user), resources: Resources = Depends(get_resources)):
+    db = resources.db
+    ensure_same_user(current_user, gift_data.sender_id)
+    if gift_data.receiver_id == gift_data.sender_id:
+        raise HTTPException(status_code=400, detail="Cannot send a gift to yourself")
+    users = await load_gift_parties(db, gift_data.sender_id, [gift_data.receiver_id])
+    if gift_data.receiver_id not in users:
+        raise HTTPException(status_code=404, detail="Receiver not found")
+    gift = new_gift(gift_data, users.get(gift_data.sender_id, {"id": gift_data.sender_id}), gift_data.receiver_id, gift_data.client_ref,
+                    gift_price(resources.settings.gift_prices, gift_data.type))
+    try:
+        _, duplicates = await send_gifts(db, resources.get_stars_ledger(), [gift.dict()], gift.price_stars)
+    except InsufficientStars as e:
+        raise HTTPException(status_code=402, detail=str(e))
+    if duplicates:
+        # A retry of a send that already went through: return the original gift.
+        existing = await db.gifts.find_one({"sender_id": gift.sender_id, "client_ref": gift.client_ref}, {"_id": 0})
+        return Gift(**existing)
+    return gift
+
+@api_router.post("/gifts/bulk", response_model=GiftBulkResponse, status_code=201, dependencies=[Depends(rate_limited("gifts"))])
+async def send_gifts_bulk(bulk: GiftBulkCreate, current_user: SessionUser = Depends(get_current_user), resources: Resources = Depends(get_resources)):
+    ensure_same_user(current_user, bulk.sender_id)
+    max_receivers = resources.settings.gift_bulk_max_receivers
+    if len(bulk.receiver_ids) > max_receivers:
+        raise HTTPException(status_code=422, detail=f"At most {max_receivers} receivers per bulk send")
+    receiver_ids = list(dict.fromkeys(bulk.receiver_ids))
+    if bulk.sender_id in receiver_ids:
+        raise HTTPException(status_code=400, detail="Cannot send a gift to yourself")
+    users = await load_gift_parties(resources.db, bulk.sender_id, receiver_ids)
+    sender = users.get(bulk.sender_id, {"id": bulk.sender_id})
+    price = gift_price(resources.settings.gift_prices, bulk.type)
+    gifts = [
+        new_gift(bulk, sender, receiver_id, f"{bulk.client_ref}:{receiver_id}" if bulk.client_ref else None, price).dict()
+        for receiver_id in receiver_ids if receiver_id in users
+    ]
+    try:
+        inserted, duplicates = await send_gifts(resources.db, resources.get_stars_ledger(), gifts, price)
+    except InsufficientStars as e:
+        raise HTTPException(status_code=402, detail=str(e))
+    return GiftBulkResponse(
+        items=inserted,
+        duplicate_receiver_ids=[gift["receiver_id"] for gift in duplicates],
+        unknown_receiver_ids=[receiver_id for receiver_id in receiver_ids if receiver_id not in users],
+        charged_stars=price * len(inserted),
+    )
+
+@api_router.get("/users/{user_id}/gifts", response_model=GiftPage)
+async def get_user_gifts(
+    user_id: str,
+    limit: Optional[int] = Query(None, ge=1, description="Page size, capped at 100"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    status: str = Query("active"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    # Newest first, keyset paged on the (receiver_id, status, created_at, id) index.
+    try:
+        docs, next_cursor = await fetch_page(db.gifts, {"receiver_id": user_id, "status": status}, cursor, clamp_page_size(limit), {"_id": 0})
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return page_response(GIFT_SHAPE, docs, next_cursor)
+
+@api_router.get("/blobs/{key}")
+async def get_blob(key: str, request: Request, resources: Resources = Depends(get_resources)):
+    if not BLOB_KEY_RE.match(key):
+        raise HTTPException(status_code=404, detail="Blob not found")
+    store = resources.get_blob_store()
+    info = await store.stat(key)
+    if not info:
+        raise HTTPException(status_code=404, detail="Blob not found")
+
+    headers = {"ETag": info.etag, "Cache-Control": BLOB_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or info.etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        byte_range = parse_range_header(request.headers.get("range"), info.size)
+    except BlobError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{info.size}"})
+    if byte_range and request.headers.get("if-range", info.etag) != info.etag:
+        byte_range = None
+
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{info.size}"
+        status_code = 206
+    else:
+        start, end = 0, info.size - 1
+        status_code = 200
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(store.iter_range(key, start, end), status_code=status_code, media_type=info.content_type, headers=headers)
+
+# --- Health ---
+@api_router.get("/health")
+async def health(resources: Resources = Depends(get_resources)):
+    """Readiness probe: answered only by a worker past startup, and 503 while Mongo is unreachable."""
+    try:
+        await asyncio.wait_for(resources.db.command("ping"), timeout=resources.settings.health_mongo_timeout_seconds)
+    except Exception as e:
+        logging.warning(f"Health check failed: {e!r}")
+        return JSONResponse(status_code=503, content={"status": "unavailable", "mongo": "unreachable"})
+    return {"status": "ok", "pid": os.getpid()}
+
+@root_router.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(authorization: Optional[str] = Header(None), resources: Resources = Depends(get_resources)):
+    expected = resources.settings.metrics_token
+    if expected and not hmac.compare_digest(authorization or "", f"Bearer {expected}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    shared = resources.get_shared_metrics()
+    return Response(shared.render() if shared else REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
 
 # Root endpoint for health check
-@app.get("/")
+@root_router.get("/")
 async def read_root():
     return {"message": "TgWall API is running"}
 
-# --- Application Lifecycle Events (Optional but good for DB connection) ---
-@app.on_event("startup")
-async def startup_event():
-    # In a real app, you might re-initialize client here if it wasn't global
-    # or perform other startup tasks.
-    # For now, client is global, so this is more of a placeholder.
-    logging.info("MongoDB client initialized.") # This log might be redundant if client is global
+# --- Application Factory ---
+def create_app(settings: Optional[Settings] = None, db: Optional[AsyncIOMotorDatabase] = None) -> FastAPI:
+    """
+    Build an app with its own Resources. Without `settings`, backend/.env is
+    loaded and the environment is read. That is the production path:
+    `uvicorn --factory server:create_app`. Pass `db` to run against an existing
+    database handle (tests, tools) instead of connecting to settings.mongo_url.
+    Nothing is opened here. Clients and workers start in the lifespan, or on
+    first use when no lifespan runs.
+    """
+    if settings is None:
+        load_env_file(ROOT_DIR / ".env")
+        logging.basicConfig(level=logging.INFO)
+        settings = Settings.from_env()
+    resources = Resources(settings, db)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await resources.start()
+        try:
+            yield
+        finally:
+            await resources.close()
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.resources = resources
+    app.include_router(api_router)
+    app.include_router(auth_router)
+    app.include_router(payments_router)
+    app.include_router(root_router)
+
+    # CORS Middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Allows all origins
+        allow_credentials=True,
+        allow_methods=["*"],  # Allows all methods
+        allow_headers=["*"],  # Allows all headers
+    )
+    # Per-route latency/in-flight metrics; added last so it wraps CORS as well
+    app.add_middleware(MetricsMiddleware)
+    return app
+
+_default_app: Optional[FastAPI] = None
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    if client:
-        client.close()
-        logging.info("MongoDB client closed.")
+def __getattr__(name: str):
+    # `uvicorn server:app` keeps working: the default app is built on first access, not at import.
+    global _default_app
+    if name == "app":
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
     # This block is for direct execution, e.g., `python server.py`
-    # Uvicorn is usually preferred for production: `uvicorn server:app --reload`
+    # Uvicorn is usually preferred for production: `uvicorn --factory server:create_app`
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
-
+    uvicorn.run(create_app(), host="0.0.0.0", port=8000)
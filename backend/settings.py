@@ -0,0 +1,90 @@
+"""
+Typed settings for the API process.
+
+`Settings.from_env()` reads the environment once, when `server.create_app()`
+builds an app. Importing the backend reads no configuration. Tests and tools
+pass their own `Settings(...)` instead of patching os.environ.
+
+Knobs that only one service uses (CATALOG_CACHE_TTL_SECONDS, RATE_LIMIT_*,
+STARS_SNAPSHOT_*, ...) are still read by that service's `from_env` when it is
+first built, never at import time.
+"""
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Mapping, Optional
+
+
+def _flag(environ: Mapping[str, str], name: str, default: bool) -> bool:
+    # Same convention as elsewhere: "0" turns a default-on flag off, "1" turns a default-off flag on.
+    value = environ.get(name)
+    if value is None:
+        return default
+    return value != "0" if default else value == "1"
+
+
+def parse_prices(spec: str) -> Dict[str, int]:
+    """"flower=5,star=25" -> {"flower": 5, "star": 25}."""
+    prices = {}
+    for part in spec.split(","):
+        if part.strip():
+            name, _, price = part.partition("=")
+            prices[name.strip()] = int(price)
+    return prices
+
+
+@dataclass(frozen=True)
+class Settings:
+    mongo_url: Optional[str] = None
+    db_name: str = "telewall_db"
+    telegram_bot_token: Optional[str] = None
+    admin_api_token: Optional[str] = None
+    metrics_token: Optional[str] = None # Bearer token required on /metrics when set
+    metrics_dir: Optional[str] = None # Shared by all workers so /metrics reports the merged totals
+    metrics_flush_seconds: float = 5.0
+    session_secret: Optional[str] = None # Signs session tokens; derived from the bot token when unset
+    session_ttl_seconds: int = 3600
+    init_data_max_age_seconds: int = 86400
+    trust_forwarded_for: bool = False # Take the client IP from X-Real-IP / X-Forwarded-For (behind nginx)
+    health_mongo_timeout_seconds: float = 2.0
+    run_migrations_on_startup: bool = True
+    payment_reaper_enabled: bool = True
+    stars_snapshotter_enabled: bool = True
+    likes_write_behind: bool = False
+    feed_fanout_workers: int = 4
+    gift_prices: Mapping[str, int] = field(default_factory=dict) # Stars per gift type; unlisted types are free
+    gift_bulk_max_receivers: int = 100
+    comment_preview_count: int = 3 # Comments embedded in each post as a preview
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> "Settings":
+        env = os.environ if environ is None else environ
+        return cls(
+            mongo_url=env.get("MONGO_URL"),
+            db_name=env.get("DB_NAME", "telewall_db"),
+            telegram_bot_token=env.get("TELEGRAM_BOT_TOKEN") or None,
+            admin_api_token=env.get("ADMIN_API_TOKEN") or None,
+            metrics_token=env.get("METRICS_TOKEN") or None,
+            metrics_dir=env.get("METRICS_DIR") or None,
+            metrics_flush_seconds=float(env.get("METRICS_FLUSH_SECONDS", "5")),
+            session_secret=env.get("SESSION_SECRET") or None,
+            session_ttl_seconds=int(env.get("SESSION_TTL_SECONDS", "3600")),
+            init_data_max_age_seconds=int(env.get("INIT_DATA_MAX_AGE_SECONDS", "86400")),
+            trust_forwarded_for=_flag(env, "RATE_LIMIT_TRUST_FORWARDED", False),
+            health_mongo_timeout_seconds=float(env.get("HEALTH_MONGO_TIMEOUT_SECONDS", "2")),
+            run_migrations_on_startup=_flag(env, "RUN_MIGRATIONS_ON_STARTUP", True),
+            payment_reaper_enabled=_flag(env, "PAYMENT_REAPER_ENABLED", True),
+            stars_snapshotter_enabled=_flag(env, "STARS_SNAPSHOTTER_ENABLED", True),
+            likes_write_behind=_flag(env, "LIKES_WRITE_BEHIND", False),
+            feed_fanout_workers=int(env.get("FEED_FANOUT_WORKERS", "4")),
+            gift_prices=parse_prices(env.get("GIFT_PRICES", "")),
+            gift_bulk_max_receivers=int(env.get("GIFT_BULK_MAX_RECEIVERS", "100")),
+            comment_preview_count=int(env.get("COMMENT_PREVIEW_COUNT", "3")),
+        )
+
+
+def load_env_file(path: Path) -> None:
+    """Load a .env file into os.environ without overriding variables already set."""
+    if path.exists():
+        from dotenv import load_dotenv
+        load_dotenv(path)
@@ -0,0 +1,375 @@
+"""
+Stars balances: an append-only `stars_ledger` plus one `stars_accounts`
+document per user.
+
+Every movement is one ledger entry {user_id, seq, delta, balance_after, reason,
+ref, created_at}. Posting it takes two writes:
+* the account is updated first by a single pipeline find_one_and_update that
+  adds `delta` to `balance` and increments `seq`. A debit's filter also requires
+  `balance >= amount`, so concurrent debits can never overspend. The update
+  returns the new `seq`, which numbers the entry, and the unique
+  (user_id, seq) index keeps each account's ledger gap-free and replay-safe;
+* the entries are then appended in one `insert_many`.
+The account also keeps a copy of its last entry. If the process dies between
+the two writes, the snapshotter re-inserts that entry.
+
+`users.stars_balance` is no longer written on every movement. Every
+STARS_SNAPSHOT_INTERVAL_SECONDS, StarsSnapshotter rolls the entries of changed
+accounts into `stars_snapshots`: each new snapshot is the previous one plus the
+entries since. It is checked against the account, then copied to the user
+documents with one bulk write. Both writes only apply over an older seq
+(`stars_seq` on the user), so snapshotters in several workers can overlap
+without one rolling a balance back. Live balance reads are one _id lookup on
+`stars_accounts`.
+
+    python stars_ledger.py snapshot     # run one snapshot pass
+    python stars_ledger.py reconcile    # verify every account against its full ledger
+"""
+import asyncio
+import logging
+import os
+import sys
+import uuid
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+LEDGER_COLLECTION = "stars_ledger"
+ACCOUNTS_COLLECTION = "stars_accounts"
+SNAPSHOTS_COLLECTION = "stars_snapshots"
+SNAPSHOT_STATE_COLLECTION = "stars_snapshot_state"
+ENTRY_FIELDS = {"_id": 0, "id": 1, "seq": 1, "delta": 1, "balance_after": 1, "reason": 1, "ref": 1, "created_at": 1}
+
+# (user_id, delta, reason, ref)
+Movement = Tuple[str, int, str, Any]
+
+
+class InsufficientStars(Exception):
+    def __init__(self, cost: int):
+        super().__init__(f"Insufficient stars balance: {cost} needed")
+        self.cost = cost
+
+
+class StarsLedger:
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def entries(self):
+        return self.db[LEDGER_COLLECTION]
+
+    @property
+    def accounts(self):
+        return self.db[ACCOUNTS_COLLECTION]
+
+    async def _apply(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Move the account's balance and seq; returns the entry numbered and completed."""
+        last_entry = {key: {"$literal": value} for key, value in entry.items()}
+        last_entry.update(seq="$seq", balance_after="$balance")
+        pipeline = [
+            {"$set": {
+                "balance": {"$add": [{"$ifNull": ["$balance", 0]}, entry["delta"]]},
+                "seq": {"$add": [{"$ifNull": ["$seq", 0]}, 1]},
+                "updated_at": entry["created_at"],
+            }},
+            {"$set": {"last_entry": last_entry}},
+        ]
+        if entry["delta"] < 0:
+            account = await self.accounts.find_one_and_update(
+                {"_id": entry["user_id"], "balance": {"$gte": -entry["delta"]}}, pipeline,
+                return_document=ReturnDocument.AFTER,
+            )
+            if account is None:
+                raise InsufficientStars(-entry["delta"])
+            return account["last_entry"]
+        for attempt in range(2):
+            try:
+                account = await self.accounts.find_one_and_update(
+                    {"_id": entry["user_id"]}, pipeline, upsert=True, return_document=ReturnDocument.AFTER,
+                )
+                return account["last_entry"]
+            except DuplicateKeyError:
+                # Two credits opened the same account at once; retry as an update.
+                if attempt:
+                    raise
+
+    async def post_many(self, movements: List[Movement]) -> List[Dict[str, Any]]:
+        """
+        Post several movements and append their entries with one insert_many.
+        Each account update is atomic on its own, the batch is not: a debit that
+        doesn't fit raises InsufficientStars after the movements before it were posted.
+        """
+        posted = []
+        try:
+            for user_id, delta, reason, ref in movements:
+                if delta == 0:
+                    raise ValueError("A ledger movement needs a non-zero delta")
+                posted.append(await self._apply({
+                    "id": str(uuid.uuid4()), "user_id": user_id, "delta": delta, "reason": reason, "ref": ref,
+                    "created_at": datetime.utcnow(),
+                }))
+        finally:
+            if posted:
+                await self.entries.insert_many([dict(entry) for entry in posted], ordered=False)
+        return posted
+
+    async def post(self, user_id: str, delta: int, reason: str, ref: Any = None) -> Dict[str, Any]:
+        return (await self.post_many([(user_id, delta, reason, ref)]))[0]
+
+    async def balance(self, user_id: str) -> int:
+        account = await self.accounts.find_one({"_id": user_id}, {"balance": 1})
+        return account["balance"] if account else 0
+
+    async def reconcile(self) -> "ReconcileReport":
+        """
+        Check every account against the sum of its full ledger. Per-user ledger
+        totals (one $group) and accounts are both streamed in user_id order and
+        merge-joined, so memory stays flat however many users there are.
+        """
+        report = ReconcileReport()
+        totals = self.entries.aggregate([
+            {"$group": {"_id": "$user_id", "sum": {"$sum": "$delta"}, "count": {"$sum": 1}, "max_seq": {"$max": "$seq"}}},
+            {"$sort": {"_id": 1}},
+        ], allowDiskUse=True).__aiter__()
+        accounts = self.accounts.find({}, {"balance": 1, "seq": 1}).sort("_id", 1).__aiter__()
+        total, account = await _next(totals), await _next(accounts)
+        while total is not None or account is not None:
+            if account is None or (total is not None and total["_id"] < account["_id"]):
+                report.flag(total["_id"], "ledger entries without an account", ledger=total["sum"])
+                report.entries += total["count"]
+                total = await _next(totals)
+                continue
+            report.accounts += 1
+            if total is None or total["_id"] > account["_id"]:
+                if account.get("balance") or account.get("seq"):
+                    report.flag(account["_id"], "account without ledger entries", balance=account.get("balance"))
+                account = await _next(accounts)
+                continue
+            report.entries += total["count"]
+            if total["sum"] != account["balance"]:
+                report.flag(account["_id"], "balance differs from ledger", balance=account["balance"], ledger=total["sum"])
+            elif not total["count"] == total["max_seq"] == account["seq"]:
+                report.flag(account["_id"], "missing ledger entries", seq=account["seq"], entries=total["count"])
+            elif account["balance"] < 0:
+                report.flag(account["_id"], "negative balance", balance=account["balance"])
+            total, account = await _next(totals), await _next(accounts)
+        return report
+
+
+async def _next(iterator) -> Optional[Dict[str, Any]]:
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+@dataclass
+class ReconcileReport:
+    accounts: int = 0
+    entries: int = 0
+    problems: int = 0
+    examples: List[Dict[str, Any]] = field(default_factory=list)
+    max_examples: int = 100
+
+    def flag(self, user_id: str, problem: str, **details: Any) -> None:
+        self.problems += 1
+        if len(self.examples) < self.max_examples:
+            self.examples.append({"user_id": user_id, "problem": problem, **details})
+
+
+@dataclass
+class SnapshotStats:
+    runs: int = 0
+    snapshots: int = 0
+    repaired: int = 0
+    mismatches: int = 0
+    errors: int = 0
+    last_run_at: Optional[datetime] = None
+
+
+class StarsSnapshotter:
+    # Accounts updated this close to the previous watermark are looked at again,
+    # covering clock skew between workers.
+    WATERMARK_OVERLAP = timedelta(seconds=5)
+
+    def __init__(self, ledger: StarsLedger, interval: float = 60.0, batch_size: int = 500, repair_after_seconds: float = 30.0):
+        self.ledger = ledger
+        self.db = ledger.db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.repair_after = timedelta(seconds=repair_after_seconds)
+        self.stats = SnapshotStats()
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, ledger: StarsLedger) -> "StarsSnapshotter":
+        return cls(
+            ledger,
+            interval=float(os.getenv("STARS_SNAPSHOT_INTERVAL_SECONDS", "60")),
+            batch_size=int(os.getenv("STARS_SNAPSHOT_BATCH_SIZE", "500")),
+            repair_after_seconds=float(os.getenv("STARS_LEDGER_REPAIR_AFTER_SECONDS", "30")),
+        )
+
+    async def _roll(self, accounts: List[Dict[str, Any]], now: datetime) -> Optional[datetime]:
+        """
+        Snapshot a batch of accounts. Returns the oldest `updated_at` among accounts
+        that could not be fully rolled because an entry is still in flight.
+        """
+        if not accounts:
+            return None
+        ids = [account["_id"] for account in accounts]
+        snapshots = {s["_id"]: s for s in await self.db[SNAPSHOTS_COLLECTION].find({"_id": {"$in": ids}}).to_list(length=None)}
+        entries = await self.ledger.entries.find(
+            {"$or": [{"user_id": user_id, "seq": {"$gt": snapshots.get(user_id, {}).get("seq", 0)}} for user_id in ids]},
+            {"_id": 0, "user_id": 1, "seq": 1, "delta": 1},
+        ).sort([("user_id", 1), ("seq", 1)]).to_list(length=None)
+        by_user = defaultdict(list)
+        for entry in entries:
+            by_user[entry["user_id"]].append(entry)
+
+        snapshot_ops, user_ops, repairs = [], [], []
+        in_flight_since: Optional[datetime] = None
+        for account in accounts:
+            user_id = account["_id"]
+            previous = snapshots.get(user_id, {"balance": 0, "seq": 0})
+            balance, seq = previous["balance"], previous["seq"]
+            for entry in by_user[user_id]:
+                if entry["seq"] != seq + 1:
+                    break
+                balance += entry["delta"]
+                seq = entry["seq"]
+            if seq < account["seq"]:
+                settled = now - account["updated_at"] >= self.repair_after
+                last = account.get("last_entry")
+                if settled and last and last["seq"] == seq + 1:
+                    # The writer died between the account update and the insert.
+                    repairs.append(dict(last))
+                    balance += last["delta"]
+                    seq = last["seq"]
+                elif settled:
+                    logging.error(f"Stars ledger for {user_id} is missing entries after seq {seq} (account at {account['seq']}).")
+                    self.stats.mismatches += 1
+                elif in_flight_since is None or account["updated_at"] < in_flight_since:
+                    in_flight_since = account["updated_at"]
+            if seq == account["seq"] and balance != account["balance"]:
+                logging.error(f"Stars ledger for {user_id} sums to {balance} but the account holds {account['balance']}.")
+                self.stats.mismatches += 1
+                continue
+            if seq > previous["seq"]:
+                # Guarded by seq: another worker's snapshotter may have rolled
+                # further since we read the snapshot, and must not be undone.
+                snapshot_ops.append(UpdateOne({"_id": user_id, "seq": {"$lt": seq}},
+                                              {"$set": {"balance": balance, "seq": seq, "taken_at": now}}, upsert=True))
+                user_ops.append(UpdateOne({"id": user_id, "stars_seq": {"$not": {"$gte": seq}}},
+                                          {"$set": {"stars_balance": balance, "stars_seq": seq}}))
+
+        if repairs:
+            try:
+                await self.ledger.entries.insert_many(repairs, ordered=False)
+            except BulkWriteError as e:
+                # Entries the original writer managed to insert after all.
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+            self.stats.repaired += len(repairs)
+        if snapshot_ops:
+            self.stats.snapshots += await self._write_guarded(self.db[SNAPSHOTS_COLLECTION], snapshot_ops)
+            await self._write_guarded(self.db.users, user_ops)
+        return in_flight_since
+
+    @staticmethod
+    async def _write_guarded(collection, ops: List[UpdateOne]) -> int:
+        """Apply seq-guarded updates; returns how many landed. Losing to a newer seq is not an error."""
+        try:
+            result = await collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # A guarded upsert whose _id already holds a newer seq fails as a duplicate.
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+            return e.details.get("nUpserted", 0) + e.details.get("nModified", 0)
+        return result.upserted_count + result.modified_count
+
+    async def run_once(self) -> int:
+        """Snapshot every account changed since the last run; returns snapshots written."""
+        started = datetime.utcnow()
+        before = self.stats.snapshots
+        state = await self.db[SNAPSHOT_STATE_COLLECTION].find_one({"_id": "watermark"})
+        query = {"updated_at": {"$gte": state["at"] - self.WATERMARK_OVERLAP}} if state else {}
+        in_flight_since: Optional[datetime] = None
+        batch: List[Dict[str, Any]] = []
+        async for account in self.ledger.accounts.find(query):
+            batch.append(account)
+            if len(batch) >= self.batch_size:
+                pending = await self._roll(batch, started)
+                in_flight_since = min(filter(None, [in_flight_since, pending]), default=None)
+                batch = []
+        pending = await self._roll(batch, started)
+        in_flight_since = min(filter(None, [in_flight_since, pending]), default=None)
+        # Don't move past accounts whose latest entry is still being written.
+        watermark = min(started, in_flight_since) if in_flight_since else started
+        await self.db[SNAPSHOT_STATE_COLLECTION].update_one({"_id": "watermark"}, {"$set": {"at": watermark}}, upsert=True)
+        self.stats.runs += 1
+        self.stats.last_run_at = started
+        return self.stats.snapshots - before
+
+    def stats_snapshot(self) -> Dict[str, Any]:
+        return asdict(self.stats)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.stats.errors += 1
+                logging.error(f"Stars snapshot run failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def _cli(command: str) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from settings import Settings, load_env_file
+
+    load_env_file(Path(__file__).parent / ".env")
+    settings = Settings.from_env()
+    client = AsyncIOMotorClient(settings.mongo_url)
+    db = client[settings.db_name]
+    try:
+        ledger = StarsLedger(db)
+        if command == "snapshot":
+            written = await StarsSnapshotter.from_env(ledger).run_once()
+            print(f"Wrote {written} balance snapshots")
+        elif command == "reconcile":
+            report = await ledger.reconcile()
+            print(f"Checked {report.accounts} accounts, {report.entries} ledger entries: {report.problems} problems")
+            for example in report.examples:
+                print(f"    {example}")
+            return 1 if report.problems else 0
+        else:
+            print(__doc__)
+            return 2
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_cli(sys.argv[1] if len(sys.argv) > 1 else "")))
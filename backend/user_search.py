@@ -0,0 +1,300 @@
+"""
+In-process user search for /api/users/search.
+
+A user's name and username are normalized (case-folded, accents stripped,
+leading "@" removed) and every word-suffix of them ("anna maria smith",
+"maria smith", "smith") is kept in one sorted key list. "Everyone whose name has a
+word starting with q" is then a bisect range instead of a regex scan over
+`users`, and so is an in-order multi-word query like "maria sm". Words given out
+of order come from intersecting the per-word ranges; a multi-word query ranks
+both, in-order matches first.
+
+Results are ranked: exact username, username prefix, full-name prefix, then any
+word prefix; ties go to users with more followers. To keep every query bounded
+only the first USER_SEARCH_MAX_CANDIDATES matching keys are ranked, so a broad
+one- or two-letter query ranks a prefix of its matches rather than all of them.
+The out-of-order fallback reads at most USER_SEARCH_MAX_SCAN keys per word.
+
+Each worker loads the index from Mongo on first use and keeps it current from
+`upsert` (called on login) plus a poll for users whose `updated_at` moved, every
+USER_SEARCH_SYNC_SECONDS; writes that change what search shows, follower counts
+included, must bump `updated_at`. The initial sort runs in a thread so requests
+keep being served while it builds.
+
+Memory is per worker: every uvicorn worker holds its own copy, roughly the user
+documents plus one key string per word-suffix, and loads it with one full read
+of `users` at startup.
+"""
+import asyncio
+import base64
+import heapq
+import itertools
+import logging
+import os
+import unicodedata
+from bisect import bisect_left
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+USER_FIELDS = {"_id": 0, "id": 1, "name": 1, "username": 1, "photo_url": 1, "follower_count": 1, "updated_at": 1}
+TIER_USERNAME, TIER_USERNAME_PREFIX, TIER_NAME_PREFIX, TIER_WORD_PREFIX = range(4)
+
+
+class InvalidSearchCursor(ValueError):
+    pass
+
+
+def normalize(text: Optional[str]) -> str:
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    return [word.lstrip("@") for word in text.replace("_", " ").replace(".", " ").split() if word.lstrip("@")]
+
+
+def suffix_phrases(text: str) -> List[str]:
+    """"anna maria smith" -> ["anna maria smith", "maria smith", "smith"]."""
+    words = tokenize(text)
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+def encode_offset(offset: int) -> str:
+    return base64.urlsafe_b64encode(str(offset).encode()).decode().rstrip("=")
+
+
+def decode_offset(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        offset = int(base64.urlsafe_b64decode((cursor + "=" * (-len(cursor) % 4)).encode()))
+    except ValueError as e:
+        raise InvalidSearchCursor(f"Malformed cursor: {cursor!r}") from e
+    if offset < 0:
+        raise InvalidSearchCursor(f"Malformed cursor: {cursor!r}")
+    return offset
+
+
+@dataclass(slots=True)
+class IndexedUser:
+    id: str
+    name: str
+    username: Optional[str]
+    photo_url: Optional[str]
+    follower_count: int
+    norm_name: str
+    norm_username: str
+    tokens: Tuple[str, ...]
+
+    @classmethod
+    def from_doc(cls, doc: Dict[str, Any]) -> "IndexedUser":
+        norm_name = normalize(doc.get("name"))
+        norm_username = normalize(doc.get("username")).lstrip("@")
+        tokens = tuple(dict.fromkeys(suffix_phrases(norm_name) + suffix_phrases(norm_username)))
+        return cls(
+            id=doc["id"], name=doc.get("name") or "", username=doc.get("username"), photo_url=doc.get("photo_url"),
+            follower_count=doc.get("follower_count") or 0, norm_name=norm_name, norm_username=norm_username, tokens=tokens,
+        )
+
+    def public(self) -> Dict[str, Any]:
+        return {"id": self.id, "name": self.name, "username": self.username,
+                "photo_url": self.photo_url, "follower_count": self.follower_count}
+
+
+def _key(token: str, slot: int) -> str:
+    # "\x00" sorts before every other character, so a token prefix range still
+    # covers all of its keys while (token, slot) pairs stay unique and bisectable.
+    return f"{token}\x00{slot}"
+
+
+class UserSearchIndex:
+    def __init__(self, max_candidates: int = 1000, max_scan: int = 50000, sync_interval: float = 30.0):
+        self.max_candidates = max_candidates
+        self.max_scan = max_scan
+        self.sync_interval = sync_interval
+        # Parallel lists sorted by key: _keys[i] is token "\x00" slot, _owners[i] its slot.
+        self._keys: List[str] = []
+        self._owners: List[int] = []
+        self._users: List[Optional[IndexedUser]] = []
+        self._slots: Dict[str, int] = {}
+        self._watermark: Optional[datetime] = None
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> "UserSearchIndex":
+        return cls(
+            max_candidates=int(os.getenv("USER_SEARCH_MAX_CANDIDATES", "1000")),
+            max_scan=int(os.getenv("USER_SEARCH_MAX_SCAN", "50000")),
+            sync_interval=float(os.getenv("USER_SEARCH_SYNC_SECONDS", "30")),
+        )
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    # --- Maintenance ---
+    @staticmethod
+    def _build_tables(docs: List[Dict[str, Any]]):
+        # Pure: touches no index state, so it can run off the event loop.
+        users: List[Optional[IndexedUser]] = []
+        slots: Dict[str, int] = {}
+        pairs = []
+        for doc in docs:
+            user = IndexedUser.from_doc(doc)
+            slot = slots.get(user.id)
+            if slot is None:
+                slot = slots[user.id] = len(users)
+                users.append(None)
+            users[slot] = user
+            pairs.extend((_key(token, slot), slot) for token in user.tokens)
+        pairs.sort()
+        return [key for key, _ in pairs], [slot for _, slot in pairs], users, slots
+
+    def build(self, docs: List[Dict[str, Any]]) -> None:
+        """Replace the whole index (one sort instead of one insert per token)."""
+        self._keys, self._owners, self._users, self._slots = self._build_tables(docs)
+
+    def _slot_for(self, user_id: str) -> int:
+        slot = self._slots.get(user_id)
+        if slot is None:
+            slot = self._slots[user_id] = len(self._users)
+            self._users.append(None)
+        return slot
+
+    def _remove_tokens(self, slot: int, tokens: Tuple[str, ...]) -> None:
+        for token in tokens:
+            key = _key(token, slot)
+            i = bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+                del self._owners[i]
+
+    def upsert(self, doc: Dict[str, Any]) -> None:
+        user = IndexedUser.from_doc(doc)
+        slot = self._slot_for(user.id)
+        old = self._users[slot]
+        if old is None or old.tokens != user.tokens:
+            if old is not None:
+                self._remove_tokens(slot, old.tokens)
+            for token in user.tokens:
+                key = _key(token, slot)
+                i = bisect_left(self._keys, key)
+                self._keys.insert(i, key)
+                self._owners.insert(i, slot)
+        self._users[slot] = user
+
+    def remove(self, user_id: str) -> None:
+        slot = self._slots.pop(user_id, None)
+        if slot is not None:
+            self._remove_tokens(slot, self._users[slot].tokens)
+            self._users[slot] = None
+
+    async def load(self, db) -> None:
+        started = datetime.utcnow()
+        docs = await db.users.find({}, USER_FIELDS).to_list(length=None)
+        # Swapped in whole once built; logins upserted meanwhile come back with
+        # the next sync, which re-reads everything since `started`.
+        self._keys, self._owners, self._users, self._slots = await asyncio.to_thread(self._build_tables, docs)
+        self._watermark = started
+        self._loaded = True
+        logging.info(f"User search index loaded: {len(self)} users, {len(self._keys)} tokens.")
+
+    async def ensure_loaded(self, db) -> None:
+        if self._loaded:
+            return
+        async with self._lock:
+            if not self._loaded:
+                await self.load(db)
+
+    async def sync(self, db) -> int:
+        """Pick up users written by other workers since the last sync."""
+        if not self._loaded:
+            await self.ensure_loaded(db)
+            return 0
+        started = datetime.utcnow()
+        # Overlap a little so writes racing the previous poll are not missed.
+        since = self._watermark - timedelta(seconds=5)
+        docs = await db.users.find({"updated_at": {"$gte": since}}, USER_FIELDS).to_list(length=None)
+        for doc in docs:
+            self.upsert(doc)
+        self._watermark = started
+        return len(docs)
+
+    async def _run(self, db) -> None:
+        while True:
+            try:
+                await self.sync(db)
+            except Exception as e:
+                logging.error(f"User search sync failed: {e!r}")
+            await asyncio.sleep(self.sync_interval)
+
+    def start(self, db) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(db))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # --- Queries ---
+    def _prefix_range(self, prefix: str) -> Tuple[int, int]:
+        return bisect_left(self._keys, prefix), bisect_left(self._keys, prefix + "\U0010ffff")
+
+    def _rank(self, user: IndexedUser, query: str) -> int:
+        if user.norm_username and user.norm_username == query:
+            return TIER_USERNAME
+        if user.norm_username and user.norm_username.startswith(query):
+            return TIER_USERNAME_PREFIX
+        if user.norm_name.startswith(query):
+            return TIER_NAME_PREFIX
+        return TIER_WORD_PREFIX
+
+    def _match_words(self, words: List[str]) -> Dict[int, None]:
+        """Slots having a word starting with each of `words`, in any order."""
+        # Start from the narrowest range and narrow it down with the others: a
+        # set intersection when their range is comparable, a per-candidate token
+        # check when it is much wider.
+        ranges = sorted(((self._prefix_range(word), word) for word in words), key=lambda r: r[0][1] - r[0][0])
+        (start, end), _ = ranges[0]
+        candidates = dict.fromkeys(self._owners[start:min(end, start + self.max_scan)])
+        users = self._users
+        for (start, end), word in ranges[1:]:
+            if end - start <= 4 * len(candidates):
+                candidates = dict.fromkeys(candidates.keys() & set(self._owners[start:end]))
+            else:
+                candidates = dict.fromkeys(
+                    slot for slot in candidates if any(t.startswith(word) for t in users[slot].tokens)
+                )
+        return candidates
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Return (users, next_offset) for one page of ranked matches."""
+        normalized = normalize(query).lstrip("@")
+        words = tokenize(normalized)
+        if not words:
+            return [], None
+        start, end = self._prefix_range(" ".join(words))
+        # In-order (phrase) matches first, so the candidate cap keeps them.
+        candidates = dict.fromkeys(self._owners[start:min(end, start + self.max_candidates)])
+        if len(words) > 1:
+            candidates.update(self._match_words(words))
+
+        users = self._users
+        scored = []
+        for slot in itertools.islice(candidates, self.max_candidates):
+            user = users[slot]
+            scored.append((self._rank(user, normalized), -user.follower_count, user.norm_name, slot))
+
+        top = heapq.nsmallest(offset + limit + 1, scored)
+        page = top[offset:offset + limit]
+        next_offset = offset + limit if len(top) > offset + limit else None
+        return [self._users[row[-1]].public() for row in page], next_offset
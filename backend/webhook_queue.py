@@ -0,0 +1,231 @@
+"""
+Durable, Mongo-backed queue for Telegram webhook updates.
+
+The webhook handler only persists the update (`enqueue`) and acks Telegram; a
+pool of asyncio workers claims queued updates with an atomic find_one_and_update
+lease, runs the handler with bounded concurrency and retries failures with
+exponential backoff. Updates that keep failing are moved to
+`webhook_dead_letters` for inspection.
+
+Queue documents use Telegram's `update_id` as `_id`, so a redelivered update is
+stored once. The same queue carries other background jobs (feed fan-out) when
+given its own collections and an explicit `key` per job. A worker that dies mid-update leaves a `processing` document whose
+lease expires after `lease_seconds`, after which any worker picks it up again.
+Each claim stamps a fresh `lease` token and completion/retry only apply while
+that token is still on the document, so a worker whose lease expired and was
+re-claimed cannot overwrite the new holder's state.
+
+Each `enqueue` wakes at most one idle worker rather than the whole pool, which
+would then race on the same document. A worker whose claim came back empty
+checks whether anything was enqueued while that claim was in flight before it
+goes idle, so no update waits for `poll_interval`; polling only matters for
+retries whose backoff has elapsed and for expired leases.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+QUEUE_COLLECTION = "webhook_updates"
+DEAD_LETTER_COLLECTION = "webhook_dead_letters"
+
+
+@dataclass
+class QueueStats:
+    enqueued: int = 0
+    duplicates: int = 0
+    processed: int = 0
+    retried: int = 0
+    dead_lettered: int = 0
+    lease_lost: int = 0
+
+
+class WebhookQueue:
+    def __init__(
+        self,
+        db,
+        handler: Callable[[Dict[str, Any]], Awaitable[None]],
+        workers: int = 16,
+        max_attempts: int = 5,
+        lease_seconds: float = 30.0,
+        backoff_base: float = 1.0,
+        backoff_max: float = 300.0,
+        poll_interval: float = 1.0,
+        collection_name: str = QUEUE_COLLECTION,
+        dead_letter_collection: str = DEAD_LETTER_COLLECTION,
+    ):
+        self.db = db
+        self.collection_name = collection_name
+        self.dead_letter_collection = dead_letter_collection
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.stats = QueueStats()
+        self._idle: Deque[asyncio.Future] = deque()
+        self._enqueue_seq = 0
+        self._tasks: List[asyncio.Task] = []
+
+    @classmethod
+    def from_env(cls, db, handler) -> "WebhookQueue":
+        return cls(
+            db,
+            handler,
+            workers=int(os.getenv("WEBHOOK_WORKERS", "16")),
+            max_attempts=int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5")),
+            lease_seconds=float(os.getenv("WEBHOOK_LEASE_SECONDS", "30")),
+            backoff_base=float(os.getenv("WEBHOOK_BACKOFF_BASE", "1.0")),
+            poll_interval=float(os.getenv("WEBHOOK_POLL_INTERVAL", "1.0")),
+        )
+
+    @property
+    def collection(self):
+        return self.db[self.collection_name]
+
+    async def enqueue(self, update: Dict[str, Any], key: Any = None) -> bool:
+        """Persist an update; returns False if this update_id (or key) was already queued."""
+        now = datetime.utcnow()
+        doc = {
+            "_id": key if key is not None else update.get("update_id", str(uuid.uuid4())),
+            "update": update,
+            "status": "queued",
+            "attempts": 0,
+            "enqueued_at": now,
+            "next_attempt_at": now,
+        }
+        try:
+            await self.collection.insert_one(doc)
+        except DuplicateKeyError:
+            self.stats.duplicates += 1
+            return False
+        self.stats.enqueued += 1
+        self._enqueue_seq += 1
+        self._wake_one()
+        return True
+
+    def _wake_one(self) -> None:
+        while self._idle:
+            waiter = self._idle.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": "queued", "next_attempt_at": {"$lte": now}},
+                {"status": "processing", "locked_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": "processing", "locked_until": now + timedelta(seconds=self.lease_seconds), "lease": uuid.uuid4().hex},
+             "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _leased(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        return {"_id": doc["_id"], "status": "processing", "lease": doc["lease"]}
+
+    def _lease_lost(self, doc: Dict[str, Any]) -> None:
+        self.stats.lease_lost += 1
+        logging.warning(f"{self.collection_name} job {doc['_id']} lease expired before it finished; leaving it to the new holder.")
+
+    async def _complete(self, doc: Dict[str, Any]) -> None:
+        result = await self.collection.update_one(
+            self._leased(doc),
+            {"$set": {"status": "done", "completed_at": datetime.utcnow()}, "$unset": {"locked_until": "", "lease": ""}},
+        )
+        if not result.matched_count:
+            self._lease_lost(doc)
+            return
+        self.stats.processed += 1
+
+    async def _fail(self, doc: Dict[str, Any], error: Exception) -> None:
+        now = datetime.utcnow()
+        if doc["attempts"] >= self.max_attempts:
+            # Mark it dead under the lease first: the dead-letter copy and the
+            # delete below only happen for the worker that still owns the job.
+            result = await self.collection.update_one(self._leased(doc), {"$set": {"status": "dead"}, "$unset": {"locked_until": ""}})
+            if not result.matched_count:
+                self._lease_lost(doc)
+                return
+            dead = {**doc, "status": "dead", "last_error": repr(error), "failed_at": now}
+            await self.db[self.dead_letter_collection].replace_one({"_id": doc["_id"]}, dead, upsert=True)
+            await self.collection.delete_one({"_id": doc["_id"]})
+            self.stats.dead_lettered += 1
+            logging.error(f"{self.collection_name} job {doc['_id']} moved to dead letters after {doc['attempts']} attempts: {error!r}")
+            return
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (doc["attempts"] - 1)))
+        result = await self.collection.update_one(
+            self._leased(doc),
+            {"$set": {"status": "queued", "next_attempt_at": now + timedelta(seconds=delay), "last_error": repr(error)},
+             "$unset": {"locked_until": "", "lease": ""}},
+        )
+        if not result.matched_count:
+            self._lease_lost(doc)
+            return
+        self.stats.retried += 1
+        logging.warning(f"{self.collection_name} job {doc['_id']} failed (attempt {doc['attempts']}), retrying in {delay:.1f}s: {error!r}")
+
+    async def process_one(self) -> bool:
+        """Claim and handle one update; returns False if nothing was ready."""
+        doc = await self.claim()
+        if doc is None:
+            return False
+        try:
+            await self.handler(doc["update"])
+        except Exception as e:
+            await self._fail(doc, e)
+        else:
+            await self._complete(doc)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            seq = self._enqueue_seq
+            try:
+                if await self.process_one():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"{self.collection_name} worker error: {e!r}")
+            if seq != self._enqueue_seq:
+                # Something was enqueued while the claim was in flight.
+                continue
+            waiter = asyncio.get_running_loop().create_future()
+            self._idle.append(waiter)
+            try:
+                await asyncio.wait({waiter}, timeout=self.poll_interval)
+            finally:
+                if not waiter.done():
+                    waiter.cancel()
+                    self._idle.remove(waiter)
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        """Wait until nothing is queued or processing (tests and load runs)."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while await self.collection.count_documents({"status": {"$in": ["queued", "processing"]}}):
+            if asyncio.get_running_loop().time() > deadline:
+                raise TimeoutError(f"{self.collection_name} queue did not drain in time")
+            await asyncio.sleep(0.01)
@@ -4,18 +4,58 @@ set -e
 # Start the FastAPI backend
 cd /backend || { echo "Backend directory not found"; exit 1; }
 
-echo "Starting FastAPI backend"
-# Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
-BACKEND_PID=$!
+# One uvicorn worker per core unless WEB_CONCURRENCY says otherwise. Each
+# worker builds its own app with server.create_app(), and that app opens its
+# own Mongo and Bot API clients in its lifespan.
+WORKERS="${WEB_CONCURRENCY:-$(nproc 2>/dev/null || echo 1)}"
+READY_TIMEOUT="${READY_TIMEOUT:-60}"
+
+# uvloop / httptools when installed, the pure-Python loop and parser otherwise.
+LOOP=asyncio
+python3 -c "import uvloop" 2>/dev/null && LOOP=uvloop
+HTTP=h11
+python3 -c "import httptools" 2>/dev/null && HTTP=httptools
 
-echo "Waiting for backend to start..."
-sleep 30
+# Apply migrations once here instead of letting every worker race them at startup.
+if [ "${RUN_MIGRATIONS_ON_STARTUP:-1}" != "0" ]; then
+    python3 migrations.py migrate
+fi
+export RUN_MIGRATIONS_ON_STARTUP=0
 
-if ! kill -0 $BACKEND_PID 2>/dev/null; then
-    echo "Backend failed to start at initialization, exiting"
-    exit 1
+# State that has to be shared between workers: rate-limit buckets live in Mongo,
+# and each worker flushes its metrics into METRICS_DIR so /metrics reports the
+# totals of all workers rather than of whichever one answered the scrape.
+if [ "$WORKERS" -gt 1 ]; then
+    export RATE_LIMIT_BACKEND=mongo
+    export METRICS_DIR="${METRICS_DIR:-/tmp/tgwall-metrics}"
 fi
+if [ -n "$METRICS_DIR" ]; then
+    rm -rf "$METRICS_DIR"
+    mkdir -p "$METRICS_DIR"
+fi
+
+echo "Starting FastAPI backend: $WORKERS workers, loop=$LOOP, http=$HTTP"
+uvicorn --factory server:create_app --host 0.0.0.0 --port 8001 --workers "$WORKERS" --loop "$LOOP" --http "$HTTP" &
+BACKEND_PID=$!
+
+# Readiness: /api/health only answers once a worker has finished startup and
+# can reach Mongo.
+echo "Waiting for backend to become ready (up to ${READY_TIMEOUT}s)..."
+WAITED=0
+until wget -q -O /dev/null http://127.0.0.1:8001/api/health 2>/dev/null; do
+    if ! kill -0 $BACKEND_PID 2>/dev/null; then
+        echo "Backend failed to start at initialization, exiting"
+        exit 1
+    fi
+    if [ "$WAITED" -ge "$READY_TIMEOUT" ]; then
+        echo "Backend not ready after ${READY_TIMEOUT}s, exiting"
+        kill $BACKEND_PID
+        exit 1
+    fi
+    sleep 1
+    WAITED=$((WAITED + 1))
+done
+echo "Backend ready after ${WAITED}s"
 
 # Start Nginx
 nginx -g 'daemon off;' &
@@ -16,6 +16,23 @@ const API_BASE_URL = `${BACKEND_URL}/api`;
 // Initialize Telegram Mini App
 const tg = window.Telegram?.WebApp;
 
+// Write endpoints (posts, comments, likes, invoices) need credentials. Every
+// axios call sends the session token from /auth/telegram_login once we have
+// one, and the raw initData until then (the backend accepts either).
+const setAuthHeaders = ({ sessionToken, initData }) => {
+  const headers = axios.defaults.headers.common;
+  if (sessionToken) {
+    headers["Authorization"] = `Bearer ${sessionToken}`;
+  } else {
+    delete headers["Authorization"];
+  }
+  if (initData) {
+    headers["X-Telegram-Init-Data"] = initData;
+  } else {
+    delete headers["X-Telegram-Init-Data"];
+  }
+};
+
 // Main App Component
 function App() {
   const [user, setUser] = useState(null);
@@ -43,16 +60,35 @@ function App() {
     }
   }, []);
 
+  useEffect(() => {
+    if (!telegramInitData) return undefined;
+    // Session tokens expire; on a 401 log in again with initData and retry once.
+    const interceptor = axios.interceptors.response.use(undefined, async (error) => {
+      const request = error.config;
+      if (error.response?.status !== 401 || !request || request._retried || request.url.endsWith("/auth/telegram_login")) {
+        throw error;
+      }
+      request._retried = true;
+      const login = await axios.post(`${API_BASE_URL}/auth/telegram_login`, { init_data_str: telegramInitData });
+      setAuthHeaders({ sessionToken: login.data.session_token, initData: telegramInitData });
+      request.headers["Authorization"] = `Bearer ${login.data.session_token}`;
+      return axios(request);
+    });
+    return () => axios.interceptors.response.eject(interceptor);
+  }, [telegramInitData]);
+
   useEffect(() => {
     if (telegramInitData) {
       // Authenticate with backend using the full initData string
       const authenticateUser = async () => {
         setIsLoading(true);
+        setAuthHeaders({ initData: telegramInitData });
         try {
           console.log("Sending initData to backend:", telegramInitData);
           const response = await axios.post(`${API_BASE_URL}/auth/telegram_login`, {
             init_data_str: telegramInitData,
           });
+          setAuthHeaders({ sessionToken: response.data.session_token, initData: telegramInitData });
           setUser(response.data); // response.data should be the UserProfile object
           console.log("User authenticated:", response.data);
         } catch (error) {
@@ -1,18 +1,29 @@
 
 import React, { useState } from 'react';
+import axios from 'axios';
 import { Link } from 'react-router-dom';
 
+const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+
 const PostItem = ({ post, user }) => {
   const [liked, setLiked] = useState(false);
-  const [likesCount, setLikesCount] = useState(Math.floor(Math.random() * 20));
-  
-  const handleLike = () => {
-    if (liked) {
-      setLikesCount(likesCount - 1);
-    } else {
-      setLikesCount(likesCount + 1);
+  const [likesCount, setLikesCount] = useState(post.likes || 0);
+  const [isLiking, setIsLiking] = useState(false);
+
+  // Auth headers are set globally by App once the user has logged in.
+  const handleLike = async () => {
+    if (isLiking) return;
+    setIsLiking(true);
+    try {
+      const url = `${API}/posts/${post.id}/likes`;
+      const response = liked ? await axios.delete(url) : await axios.post(url);
+      setLiked(response.data.liked);
+      setLikesCount(response.data.likes);
+    } catch (error) {
+      console.error('Error updating like:', error.response ? error.response.data : error.message);
+    } finally {
+      setIsLiking(false);
     }
-    setLiked(!liked);
   };
   
   const formatDate = (dateString) => {
@@ -94,7 +105,7 @@ const PostItem = ({ post, user }) => {
           <svg xmlns="http://www.w3.org/2000/svg" className="h-5 w-5 mr-1" fill="none" viewBox="0 0 24 24" stroke="currentColor">
             <path strokeLinecap="round" strokeLinejoin="round" strokeWidth={1.5} d="M8 12h.01M12 12h.01M16 12h.01M21 12c0 4.418-4.03 8-9 8a9.863 9.863 0 01-4.255-.949L3 20l1.395-3.72C3.512 15.042 3 13.574 3 12c0-4.418 4.03-8 9-8s9 3.582 9 8z" />
           </svg>
-          <span className="text-sm">{Math.floor(Math.random() * 10)}</span>
+          <span className="text-sm">{post.comment_count || 0}</span>
         </button>
         
         <button className="flex items-center text-gray-400">
@@ -9,6 +9,8 @@ const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 const ProfilePage = ({ currentUser }) => {
   const [user, setUser] = useState(null);
   const [posts, setPosts] = useState([]);
+  const [postsCursor, setPostsCursor] = useState(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [gifts, setGifts] = useState([]);
   const [activeTab, setActiveTab] = useState("posts");
   const [isLoading, setIsLoading] = useState(true);
@@ -22,17 +24,28 @@ const ProfilePage = ({ currentUser }) => {
         const id = userId || (currentUser ? currentUser.id : null);
         
         if (id) {
-          // Fetch user profile
-          const userResponse = await axios.get(`${API}/users/${id}`);
-          setUser(userResponse.data);
-          
-          // Fetch user posts
-          const postsResponse = await axios.get(`${API}/users/${id}/posts`);
-          setPosts(postsResponse.data);
-          
-          // Fetch user gifts
-          const giftsResponse = await axios.get(`${API}/users/${id}/gifts`);
-          setGifts(giftsResponse.data);
+          // Profile, first page of posts and gifts in parallel; a failing
+          // posts or gifts request leaves that tab empty instead of the page.
+          const [userResult, postsResult, giftsResult] = await Promise.allSettled([
+            axios.get(`${API}/profile/${id}`),
+            axios.get(`${API}/users/${id}/posts`),
+            axios.get(`${API}/users/${id}/gifts`),
+          ]);
+          if (userResult.status === 'rejected') throw userResult.reason;
+          setUser(userResult.value.data);
+
+          if (postsResult.status === 'fulfilled') {
+            setPosts(postsResult.value.data.items);
+            setPostsCursor(postsResult.value.data.next_cursor);
+          } else {
+            console.error('Error fetching posts:', postsResult.reason);
+          }
+
+          if (giftsResult.status === 'fulfilled') {
+            setGifts(giftsResult.value.data.items);
+          } else {
+            console.error('Error fetching gifts:', giftsResult.reason);
+          }
         } else {
           // If no user ID, use current user data
           setUser(currentUser);
@@ -47,6 +60,20 @@ const ProfilePage = ({ currentUser }) => {
     fetchData();
   }, [userId, currentUser]);
 
+  const loadMorePosts = async () => {
+    if (!postsCursor || isLoadingMore) return;
+    setIsLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/users/${user.id}/posts`, { params: { cursor: postsCursor } });
+      setPosts(prev => [...prev, ...response.data.items]);
+      setPostsCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error loading more posts:', error);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
   if (isLoading) {
     return (
       <div className="min-h-screen bg-black text-white flex items-center justify-center">
@@ -127,9 +154,20 @@ const ProfilePage = ({ currentUser }) => {
         {activeTab === 'posts' ? (
           <div className="space-y-4">
             {posts && posts.length > 0 ? (
-              posts.map(post => (
-                <PostItem key={post.id} post={post} user={user} />
-              ))
+              <>
+                {posts.map(post => (
+                  <PostItem key={post.id} post={post} user={user} />
+                ))}
+                {postsCursor && (
+                  <button
+                    className="w-full bg-gray-900 text-gray-300 py-3 rounded-lg hover:text-white transition-colors disabled:opacity-50"
+                    onClick={loadMorePosts}
+                    disabled={isLoadingMore}
+                  >
+                    {isLoadingMore ? 'Загрузка...' : 'Показать ещё'}
+                  </button>
+                )}
+              </>
             ) : (
               <div className="bg-gradient-to-br from-gray-900 to-gray-800 rounded-lg p-5 text-center">
                 <div className="flex flex-col items-center justify-center py-10">
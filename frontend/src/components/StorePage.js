@@ -47,26 +47,8 @@ const StorePage = ({ currentUser, telegramInitData }) => {
     setPurchaseStatus(`Обработка покупки товара ID: ${itemId}...`);
     try {
       // Backend needs to identify the user. 
-      // This could be done by sending initData again, or if backend uses sessions/JWTs from initial login.
-      // For simplicity, if your backend /create_invoice_link can re-validate initData or uses a session, great.
-      // Otherwise, you might need to pass telegramInitData or a session token.
-      // The backend `create_invoice_link` was defined with a dummy `current_user_tg_id` dependency.
-      // This needs to be replaced with actual authentication. For now, we assume backend handles it.
-      // Let's assume the backend will use the initData passed for authentication for this endpoint as well.
-      // We need to ensure the backend endpoint is set up to receive and validate it.
-      // For now, I will pass the telegramInitData in the request to the backend.
-      
-      const response = await axios.post(`${API_BASE_URL}/payments/create_invoice_link`, 
-        { store_item_id: itemId }, 
-        {
-          headers: {
-            // If you implemented JWT tokens after login, send it here:
-            // 'Authorization': `Bearer ${your_jwt_token}`
-            // If your backend re-validates initData for each protected call:
-            'X-Telegram-Init-Data': telegramInitData 
-          }
-        }
-      );
+      // App sets the session token (or initData) on every axios request.
+      const response = await axios.post(`${API_BASE_URL}/payments/create_invoice_link`, { store_item_id: itemId });
       
       const { invoice_url, payload } = response.data;
       console.log("Received invoice URL:", invoice_url, "Payload:", payload);
@@ -0,0 +1,553 @@
+"""
+Backend micro-benchmarks. They run in-process against the backend modules (no
+network, no Mongo) unless a scenario says otherwise.
+
+    python scripts/bench.py            # list scenarios
+    python scripts/bench.py auth       # run one scenario
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+SCENARIOS: Dict[str, Callable[[], None]] = {}
+
+
+def scenario(fn):
+    SCENARIOS[fn.__name__] = fn
+    return fn
+
+
+def per_call_us(fn: Callable[[], object], n: int) -> float:
+    fn()  # warm up caches/imports
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def async_per_call_us(make_coro: Callable[[], object], n: int) -> float:
+    async def run():
+        await make_coro()
+        started = time.perf_counter()
+        for _ in range(n):
+            await make_coro()
+        return (time.perf_counter() - started) / n * 1e6
+    return asyncio.run(run())
+
+
+class RoundTripCursor:
+    def __init__(self, cursor, owner):
+        self._cursor = cursor
+        self._owner = owner
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+
+        def chain(*args, **kwargs):
+            attr(*args, **kwargs)
+            return self
+        return chain
+
+    async def to_list(self, length=None):
+        self._owner.round_trips += 1
+        await asyncio.sleep(self._owner.rtt)
+        return await self._cursor.to_list(length=length)
+
+    def __aiter__(self):
+        async def iterate():
+            for doc in await self.to_list():
+                yield doc
+        return iterate()
+
+
+class RoundTripCollection:
+    """Wraps a (mongomock) collection, counting calls and adding a simulated network RTT to each."""
+
+    def __init__(self, collection, rtt: float):
+        self._collection = collection
+        self.rtt = rtt
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+        if name in ("find", "aggregate"):
+            return lambda *args, **kwargs: RoundTripCursor(attr(*args, **kwargs), self)
+
+        async def call(*args, **kwargs):
+            self.round_trips += 1
+            await asyncio.sleep(self.rtt)
+            return await attr(*args, **kwargs)
+        return call
+
+
+class RoundTripDB:
+    """Wraps a (mongomock) database so every collection call pays a simulated RTT."""
+
+    def __init__(self, db, rtt: float):
+        self._db = db
+        self._collections = {}
+        self.rtt = rtt
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = RoundTripCollection(self._db[name], self.rtt)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    @property
+    def round_trips(self) -> int:
+        return sum(c.round_trips for c in self._collections.values())
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def report(rows):
+    width = max(len(name) for name, _ in rows)
+    for name, value in rows:
+        print(f"  {name:<{width}}  {value}")
+
+
+@scenario
+def auth():
+    """Per-request auth cost: initData HMAC validation vs session token verification."""
+    import hashlib
+    import hmac
+    import json
+    from urllib.parse import urlencode
+
+    from auth_utils import decode_session_token, issue_session_token, session_secret, validate_init_data, webapp_secret_key
+
+    bot_token = "123456:BENCH"
+    fields = {"auth_date": str(int(time.time())), "query_id": "AAH", "user": json.dumps({"id": 42, "first_name": "Ada"})}
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    init_data = urlencode(fields)
+    token, _ = issue_session_token("user-1", "42", session_secret(bot_token))
+
+    def uncached():
+        webapp_secret_key.cache_clear()
+        validate_init_data(init_data, bot_token)
+
+    n = 20000
+    report([
+        ("validate_init_data, key derived per call", f"{per_call_us(uncached, n):8.2f} us"),
+        ("validate_init_data, cached secret key", f"{per_call_us(lambda: validate_init_data(init_data, bot_token, 86400), n):8.2f} us"),
+        ("decode_session_token (JWT HS256)", f"{per_call_us(lambda: decode_session_token(token, session_secret(bot_token)), n):8.2f} us"),
+    ])
+    print("  (initData callers additionally pay a users.find_one round trip; token callers do not)")
+
+
+@scenario
+def login():
+    """telegram_login DB cost: legacy find/update/find vs single find_one_and_update upsert (1ms simulated RTT)."""
+    from datetime import datetime
+
+    from mongomock_motor import AsyncMongoMockClient
+
+    import server
+    from migrations import run_migrations
+    from settings import Settings
+
+    async def legacy(users, tg_user):
+        existing = await users.find_one({"telegram_id": tg_user.id})
+        if existing:
+            await users.update_one({"telegram_id": tg_user.id}, {"$set": {"name": tg_user.first_name, "updated_at": datetime.utcnow()}})
+            return await users.find_one({"telegram_id": tg_user.id})
+        await users.insert_one(server.UserProfile(telegram_id=tg_user.id, name=tg_user.first_name).dict())
+
+    async def run():
+        rows = []
+        for label, flow in (("legacy find/update/find", "legacy"), ("find_one_and_update upsert", "upsert")):
+            db = AsyncMongoMockClient()[f"bench_{flow}"]
+            await run_migrations(db)
+            users = RoundTripCollection(db.users, rtt=0.001)
+
+            class DB:
+                def __getattr__(self, name):
+                    return users if name == "users" else getattr(db, name)
+            resources = server.Resources(Settings(), DB())
+            logins = [server.TelegramUserFromInitData(id=str(i % 200), first_name="U", auth_date=0) for i in range(1000)]
+            started = time.perf_counter()
+            for tg_user in logins:
+                if flow == "legacy":
+                    await legacy(users, tg_user)
+                else:
+                    await server.upsert_telegram_user(resources, tg_user)
+            elapsed = time.perf_counter() - started
+            rows.append((label, f"{users.round_trips / len(logins):.2f} round trips/login, {elapsed / len(logins) * 1000:.2f} ms/login"))
+        report(rows)
+
+    asyncio.run(run())
+
+
+@scenario
+def webhook():
+    """successful_payment webhooks: inline processing vs queue+ack (mongomock, 1ms simulated RTT, 500 updates, 50 concurrent)."""
+    import logging
+    from functools import partial
+
+    import httpx
+    from mongomock_motor import AsyncMongoMockClient
+
+    logging.disable(logging.WARNING)  # the webhook handler logs every update
+    import server
+    from migrations import run_migrations
+    from settings import Settings
+    from webhook_queue import WebhookQueue
+
+    updates, concurrency = 500, 50
+
+    async def seed(name):
+        raw = AsyncMongoMockClient()[name]
+        await run_migrations(raw)
+        item = server.StoreItem(name="Brush", description="b", price_stars=10, item_type="brush")
+        await raw.store_items.insert_one(item.dict())
+        for i in range(updates):
+            await raw.payment_transactions.insert_one(server.PaymentTransaction(
+                user_profile_id=f"u{i}", store_item_id=item.id, invoice_payload=f"p{i}", amount_stars=10).dict())
+        return raw, server.create_app(Settings(), db=RoundTripDB(raw, rtt=0.001))
+
+    def update(i):
+        return {"update_id": i, "message": {"successful_payment": {"invoice_payload": f"p{i}", "telegram_payment_charge_id": f"c{i}", "total_amount": 10, "currency": "XTR"}}}
+
+    async def fire(send):
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with semaphore:
+                started = time.perf_counter()
+                await send(i)
+                latencies.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(updates)))
+        return latencies, time.perf_counter() - started
+
+    async def run():
+        rows = []
+        raw, app = await seed("bench_inline")
+        resources = app.state.resources
+        latencies, elapsed = await fire(lambda i: server.process_webhook_update(resources, update(i)))
+        granted = await raw.user_inventory.count_documents({})
+        rows.append(("inline (ack after fulfillment)", f"ack p50 {percentile(latencies, 50):6.2f} ms  p99 {percentile(latencies, 99):6.2f} ms  "
+                     f"fulfilled {updates / elapsed:5.0f}/s ({granted} granted)"))
+
+        raw, app = await seed("bench_queue")
+        resources = app.state.resources
+        queue = resources.webhook_queue = WebhookQueue(
+            resources.db, partial(server.process_webhook_update, resources), workers=8, poll_interval=0.01
+        )
+        queue.start()
+        started = time.perf_counter()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            latencies, _ = await fire(lambda i: client.post("/api/payments/telegram_webhook", json=update(i)))
+        await queue.drain(timeout=120)
+        elapsed = time.perf_counter() - started
+        await queue.close()
+        granted = await raw.user_inventory.count_documents({})
+        rows.append(("queued (HTTP ack, 8 workers)", f"ack p50 {percentile(latencies, 50):6.2f} ms  p99 {percentile(latencies, 99):6.2f} ms  "
+                     f"fulfilled {updates / elapsed:5.0f}/s ({granted} granted)"))
+        report(rows)
+
+    asyncio.run(run())
+
+
+@scenario
+def feed():
+    """Home feed: fan-out-on-write timelines vs fan-out-on-read (mongomock, 1ms simulated RTT, 100 users x 20 follows, 500 posts)."""
+    import random
+    from datetime import datetime, timedelta
+
+    from mongomock_motor import AsyncMongoMockClient
+
+    from feed import FeedService
+    from migrations import run_migrations
+
+    users, follows_per_user, posts, reads = 100, 20, 500, 100
+    rng = random.Random(7)
+    graph = {f"u{i}": rng.sample([f"u{j}" for j in range(users) if j != i], follows_per_user) for i in range(users)}
+    start = datetime(2026, 1, 1)
+    post_docs = [{"id": f"p{i}", "user_id": f"u{rng.randrange(users)}", "type": "text", "content": "x",
+                  "created_at": start + timedelta(seconds=i)} for i in range(posts)]
+
+    async def run():
+        rows = []
+        # celebrity_threshold=0 turns every author into a fan-out-on-read author.
+        for label, threshold in (("fan-out-on-write", 10 ** 9), ("fan-out-on-read", 0)):
+            raw = AsyncMongoMockClient()[f"bench_feed_{threshold}"]
+            await run_migrations(raw)
+            await raw.users.insert_many([{"id": f"u{i}", "telegram_id": str(i), "name": "U"} for i in range(users)])
+            service = FeedService(raw, celebrity_threshold=threshold)
+            for follower, followees in graph.items():
+                for followee in followees:
+                    await service.follow(follower, followee)
+            started = time.perf_counter()
+            for doc in post_docs:
+                await raw.posts.insert_one(dict(doc))
+                await service.fanout_post(FeedService.timeline_entry(doc))
+            write_ms = (time.perf_counter() - started) / posts * 1000
+
+            service.db = RoundTripDB(raw, rtt=0.001)
+            latencies = []
+            for i in range(reads):
+                started = time.perf_counter()
+                page, cursor = await service.read_page(f"u{i % users}", None, 20)
+                await service.read_page(f"u{i % users}", cursor, 20)
+                latencies.append((time.perf_counter() - started) * 1000 / 2)
+            rows.append((label, f"write {write_ms:6.2f} ms/post  read p50 {percentile(latencies, 50):6.2f} ms  "
+                         f"p99 {percentile(latencies, 99):6.2f} ms  {service.db.round_trips / (2 * reads):.2f} round trips/page"))
+        report(rows)
+
+    asyncio.run(run())
+
+
+@scenario
+def search():
+    """User search at 200k users: prefix index query latency vs a regex scan (in-process, no Mongo)."""
+    import random
+    import re
+    import tracemalloc
+
+    from user_search import UserSearchIndex
+
+    rng = random.Random(11)
+    first = ["Anna", "Ivan", "Maria", "Alex", "Dmitry", "Olga", "Sergey", "Elena", "Pavel", "Nikita", "Zoë", "José", "Li", "Sam"]
+    syllables = ["ka", "ro", "mi", "to", "va", "len", "sha", "pe", "tro", "nov", "ski", "ber", "an", "ya"]
+
+    def surname():
+        return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+
+    users = [{"id": str(i), "name": f"{rng.choice(first)} {surname()}",
+              "username": f"{surname().lower()}{i}" if rng.random() < 0.7 else None,
+              "follower_count": int(rng.paretovariate(1.5))} for i in range(200000)]
+
+    started = time.perf_counter()
+    index = UserSearchIndex()
+    index.build(users)
+    build_s = time.perf_counter() - started
+    tracemalloc.start()
+    UserSearchIndex().build(users)
+    memory_mb = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    # "karo ivan" is out of order and takes the per-word intersection path.
+    queries = ["a", "an", "ann", "anna", "ivan ka", "karo", "zoe", "@mi", "tronov", "shaberya", "maria pe", "jose", "karo ivan"]
+    latencies = []
+    for _ in range(50):
+        for q in queries:
+            started = time.perf_counter()
+            index.search(q, limit=20)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    def regex_scan(q):
+        pattern = re.compile(re.escape(q), re.IGNORECASE)
+        return [u for u in users if pattern.search(u["name"]) or (u["username"] and pattern.search(u["username"]))][:20]
+
+    scan = []
+    for q in queries[:6]:
+        started = time.perf_counter()
+        regex_scan(q)
+        scan.append((time.perf_counter() - started) * 1000)
+
+    relogin = per_call_us(lambda: index.upsert(users[rng.randrange(200000)]), 2000)
+    renamed = per_call_us(lambda: index.upsert({"id": str(rng.randrange(200000)), "name": f"{rng.choice(first)} {surname()}"}), 2000)
+    report([
+        ("build 200k users", f"{build_s:6.2f} s, {memory_mb:.0f} MB peak traced"),
+        ("prefix index query", f"p50 {percentile(latencies, 50):6.3f} ms  p99 {percentile(latencies, 99):6.3f} ms  max {max(latencies):6.3f} ms"),
+        ("regex scan (collscan stand-in)", f"p50 {percentile(scan, 50):6.1f} ms"),
+        ("upsert, same name (login)", f"{relogin / 1000:6.3f} ms"),
+        ("upsert, renamed user", f"{renamed / 1000:6.3f} ms"),
+    ])
+
+
+@scenario
+def metrics():
+    """Instrumentation overhead: one ASGI request with/without MetricsMiddleware, and per-event recording cost."""
+    from types import SimpleNamespace
+
+    from fastapi import FastAPI
+
+    import metrics as m
+
+    def make_app(instrumented):
+        app = FastAPI()
+
+        @app.get("/api/posts/{post_id}")
+        async def get_post(post_id: str):
+            return {"id": post_id}
+
+        if instrumented:
+            app.add_middleware(m.MetricsMiddleware)
+        return app
+
+    async def call(app):
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+                 "path": "/api/posts/abc", "raw_path": b"/api/posts/abc", "root_path": "", "query_string": b"",
+                 "headers": [], "client": ("127.0.0.1", 1), "server": ("test", 80)}
+        await app(scope, receive, send)
+
+    plain, instrumented = make_app(False), make_app(True)
+    plain_us = async_per_call_us(lambda: call(plain), 20000)
+    instrumented_us = async_per_call_us(lambda: call(instrumented), 20000)
+
+    listener = m.MongoCommandMetrics(slow_ms=1000)
+    started_event = SimpleNamespace(command_name="find", request_id=1, connection_id=("db", 27017), command={"find": "posts"})
+    done_event = SimpleNamespace(command_name="find", request_id=1, connection_id=("db", 27017), duration_micros=900)
+
+    def mongo_event():
+        listener.started(started_event)
+        listener.succeeded(done_event)
+
+    for i in range(40):
+        m.HTTP_LATENCY.observe(0.01, "GET", f"/api/route{i}")
+    report([
+        ("request, no middleware", f"{plain_us:7.1f} us"),
+        ("request, MetricsMiddleware", f"{instrumented_us:7.1f} us  (+{instrumented_us - plain_us:.1f} us)"),
+        ("histogram observe", f"{per_call_us(lambda: m.HTTP_LATENCY.observe(0.012, 'GET', '/api/posts'), 200000):7.2f} us"),
+        ("mongo command started+succeeded", f"{per_call_us(mongo_event, 200000):7.2f} us"),
+        ("render /metrics (~40 routes)", f"{per_call_us(m.REGISTRY.render, 500) / 1000:7.2f} ms"),
+    ])
+
+
+@scenario
+def ratelimit():
+    """Rate limiter cost per request: memory backend vs Mongo backend (mongomock, plus 1ms simulated RTT)."""
+    from mongomock_motor import AsyncMongoMockClient
+
+    from rate_limit import Budget, MemoryRateLimitBackend, MongoRateLimitBackend, RateLimiter
+
+    budgets = {"posts": (Budget(1e9, 1), Budget(1e9, 1))}
+    counter = iter(range(10**9))
+
+    def check(limiter, users):
+        i = next(counter)
+        return limiter.check("posts", f"user-{i % users}", f"10.0.{i % 200}.1")
+
+    memory = RateLimiter(MemoryRateLimitBackend(), budgets)
+    # mongomock scans, so the Mongo backend is measured on a small key space;
+    # against a real server each bucket is an _id lookup and the cost is the round trips.
+    mongo = RateLimiter(MongoRateLimitBackend(AsyncMongoMockClient()["bench"]), budgets)
+    rtt_db = RoundTripDB(AsyncMongoMockClient()["bench"], rtt=0.001)
+    mongo_rtt = RateLimiter(MongoRateLimitBackend(rtt_db), budgets)
+    rtt_us = async_per_call_us(lambda: check(mongo_rtt, 50), 300)
+    report([
+        ("memory backend, 10k users (user + IP bucket)", f"{async_per_call_us(lambda: check(memory, 10000), 100000):8.2f} us"),
+        ("mongo backend, mongomock, 50 users", f"{async_per_call_us(lambda: check(mongo, 50), 2000):8.1f} us"),
+        ("mongo backend, 1ms RTT", f"{rtt_us / 1000:8.2f} ms, {rtt_db.round_trips / 301:.0f} round trips"),
+    ])
+
+
+@scenario
+def jsonpage():
+    """A 100-post page (2 KB content each) through FastAPI: model construction + response_model vs shaped docs + orjson/stdlib."""
+    from datetime import datetime
+    from typing import List
+
+    from fastapi import FastAPI
+
+    import fast_json
+    from server import Post
+
+    now = datetime.utcnow()
+    docs = [{"_id": i, "id": f"post-{i}", "user_id": "u1", "type": "text", "content": "x" * 2048, "likes": i,
+             "comment_count": 1, "comments": [{"id": "c", "user_id": "u2", "text": "nice", "created_at": now}],
+             "created_at": now, "updated_at": now} for i in range(100)]
+    shape = fast_json.DocumentShape(Post)
+    app = FastAPI()
+
+    @app.get("/before", response_model=List[Post])
+    async def before():
+        return [Post(**doc) for doc in docs]
+
+    @app.get("/after", response_model=List[Post])
+    async def after():
+        return fast_json.FastJSONResponse(shape.shape_all(docs))
+
+    async def call(path):
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            pass
+
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+                 "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+                 "headers": [], "client": ("127.0.0.1", 1), "server": ("test", 80)}
+        await app(scope, receive, send)
+
+    before_us = async_per_call_us(lambda: call("/before"), 300)
+    after_us = async_per_call_us(lambda: call("/after"), 1000)
+    orjson, fast_json.orjson = fast_json.orjson, None
+    try:
+        stdlib_us = async_per_call_us(lambda: call("/after"), 1000)
+    finally:
+        fast_json.orjson = orjson
+    report([
+        ("before: Post(**doc) + response_model", f"{before_us / 1000:7.2f} ms"),
+        ("after: shaped docs + orjson", f"{after_us / 1000:7.2f} ms  ({before_us / after_us:.1f}x)"),
+        ("after: shaped docs + json (no orjson)", f"{stdlib_us / 1000:7.2f} ms  ({before_us / stdlib_us:.1f}x)"),
+    ])
+
+
+
+@scenario
+def startup():
+    """Cold import of the backend in a fresh interpreter (median of 7), and create_app() on top of it."""
+    import statistics
+    import subprocess
+
+    backend = Path(__file__).resolve().parent.parent / "backend"
+
+    def cold(code):
+        runs = []
+        for _ in range(7):
+            out = subprocess.run([sys.executable, "-c", f"import time; t = time.perf_counter(); {code}; print(time.perf_counter() - t)"],
+                                 cwd=backend, capture_output=True, text=True, check=True).stdout
+            runs.append(float(out) * 1000)
+        return statistics.median(runs)
+
+    framework = cold("import fastapi, motor.motor_asyncio, httpx")
+    imported = cold("import server")
+    created = cold("import server; server.create_app(server.Settings())")
+    report([
+        ("fastapi + motor + httpx (floor)", f"{framework:6.0f} ms"),
+        ("import server", f"{imported:6.0f} ms  (+{imported - framework:.0f} ms over the floor)"),
+        ("import server + create_app()", f"{created:6.0f} ms"),
+    ])
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in SCENARIOS:
+        print(__doc__)
+        for name, fn in SCENARIOS.items():
+            print(f"  {name:<12} {(fn.__doc__ or '').strip()}")
+        return 2
+    print(f"{argv[1]}: {(SCENARIOS[argv[1]].__doc__ or '').strip()}")
+    SCENARIOS[argv[1]]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
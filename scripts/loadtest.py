@@ -0,0 +1,189 @@
+"""
+HTTP load test against a running backend, a side-by-side comparison of launch
+modes, or an offline replay of synthetic user traffic.
+
+    python scripts/loadtest.py run --url http://127.0.0.1:8001 --path /api/store_items
+    python scripts/loadtest.py compare --path / --workers 4
+    python scripts/loadtest.py offline --users 200 --concurrency 16
+
+`compare` starts the backend twice on a free port - once as the old entrypoint
+did (`uvicorn server:app`, one process, default loop) and once the way
+entrypoint.sh does now (`--workers N`, uvloop/httptools when installed) - and
+runs the same closed-loop load against each. The load generator is a single
+asyncio process, so give it its own cores (`taskset`) when the
+machine is small, otherwise it competes with the workers being measured.
+
+`offline` needs no server, Mongo or bot token: synthetic users log in, post,
+read their wall, create an invoice link and pay through the pre-checkout and
+payment webhooks, against the app in process over mongomock and a fake Bot API
+(scripts/offline.py). It reports p50/p99 and throughput per route.
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run_load(url: str, path: str, concurrency: int, duration: float) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        async def user():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    ok = response.status_code < 500
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, errors, elapsed)
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    if not latencies:
+        return {"requests": 0, "errors": errors, "rps": 0.0, "p50_ms": 0.0, "p99_ms": 0.0}
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def print_result(label: str, result: Dict[str, float], width: int = 28) -> None:
+    print(f"  {label:<{width}} {result['rps']:8.0f} req/s  p50 {result['p50_ms']:7.2f} ms  "
+          f"p99 {result['p99_ms']:7.2f} ms  ({result['requests']} ok, {result['errors']} errors)")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url: str, path: str, proc: subprocess.Popen, timeout: float) -> float:
+    """Poll `path` until it answers; returns the seconds it took."""
+    started = time.monotonic()
+    deadline = started + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"backend exited with {proc.returncode} during startup")
+        try:
+            if httpx.get(url + path, timeout=1).status_code < 500:
+                return time.monotonic() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"backend not ready after {timeout}s")
+
+
+def launch_args(mode: str, port: int, workers: int) -> List[str]:
+    target = ["--factory", "server:create_app"] if mode == "workers" else ["server:app"]
+    args = [sys.executable, "-m", "uvicorn", *target, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    if mode == "workers":
+        args += ["--workers", str(workers)]
+        args += ["--loop", "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"]
+        args += ["--http", "httptools" if importlib.util.find_spec("httptools") else "h11"]
+    return args
+
+
+def compare(opts) -> None:
+    env = {**os.environ, "RUN_MIGRATIONS_ON_STARTUP": "0", "PAYMENT_REAPER_ENABLED": "0"}
+    print(f"GET {opts.path}, {opts.concurrency} concurrent, {opts.duration:.0f}s per mode, {os.cpu_count()} CPUs")
+    for mode, label in (("single", "single process (old)"), ("workers", f"{opts.workers} workers (entrypoint.sh)")):
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        proc = subprocess.Popen(launch_args(mode, port, opts.workers), cwd=BACKEND_DIR, env=env)
+        try:
+            ready_in = wait_ready(url, opts.ready_path, proc, opts.ready_timeout)
+            asyncio.run(run_load(url, opts.path, opts.concurrency, 1.0))  # warm up
+            print_result(label, asyncio.run(run_load(url, opts.path, opts.concurrency, opts.duration)))
+            print(f"  {'':<28} ready after {ready_in:.1f}s")
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+
+async def run_offline(opts) -> None:
+    from offline import OfflineStack, replay
+
+    print(f"offline: {opts.users} users, {opts.concurrency} concurrent, {opts.posts} posts each, "
+          f"fake Bot API latency {opts.bot_latency * 1000:.0f} ms")
+    async with OfflineStack(bot_latency=opts.bot_latency) as stack:
+        # Warm up with users the measured run doesn't reuse.
+        await replay(stack, min(opts.users, opts.concurrency), opts.concurrency, opts.posts, first_user=opts.users)
+        await stack.drain()
+        stack.bot_api.calls.clear()
+        recorder, elapsed = await replay(stack, opts.users, opts.concurrency, opts.posts)
+        await stack.drain()
+        granted = await stack.db.user_inventory.count_documents({"user_profile_id": {"$in": recorder.user_ids}})
+    # Throughput per route is its completed requests over the whole replay's wall time.
+    labels = sorted(set(recorder.latencies) | set(recorder.errors))
+    for label in labels:
+        print_result(label, summarize(recorder.latencies[label], recorder.errors[label], elapsed), max(map(len, labels)))
+    total = sum(len(samples) for samples in recorder.latencies.values())
+    print(f"  {total} requests in {elapsed:.1f}s ({total / elapsed:.0f} req/s), "
+          f"{stack.bot_api.count('createInvoiceLink')} invoice links and "
+          f"{stack.bot_api.count('answerPreCheckoutQuery')} pre-checkout answers sent to the fake Bot API, "
+          f"{granted} items granted")
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("run", "compare"):
+        p = sub.add_parser(name)
+        p.add_argument("--path", default="/")
+        p.add_argument("--concurrency", type=int, default=64)
+        p.add_argument("--duration", type=float, default=10.0)
+        if name == "run":
+            p.add_argument("--url", default="http://127.0.0.1:8001")
+        else:
+            p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+            p.add_argument("--ready-path", default="/")
+            p.add_argument("--ready-timeout", type=float, default=60.0)
+    p = sub.add_parser("offline")
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--posts", type=int, default=1, help="posts per user")
+    p.add_argument("--bot-latency", type=float, default=0.05, help="seconds the fake Bot API takes per call")
+    opts = parser.parse_args(argv[1:])
+    if opts.command == "run":
+        print_result(f"GET {opts.path}", asyncio.run(run_load(opts.url, opts.path, opts.concurrency, opts.duration)))
+    elif opts.command == "offline":
+        asyncio.run(run_offline(opts))
+    else:
+        compare(opts)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,193 @@
+"""
+The real app (`server.create_app`) with nothing outside the process: Mongo is
+mongomock_motor, the Bot API is `FakeBotAPI` behind an httpx transport and
+requests go through `httpx.ASGITransport`. Used by the integration tests and by
+`scripts/loadtest.py offline`.
+
+    async with OfflineStack() as stack:
+        recorder, elapsed = await replay(stack, users=50, concurrency=16)
+
+The lifespan runs as in production (migrations, webhook and fan-out workers,
+invoice pool), except for the periodic reaper/snapshotter and the rate limiter,
+which would otherwise reject a synthetic crowd sharing one client address.
+Latencies measure the app and its in-memory stand-ins: they are for comparing
+code paths with each other, not for predicting production numbers.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+import server
+from external_integrations.telegram_bot_api import TelegramBotAPIClient, TelegramClientConfig
+from rate_limit import MemoryRateLimitBackend, RateLimiter
+from settings import Settings
+
+BOT_TOKEN = "123456:OFFLINE-TOKEN"
+ADMIN_TOKEN = "offline-admin"
+PARTIAL_UNIQUE_INDEXES = [("payment_transactions", "charge_id_unique"), ("payment_transactions", "update_id_unique")]
+STORE_ITEMS = [
+    server.StoreItem(id="brush", name="Brush", description="A brush", price_stars=10, item_type="brush"),
+    server.StoreItem(id="frame", name="Frame", description="A frame", price_stars=25, item_type="frame"),
+]
+
+
+def sign_init_data(telegram_id: int, first_name: str = "Load", bot_token: str = BOT_TOKEN, auth_date: Optional[int] = None) -> str:
+    """initData as the Telegram client would send it, signed with `bot_token`."""
+    fields = {
+        "auth_date": str(auth_date if auth_date is not None else int(time.time())),
+        "query_id": f"AAH{telegram_id}",
+        "user": json.dumps({"id": telegram_id, "first_name": first_name, "username": f"user{telegram_id}"}),
+    }
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+class FakeBotAPI:
+    """
+    Answers Bot API calls in process and records them. createInvoiceLink returns
+    a fresh link, every other method `{"ok": true, "result": true}`. `latency`
+    delays each answer to stand in for the round trip to api.telegram.org.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.transport = httpx.MockTransport(self._handle)
+
+    async def _handle(self, request: httpx.Request) -> httpx.Response:
+        method = request.url.path.rsplit("/", 1)[-1]
+        body = json.loads(request.content or b"null") or {}
+        self.calls.append((method, body))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "createInvoiceLink":
+            return httpx.Response(200, json={"ok": True, "result": f"https://t.me/$offline-{len(self.calls)}"})
+        return httpx.Response(200, json={"ok": True, "result": True})
+
+    def count(self, method: str) -> int:
+        return sum(1 for name, _ in self.calls if name == method)
+
+
+class OfflineStack:
+    """Builds the app over fresh in-memory state and runs its lifespan while entered."""
+
+    def __init__(self, bot_latency: float = 0.0, settings: Optional[Settings] = None):
+        import mongomock_motor
+
+        self.settings = settings or Settings(
+            telegram_bot_token=BOT_TOKEN,
+            admin_api_token=ADMIN_TOKEN,
+            payment_reaper_enabled=False,
+            stars_snapshotter_enabled=False,
+        )
+        self.db = mongomock_motor.AsyncMongoMockClient()[self.settings.db_name]
+        self.bot_api = FakeBotAPI(bot_latency)
+        self.app = server.create_app(self.settings, db=self.db)
+        self.resources = self.app.state.resources
+        self.resources.telegram_client = TelegramBotAPIClient(
+            TelegramClientConfig(bot_token=BOT_TOKEN), transport=self.bot_api.transport)
+        self.resources.rate_limiter = RateLimiter(MemoryRateLimitBackend(), {}, enabled=False)
+        self.client: Optional[httpx.AsyncClient] = None
+        self._lifespan = None
+
+    async def __aenter__(self) -> "OfflineStack":
+        # Seeded before startup so the invoice pool sees the catalog on its first pass.
+        await self.db.store_items.insert_many([item.dict() for item in STORE_ITEMS])
+        self._lifespan = self.app.router.lifespan_context(self.app)
+        await self._lifespan.__aenter__()
+        await self._drop_partial_unique_indexes()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url="http://offline")
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.client.aclose()
+        await self._lifespan.__aexit__(*exc)
+
+    async def _drop_partial_unique_indexes(self) -> None:
+        # mongomock drops partialFilterExpression, so these would reject the
+        # second pending transaction (charge id and update id still None). Real
+        # Mongo enforces them; offline runs go without.
+        for collection, index in PARTIAL_UNIQUE_INDEXES:
+            await self.db[collection].drop_index(index)
+
+    async def drain(self) -> None:
+        """Wait for queued webhook updates and feed fan-out jobs."""
+        await self.resources.get_webhook_queue().drain()
+        await self.resources.get_feed_fanout_queue().drain()
+
+
+class Recorder:
+    """Latency samples and error counts per route label ("POST /api/posts")."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.user_ids: List[str] = []
+
+    async def request(self, client: httpx.AsyncClient, label: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        if response.status_code >= 400:
+            self.errors[label] += 1
+            return None
+        self.latencies[label].append(time.perf_counter() - started)
+        return response
+
+
+async def user_journey(stack: OfflineStack, recorder: Recorder, n: int, posts: int = 1) -> None:
+    """One synthetic user: log in, post, read the wall, buy an item through the webhook flow."""
+    client = stack.client
+    login = await recorder.request(client, "POST /api/auth/telegram_login", "POST", "/api/auth/telegram_login",
+                                   json={"init_data_str": sign_init_data(1_000_000 + n)})
+    if login is None:
+        return
+    profile = login.json()
+    recorder.user_ids.append(profile["id"])
+    headers = {"Authorization": f"Bearer {profile['session_token']}"}
+    for i in range(posts):
+        await recorder.request(client, "POST /api/posts", "POST", "/api/posts", headers=headers,
+                               json={"user_id": profile["id"], "type": "text", "content": f"post {i} from user {n}"})
+    await recorder.request(client, "GET /api/users/{user_id}/posts", "GET", f"/api/users/{profile['id']}/posts")
+
+    item = STORE_ITEMS[n % len(STORE_ITEMS)]
+    invoice = await recorder.request(client, "POST /api/payments/create_invoice_link", "POST", "/api/payments/create_invoice_link",
+                                     headers=headers, json={"store_item_id": item.id})
+    if invoice is None:
+        return
+    payload = invoice.json()["payload"]
+    await recorder.request(client, "POST /api/payments/telegram_webhook (pre_checkout)", "POST", "/api/payments/telegram_webhook",
+                           json={"update_id": 2 * n, "pre_checkout_query": {
+                               "id": f"pcq-{n}", "invoice_payload": payload, "currency": "XTR", "total_amount": item.price_stars}})
+    await recorder.request(client, "POST /api/payments/telegram_webhook (payment)", "POST", "/api/payments/telegram_webhook",
+                           json={"update_id": 2 * n + 1, "message": {"successful_payment": {
+                               "invoice_payload": payload, "telegram_payment_charge_id": f"charge-{n}",
+                               "currency": "XTR", "total_amount": item.price_stars}}})
+
+
+async def replay(stack: OfflineStack, users: int, concurrency: int, posts: int = 1, first_user: int = 0) -> Tuple[Recorder, float]:
+    """Run `users` journeys, at most `concurrency` at a time; returns the samples and the wall time."""
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(n: int) -> None:
+        async with semaphore:
+            await user_journey(stack, recorder, n, posts)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(first_user, first_user + users)))
+    return recorder, time.perf_counter() - started
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import httpx
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from metrics import REGISTRY
+from settings import Settings
+
+
+def test_import_has_no_side_effects():
+    env = {**os.environ, "TELEGRAM_BOT_TOKEN": "999:do-not-log"}
+    code = "import sys, server; print(sorted(m for m in ('dotenv', 'PIL') if m in sys.modules), server._default_app)"
+    done = subprocess.run([sys.executable, "-c", code], cwd=server.ROOT_DIR, env=env, capture_output=True, text=True, check=True)
+    assert done.stdout.strip() == "[] None"
+    assert "do-not-log" not in done.stderr
+
+
+def test_settings_from_env():
+    settings = Settings.from_env({"DB_NAME": "other", "PAYMENT_REAPER_ENABLED": "0", "LIKES_WRITE_BEHIND": "1", "SESSION_TTL_SECONDS": "60",
+                                  "SESSION_SECRET": "s3cret"})
+    assert settings.db_name == "other" and settings.session_ttl_seconds == 60 and settings.session_secret == "s3cret"
+    assert not settings.payment_reaper_enabled and settings.likes_write_behind
+    assert settings.run_migrations_on_startup and not settings.trust_forwarded_for
+    assert settings.gift_prices == {} and settings.gift_bulk_max_receivers == 100 and settings.comment_preview_count == 3
+    settings = Settings.from_env({"GIFT_PRICES": "flower=5, star=25", "GIFT_BULK_MAX_RECEIVERS": "10", "COMMENT_PREVIEW_COUNT": "5"})
+    assert settings.gift_prices == {"flower": 5, "star": 25}
+    assert settings.gift_bulk_max_receivers == 10 and settings.comment_preview_count == 5
+
+
+def test_apps_are_isolated():
+    dbs = [mongomock_motor.AsyncMongoMockClient()[f"tgwall_{i}"] for i in range(2)]
+    for db in dbs:
+        asyncio.run(db.users.insert_one({"id": "u1", "telegram_id": "1", "name": "U"}))
+    asyncio.run(dbs[0].posts.insert_one(server.Post(user_id="u1", type="text", content="hi").dict()))
+
+    async def posts(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return (await client.get("/api/posts/u1")).json()
+
+    assert [len(asyncio.run(posts(server.create_app(Settings(), db=db)))) for db in dbs] == [1, 0]
+
+
+def test_lifespan_starts_and_closes_resources():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    app = server.create_app(Settings(payment_reaper_enabled=False, stars_snapshotter_enabled=False), db=db)
+    resources = app.state.resources
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            started = (resources.webhook_queue is not None, resources.service_metrics in REGISTRY._collectors,
+                       "schema_migrations" in await db.list_collection_names())
+        return started
+
+    assert asyncio.run(run()) == (True, True, True)
+    assert resources.service_metrics not in REGISTRY._collectors
+    assert resources.payment_reaper is None and resources.telegram_client is None
@@ -0,0 +1,58 @@
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+from auth_utils import decode_session_token, issue_session_token, session_secret, validate_init_data, webapp_secret_key
+
+BOT_TOKEN = "123456:TEST-TOKEN"
+
+
+def make_init_data(user_id=42, auth_date=None, bot_token=BOT_TOKEN):
+    fields = {
+        "auth_date": str(auth_date if auth_date is not None else int(time.time())),
+        "query_id": "AAH",
+        "user": json.dumps({"id": user_id, "first_name": "Ada", "username": "ada"}),
+    }
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def test_validate_init_data_accepts_signed_and_rejects_tampered():
+    init_data = make_init_data()
+    user = validate_init_data(init_data, BOT_TOKEN)
+    assert user["id"] == "42"
+    assert validate_init_data(init_data.replace("Ada", "Eve"), BOT_TOKEN) is None
+    assert validate_init_data(init_data, "999:OTHER") is None
+
+
+def test_validate_init_data_freshness_window():
+    stale = make_init_data(auth_date=int(time.time()) - 7200)
+    assert validate_init_data(stale, BOT_TOKEN) is not None
+    assert validate_init_data(stale, BOT_TOKEN, max_age_seconds=3600) is None
+    assert validate_init_data(make_init_data(), BOT_TOKEN, max_age_seconds=3600) is not None
+
+
+def test_secret_key_is_cached_per_bot_token():
+    webapp_secret_key.cache_clear()
+    for _ in range(5):
+        validate_init_data(make_init_data(), BOT_TOKEN)
+    info = webapp_secret_key.cache_info()
+    assert info.misses == 1 and info.hits == 4
+
+
+def test_session_token_round_trip_and_expiry():
+    secret = session_secret(BOT_TOKEN)
+    token, _ = issue_session_token("user-1", "42", secret)
+    assert decode_session_token(token, secret)["sub"] == "user-1"
+    assert decode_session_token(token, b"another-secret") is None
+    expired, _ = issue_session_token("user-1", "42", secret, ttl_seconds=-10)
+    assert decode_session_token(expired, secret) is None
+
+
+def test_configured_session_secret_wins():
+    assert session_secret(BOT_TOKEN, "from-settings") == b"from-settings"
+    assert session_secret(BOT_TOKEN, None) == session_secret(BOT_TOKEN) != session_secret("999:OTHER")
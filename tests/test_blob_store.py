@@ -0,0 +1,86 @@
+import asyncio
+import base64
+
+import httpx
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from blob_store import BlobError, LocalBlobStore, blob_key_for, decode_data_url, parse_range_header
+from settings import Settings
+
+DATA = bytes(range(256)) * 40  # 10240 bytes
+
+
+def test_concurrent_identical_puts_store_one_file(tmp_path):
+    store = LocalBlobStore(tmp_path)
+
+    async def put_many():
+        return await asyncio.gather(*(store.put(DATA, "image/png") for _ in range(20)))
+
+    keys = asyncio.run(put_many())
+    assert set(keys) == {blob_key_for(DATA, "image/png")}
+    files = [p for p in tmp_path.rglob("*") if p.is_file()]
+    assert [p.name for p in files] == [keys[0]]
+    assert files[0].read_bytes() == DATA
+    assert asyncio.run(store.put(DATA, "image/png")) == keys[0]
+
+
+def test_decode_data_url():
+    url = "data:image/png;base64," + base64.b64encode(b"png").decode()
+    assert decode_data_url(url) == (b"png", "image/png")
+    for bad in ("data:text/html;base64,PGI+", "data:image/png;base64,@@@", "https://example.com/x.png"):
+        with pytest.raises(BlobError):
+            decode_data_url(bad)
+
+
+@pytest.mark.parametrize("header,expected", [
+    (None, None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=0-1,5-6", None),   # multipart ranges: serve everything
+    ("items=0-1", None),
+    ("bytes=abc-", None),
+    ("bytes=500-100", None),   # last < first is invalid, not unsatisfiable
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(BlobError):
+        parse_range_header(header, 1000)
+
+
+def test_blob_endpoint_ranges_and_conditionals(tmp_path):
+    app = server.create_app(Settings(), db=mongomock_motor.AsyncMongoMockClient()["tgwall_test"])
+    store = app.state.resources.blob_store = LocalBlobStore(tmp_path)
+    key = asyncio.run(store.put(DATA, "image/png"))
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            url = f"/api/blobs/{key}"
+            full = await client.get(url)
+            etag = full.headers["etag"]
+            return full, [await client.get(url, headers=h) for h in (
+                {"Range": "bytes=10-19"},
+                {"If-None-Match": etag},
+                {"Range": "bytes=20000-"},
+                {"Range": "bytes=50-10"},
+                {"Range": "bytes=10-19", "If-Range": '"stale"'},
+            )], await client.get("/api/blobs/" + "0" * 64 + ".png")
+
+    full, (partial, not_modified, unsatisfiable, invalid, stale), missing = asyncio.run(run())
+    assert full.status_code == 200 and full.content == DATA
+    assert full.headers["content-type"] == "image/png" and "immutable" in full.headers["cache-control"]
+    assert partial.status_code == 206 and partial.content == DATA[10:20]
+    assert partial.headers["content-range"] == f"bytes 10-19/{len(DATA)}"
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert unsatisfiable.status_code == 416 and unsatisfiable.headers["content-range"] == f"bytes */{len(DATA)}"
+    assert invalid.status_code == 200 and invalid.content == DATA
+    assert stale.status_code == 200
+    assert missing.status_code == 404
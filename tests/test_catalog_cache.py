@@ -0,0 +1,99 @@
+import asyncio
+import types
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import catalog_cache
+import server
+from catalog_cache import CatalogCache
+from settings import Settings
+
+ADMIN_TOKEN = "admin-test"
+T0 = datetime(2025, 5, 1, 12)
+
+
+def item(item_id, i=0, **fields):
+    return server.StoreItem(id=item_id, name=item_id.title(), description="x", price_stars=10,
+                            item_type="brush", created_at=T0 + timedelta(seconds=i), **fields).dict()
+
+
+@pytest.fixture
+def db():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    asyncio.run(db.store_items.insert_many([item("brush", 0), item("frame", 1, is_active=False)]))
+    return db
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Only the cache's notion of time moves; the event loop keeps the real one.
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(catalog_cache, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def ids(view):
+    return [i["id"] for i in view.items]
+
+
+def test_version_bump_from_another_worker_reloads(db, clock):
+    reader = CatalogCache(db, ttl=300, version_check_interval=2)
+    writer = CatalogCache(db, ttl=300, version_check_interval=2)
+
+    async def scenario():
+        before = ids(await reader.view(active_only=True))
+        await db.store_items.insert_one(item("theme", 2))
+        await writer.invalidate()
+        within_interval = ids(await reader.view(active_only=True))
+        clock.now += 2
+        after = await reader.view(active_only=False)
+        return before, within_interval, after
+
+    before, within_interval, after = asyncio.run(scenario())
+    assert before == within_interval == ["brush"]
+    assert ids(after) == ["brush", "frame", "theme"]
+    assert reader.reloads == 2
+
+
+def test_unversioned_edit_is_picked_up_after_ttl(db, clock):
+    cache = CatalogCache(db, ttl=60, version_check_interval=2)
+
+    async def scenario():
+        first = await cache.get_item("brush")
+        await db.store_items.update_one({"id": "brush"}, {"$set": {"price_stars": 99}})
+        clock.now += 30
+        stale = await cache.get_item("brush")
+        clock.now += 30
+        fresh = await cache.get_item("brush")
+        return first, stale, fresh
+
+    first, stale, fresh = asyncio.run(scenario())
+    assert first["price_stars"] == stale["price_stars"] == 10
+    assert fresh["price_stars"] == 99
+    assert cache.reloads == 2
+
+
+def test_store_items_etag_round_trip(db):
+    app = server.create_app(Settings(admin_api_token=ADMIN_TOKEN), db=db)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.get("/api/store_items")
+            etag = first.headers["etag"]
+            unchanged = await client.get("/api/store_items", headers={"If-None-Match": f'"other", {etag}'})
+            await client.patch("/api/store_items/brush", json={"price_stars": 15}, headers={"X-Admin-Token": ADMIN_TOKEN})
+            changed = await client.get("/api/store_items", headers={"If-None-Match": etag})
+            return first, unchanged, changed
+
+    first, unchanged, changed = asyncio.run(run())
+    assert first.status_code == 200 and [i["id"] for i in first.json()] == ["brush"]
+    assert unchanged.status_code == 304 and unchanged.content == b""
+    assert unchanged.headers["etag"] == first.headers["etag"]
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != first.headers["etag"]
+    assert changed.json()[0]["price_stars"] == 15
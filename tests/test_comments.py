@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from auth_utils import issue_session_token, session_secret
+from comments import COMMENT_PREVIEW_COUNT, add_comment
+from migrations import run_migrations
+from settings import Settings
+
+BOT_TOKEN = "123:test"
+T0 = datetime(2025, 5, 1, 12)
+
+
+@pytest.fixture
+def db():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    asyncio.run(run_migrations(db))
+    asyncio.run(db.posts.insert_one(server.Post(id="p1", user_id="u1", type="text", content="hi").dict()))
+    return db
+
+
+def comment(i, post_id="p1"):
+    return server.Comment(id=f"c{i:02d}", post_id=post_id, user_id="u2", text=f"comment {i}",
+                          created_at=T0 + timedelta(seconds=i // 2)).dict()
+
+
+def test_counts_every_comment_and_caps_the_preview(db):
+    async def scenario():
+        results = await asyncio.gather(*(add_comment(db, comment(i)) for i in range(7)))
+        return results, await db.posts.find_one({"id": "p1"}), await db.comments.count_documents({"post_id": "p1"})
+
+    results, post, stored = asyncio.run(scenario())
+    assert all(results)
+    assert post["comment_count"] == stored == 7
+    assert [c["id"] for c in post["comments"]] == [f"c{i:02d}" for i in range(COMMENT_PREVIEW_COUNT)]
+
+
+def test_preview_size_is_configurable(db):
+    for i in range(4):
+        asyncio.run(add_comment(db, comment(i), preview_count=2))
+    post = asyncio.run(db.posts.find_one({"id": "p1"}))
+    assert post["comment_count"] == 4 and [c["id"] for c in post["comments"]] == ["c00", "c01"]
+
+
+def test_comment_on_missing_post_is_rolled_back(db):
+    assert asyncio.run(add_comment(db, comment(1, post_id="nope"))) is False
+    assert asyncio.run(db.comments.count_documents({})) == 0
+
+
+def test_endpoints_create_and_page_oldest_first(db):
+    for i in range(5):
+        asyncio.run(add_comment(db, comment(i)))
+    token, _ = issue_session_token("u2", "2", session_secret(BOT_TOKEN))
+    app = server.create_app(Settings(telegram_bot_token=BOT_TOKEN), db=db)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers={"Authorization": f"Bearer {token}"}) as client:
+            created = await client.post("/api/posts/p1/comments", json={"user_id": "u2", "text": "latest"})
+            missing = await client.post("/api/posts/nope/comments", json={"user_id": "u2", "text": "x"})
+            spoofed = await client.post("/api/posts/p1/comments", json={"user_id": "u1", "text": "x"})
+            pages, cursor = [], None
+            while True:
+                params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+                page = (await client.get("/api/posts/p1/comments", params=params)).json()
+                pages.append([c["text"] for c in page["items"]])
+                cursor = page["next_cursor"]
+                if not cursor:
+                    break
+            bad = await client.get("/api/posts/p1/comments", params={"cursor": "garbage"})
+            return created, missing, spoofed, pages, bad
+
+    created, missing, spoofed, pages, bad = asyncio.run(run())
+    assert created.status_code == 201
+    assert missing.status_code == 404 and spoofed.status_code == 403
+    assert pages == [["comment 0", "comment 1"], ["comment 2", "comment 3"], ["comment 4", "latest"]]
+    assert bad.status_code == 400
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from entitlements import EntitlementService
+from settings import Settings
+
+
+class CountingInventory:
+    """Wraps user_inventory and counts `distinct` calls (one per cache load)."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.distinct_calls = 0
+
+    async def distinct(self, *args, **kwargs):
+        self.distinct_calls += 1
+        await asyncio.sleep(0)
+        return await self._collection.distinct(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+class CountingDB:
+    def __init__(self, db):
+        self.user_inventory = CountingInventory(db.user_inventory)
+
+
+def grant(db, user_id, item_id):
+    return db.user_inventory.insert_one(server.UserInventoryItem(
+        user_profile_id=user_id, store_item_id=item_id, item_name=item_id,
+        telegram_payment_charge_id=f"charge-{user_id}-{item_id}").dict())
+
+
+def test_has_item_is_served_from_the_cache():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    counting = CountingDB(db)
+    service = EntitlementService(counting, negative_recheck=60)
+
+    async def scenario():
+        await grant(db, "user-1", "brush")
+        answers = await asyncio.gather(*(service.has_item("user-1", "brush") for _ in range(20)))
+        answers += [await service.has_item("user-1", "theme") for _ in range(20)]
+        return answers
+
+    answers = asyncio.run(scenario())
+    assert answers == [True] * 20 + [False] * 20
+    assert counting.user_inventory.distinct_calls == 1
+
+
+def test_lru_evicts_least_recently_used_user():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    service = EntitlementService(db, max_users=2)
+
+    async def scenario():
+        for user in ("a", "b", "a", "c"):
+            await service.owned_items(user)
+
+    asyncio.run(scenario())
+    assert list(service._cache) == ["a", "c"]
+
+
+def test_invalidate_during_a_load_keeps_the_stale_read_out_of_the_cache():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    counting = CountingDB(db)
+    service = EntitlementService(counting, negative_recheck=3600)
+    read_done, resume = asyncio.Event(), asyncio.Event()
+    distinct = counting.user_inventory.distinct
+
+    async def paused_distinct(*args, **kwargs):
+        items = await distinct(*args, **kwargs)
+        read_done.set()
+        await resume.wait()
+        return items
+
+    counting.user_inventory.distinct = paused_distinct
+
+    async def scenario():
+        load = asyncio.create_task(service.owned_items("user-1"))
+        await read_done.wait()
+        await grant(db, "user-1", "brush")
+        service.invalidate("user-1")
+        resume.set()
+        stale = await load
+        return stale, "user-1" in service._cache, await service.has_item("user-1", "brush")
+
+    assert asyncio.run(scenario()) == (frozenset(), False, True)
+    assert counting.user_inventory.distinct_calls == 2
+
+
+def test_successful_payment_invalidates_cached_entitlements():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    resources = server.Resources(Settings(), db)
+    # A long negative recheck: only the invalidation can make the new item visible.
+    resources.entitlements = EntitlementService(db, negative_recheck=3600)
+
+    async def scenario():
+        await db.store_items.insert_one(server.StoreItem(
+            id="brush", name="Brush", description="A brush", price_stars=10, item_type="brush").dict())
+        await db.payment_transactions.insert_one(server.PaymentTransaction(
+            user_profile_id="user-1", store_item_id="brush", invoice_payload="payload-1", amount_stars=10).dict())
+        before = await server.has_item(resources, "user-1", "brush")
+        await server.fulfill_successful_payment(resources, "payload-1", "charge-1", 1)
+        return before, await server.has_item(resources, "user-1", "brush")
+
+    assert asyncio.run(scenario()) == (False, True)
+
+
+def test_grant_inside_the_transaction_leaves_the_cache_alone():
+    # Invalidating inside the transaction would let a concurrent reload cache the
+    # pre-commit inventory; fulfill_successful_payment invalidates after commit.
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    resources = server.Resources(Settings(), db)
+    resources.entitlements = EntitlementService(db, negative_recheck=3600)
+    transaction = server.PaymentTransaction(user_profile_id="user-1", store_item_id="brush", invoice_payload="payload-1",
+                                            amount_stars=10, telegram_payment_charge_id="charge-1")
+
+    async def scenario():
+        await db.store_items.insert_one(server.StoreItem(
+            id="brush", name="Brush", description="A brush", price_stars=10, item_type="brush").dict())
+        await resources.entitlements.owned_items("user-1")
+        await server.grant_inventory_item(resources, transaction, None)
+        return "user-1" in resources.entitlements._cache, await db.user_inventory.count_documents({"user_profile_id": "user-1"})
+
+    assert asyncio.run(scenario()) == (True, 1)
@@ -0,0 +1,57 @@
+import asyncio
+import json
+from datetime import datetime
+
+import httpx
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import fast_json
+import server
+from fast_json import DocumentShape, dumps
+from settings import Settings
+
+CREATED = datetime(2025, 5, 1, 12, 30, 15, 123000)
+
+
+def stored_post(i, **extra):
+    return {"_id": f"oid-{i}", "id": f"p{i}", "user_id": "u1", "type": "text", "content": f"пост {i} \"quoted\"",
+            "created_at": CREATED, "updated_at": CREATED, **extra}
+
+
+def test_shape_matches_model_serialization():
+    # An old document without likes/comments/variants, and one with everything set.
+    docs = [
+        stored_post(1),
+        stored_post(2, likes=3, comment_count=1, blob_key="abc", variants={"full": "/api/blobs/abc"},
+                    comments=[{"id": "c1", "text": "hi", "created_at": CREATED}], internal="dropped"),
+    ]
+    expected = [server.Post(**doc).model_dump(mode="json") for doc in docs]
+    assert json.loads(dumps(DocumentShape(server.Post).shape_all(docs))) == expected
+
+
+def test_stdlib_fallback_produces_the_same_bytes(monkeypatch):
+    if fast_json.orjson is None:
+        pytest.skip("orjson not installed")
+    content = {"items": DocumentShape(server.Post).shape_all([stored_post(1), stored_post(2)]), "next_cursor": None}
+    fast = dumps(content)
+    monkeypatch.setattr(fast_json, "orjson", None)
+    assert dumps(content) == fast
+
+
+def test_list_endpoints_return_shaped_documents():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    asyncio.run(db.posts.insert_many([{**stored_post(i), "created_at": CREATED.replace(second=i)} for i in range(3)]))
+
+    async def run():
+        transport = httpx.ASGITransport(app=server.create_app(Settings(), db=db))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/posts/u1"), await client.get("/api/users/u1/posts?limit=2&fields=type")
+
+    legacy, wall = asyncio.run(run())
+    assert legacy.headers["content-type"] == "application/json"
+    assert [p["id"] for p in legacy.json()] == ["p2", "p1", "p0"]
+    assert legacy.json()[0]["likes"] == 0 and "_id" not in legacy.json()[0]
+    assert wall.json()["items"][0] == {"id": "p2", "created_at": "2025-05-01T12:30:02.123000", "type": "text"}
+    assert wall.json()["next_cursor"]
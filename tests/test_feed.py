@@ -0,0 +1,90 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from feed import FeedService
+from migrations import run_migrations
+
+START = datetime(2026, 1, 1)
+
+
+async def make_service(**kwargs):
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    await run_migrations(db)
+    await db.users.insert_many([{"id": u, "telegram_id": u, "name": u} for u in ("alice", "bob", "carol", "dave")])
+    return FeedService(db, celebrity_cache_seconds=0, **kwargs)
+
+
+async def publish(service, author, minutes):
+    post = {"id": f"{author}-{minutes}", "user_id": author, "type": "text", "content": "hi",
+            "created_at": START + timedelta(minutes=minutes)}
+    await service.db.posts.insert_one(dict(post))
+    await service.fanout_post(FeedService.timeline_entry(post))
+    return post["id"]
+
+
+async def read_all(service, user_id, limit):
+    ids, cursor = [], None
+    while True:
+        posts, cursor = await service.read_page(user_id, cursor, limit)
+        ids += [p["id"] for p in posts]
+        if not cursor:
+            return ids
+
+
+def test_feed_merges_followed_authors_newest_first():
+    async def scenario():
+        service = await make_service()
+        await service.follow("carol", "alice")
+        await service.follow("carol", "bob")
+        posted = [await publish(service, author, i) for i, author in enumerate(["alice", "bob", "dave", "carol", "alice"])]
+        # A redelivered fan-out job must not duplicate the entry.
+        await service.fanout_post({"post_id": posted[0], "author_id": "alice", "created_at": START})
+        timeline = await service.timelines.find_one({"_id": "carol"})
+        return posted, await read_all(service, "carol", 2), len(timeline["entries"])
+
+    posted, feed, entries = asyncio.run(scenario())
+    assert feed == ["alice-4", "carol-3", "bob-1", "alice-0"]
+    assert entries == 4
+
+
+def test_follow_backfills_and_unfollow_removes_posts():
+    async def scenario():
+        service = await make_service()
+        await publish(service, "alice", 1)
+        await service.follow("carol", "alice")
+        after_follow = await read_all(service, "carol", 10)
+        await service.unfollow("carol", "alice")
+        return after_follow, await read_all(service, "carol", 10)
+
+    assert asyncio.run(scenario()) == (["alice-1"], [])
+
+
+def test_celebrity_posts_are_read_at_request_time():
+    async def scenario():
+        service = await make_service(celebrity_threshold=2)
+        await service.follow("carol", "alice")
+        await service.follow("bob", "alice")
+        await publish(service, "alice", 1)
+        await publish(service, "bob", 2)
+        await service.follow("carol", "bob")
+        timeline = await service.timelines.find_one({"_id": "carol"})
+        return [e["post_id"] for e in timeline["entries"]], await read_all(service, "carol", 1)
+
+    pushed, feed = asyncio.run(scenario())
+    assert pushed == ["bob-2"]  # alice has 2 followers, so her post was not fanned out
+    assert feed == ["bob-2", "alice-1"]
+
+
+def test_paging_past_a_trimmed_timeline_reads_older_posts():
+    async def scenario():
+        service = await make_service(timeline_max=3)
+        await service.follow("carol", "alice")
+        for minute in range(7):
+            await publish(service, "alice", minute)
+        return await read_all(service, "carol", 2)
+
+    assert asyncio.run(scenario()) == [f"alice-{m}" for m in range(6, -1, -1)]
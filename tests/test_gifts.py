@@ -0,0 +1,117 @@
+import asyncio
+
+import httpx
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from auth_utils import issue_session_token, session_secret
+from gifts import send_gifts
+from migrations import run_migrations
+from rate_limit import MemoryRateLimitBackend, RateLimiter
+from settings import Settings
+from stars_ledger import InsufficientStars, StarsLedger
+
+BOT_TOKEN = "123:test"
+
+
+@pytest.fixture
+def db():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    asyncio.run(db.users.insert_many([
+        {"id": f"u{i}", "telegram_id": str(i), "name": f"User {i}", "stars_balance": 10} for i in range(5)
+    ]))
+    # Opening balances: migration 13 turns users.stars_balance into ledger accounts.
+    asyncio.run(run_migrations(db))
+    return db
+
+
+@pytest.fixture
+def app(db):
+    app = server.create_app(Settings(telegram_bot_token=BOT_TOKEN, gift_prices={"star": 3}, gift_bulk_max_receivers=4), db=db)
+    app.state.resources.rate_limiter = RateLimiter(MemoryRateLimitBackend(), {})
+    return app
+
+
+def api(app, requests, user_id="u0"):
+    token, _ = issue_session_token(user_id, "0", session_secret(BOT_TOKEN))
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers={"Authorization": f"Bearer {token}"}) as client:
+            return [await client.request(method, url, **kwargs) for method, url, kwargs in requests]
+    return asyncio.run(run())
+
+
+def balance(db, user_id):
+    return asyncio.run(StarsLedger(db).balance(user_id))
+
+
+def test_send_charges_and_lists_newest_first(db, app):
+    sends = [("POST", "/api/gifts", {"json": {"sender_id": "u0", "receiver_id": "u1", "type": t}}) for t in ("flower", "star", "candy")]
+    responses = api(app, sends)
+    assert [r.status_code for r in responses] == [201, 201, 201]
+    assert responses[1].json()["price_stars"] == 3
+    assert balance(db, "u0") == 7
+
+    first, = api(app, [("GET", "/api/users/u1/gifts?limit=2", {})])
+    page = first.json()
+    assert [g["type"] for g in page["items"]] == ["candy", "star"]
+    assert page["items"][0]["sender_name"] == "User 0"
+    second, = api(app, [("GET", f"/api/users/u1/gifts?limit=2&cursor={page['next_cursor']}", {})])
+    assert [g["type"] for g in second.json()["items"]] == ["flower"]
+    assert second.json()["next_cursor"] is None
+
+
+def test_retried_send_is_not_charged_twice(db, app):
+    body = {"json": {"sender_id": "u0", "receiver_id": "u1", "type": "star", "client_ref": "tap-1"}}
+    first, retry = api(app, [("POST", "/api/gifts", body), ("POST", "/api/gifts", body)])
+    assert first.json()["id"] == retry.json()["id"]
+    assert balance(db, "u0") == 7
+    assert asyncio.run(db.gifts.count_documents({})) == 1
+
+
+def test_insufficient_balance_and_validation(db, app):
+    asyncio.run(StarsLedger(db).post("u0", -8, "adjustment"))
+    poor, self_gift, unknown = api(app, [
+        ("POST", "/api/gifts", {"json": {"sender_id": "u0", "receiver_id": "u1", "type": "star"}}),
+        ("POST", "/api/gifts", {"json": {"sender_id": "u0", "receiver_id": "u0", "type": "flower"}}),
+        ("POST", "/api/gifts", {"json": {"sender_id": "u0", "receiver_id": "nobody", "type": "flower"}}),
+    ])
+    assert (poor.status_code, self_gift.status_code, unknown.status_code) == (402, 400, 404)
+    assert balance(db, "u0") == 2
+
+
+def test_concurrent_sends_cannot_overspend(db):
+    async def run():
+        async def one(i):
+            gift = server.new_gift(server.GiftBase(type="star"), {"id": "u0"}, "u1", None, 3).dict()
+            try:
+                return await send_gifts(db, StarsLedger(db), [gift], 3)
+            except InsufficientStars:
+                return None
+        return await asyncio.gather(*(one(i) for i in range(10)))
+
+    results = asyncio.run(run())
+    assert sum(r is not None for r in results) == 3
+    assert balance(db, "u0") == 1
+
+
+def test_bulk_send_skips_duplicates_and_unknown_receivers(db, app):
+    body = {"sender_id": "u0", "receiver_ids": ["u1", "u2"], "type": "star", "client_ref": "batch-1"}
+    first, = api(app, [("POST", "/api/gifts/bulk", {"json": body})])
+    assert first.status_code == 201 and first.json()["charged_stars"] == 6
+
+    retry, = api(app, [("POST", "/api/gifts/bulk", {"json": {**body, "receiver_ids": ["u1", "u2", "u3", "ghost"]}})])
+    result = retry.json()
+    assert [g["receiver_id"] for g in result["items"]] == ["u3"]
+    assert result["duplicate_receiver_ids"] == ["u1", "u2"]
+    assert result["unknown_receiver_ids"] == ["ghost"]
+    assert result["charged_stars"] == 3
+    assert balance(db, "u0") == 1
+    assert asyncio.run(db.gifts.count_documents({"sender_id": "u0"})) == 3
+
+    too_many, = api(app, [("POST", "/api/gifts/bulk", {"json": {**body, "receiver_ids": ["u1", "u2", "u3", "u4", "ghost"]}})])
+    assert too_many.status_code == 422
+    assert balance(db, "u0") == 1
@@ -0,0 +1,48 @@
+import asyncio
+
+import httpx
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from pymongo.errors import ServerSelectionTimeoutError
+
+import server
+from settings import Settings
+
+
+class UnreachableDB:
+    async def command(self, name):
+        raise ServerSelectionTimeoutError("localhost:27017: connection refused")
+
+
+def get_health(db):
+    async def run():
+        transport = httpx.ASGITransport(app=server.create_app(Settings(), db=db))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/health")
+    return asyncio.run(run())
+
+
+def test_health_ok_when_mongo_answers():
+    response = get_health(mongomock_motor.AsyncMongoMockClient()["tgwall_test"])
+    assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+
+
+def test_health_unavailable_without_mongo():
+    response = get_health(UnreachableDB())
+    assert response.status_code == 503
+    assert response.json()["mongo"] == "unreachable"
+
+
+def test_mongo_client_is_created_lazily_per_app():
+    app = server.create_app(Settings(mongo_url="mongodb://localhost:27017", db_name="tgwall_lazy"))
+    resources = app.state.resources
+    assert resources.client is None
+    db = resources.db
+    try:
+        assert db.name == "tgwall_lazy" and resources.connect_mongo() is db
+        assert server.create_app(Settings()).state.resources.client is None
+    finally:
+        resources.client.close()
@@ -0,0 +1,73 @@
+import asyncio
+import io
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from image_pipeline import FULL_VARIANT, ImagePipeline, ImageRejected, PipelineConfig, transcode
+
+CONFIG = PipelineConfig(variants=(("thumb", 16), ("small", 48)), max_dimension=200, max_bytes=200_000, workers=1)
+
+
+def encoded(size=(100, 50), fmt="PNG", mode="RGB", color="red", **save):
+    out = io.BytesIO()
+    Image.new(mode, size, color).save(out, format=fmt, **save)
+    return out.getvalue()
+
+
+def decoded_size(variant):
+    return Image.open(io.BytesIO(variant.data)).size
+
+
+def test_generates_full_and_downscaled_variants():
+    processed = transcode(encoded((100, 50)), CONFIG)
+    assert {name: (v.width, v.height) for name, v in processed.variants.items()} == {
+        FULL_VARIANT: (100, 50), "thumb": (16, 8), "small": (48, 24),
+    }
+    assert all(v.content_type == "image/webp" and decoded_size(v) == (v.width, v.height) for v in processed.variants.values())
+    # Variants no smaller than the original are skipped.
+    assert list(transcode(encoded((40, 20)), CONFIG).variants) == [FULL_VARIANT, "thumb"]
+
+
+def test_palette_and_alpha_images_are_normalised():
+    assert Image.open(io.BytesIO(transcode(encoded(mode="P"), CONFIG).full.data)).mode == "RGB"
+    assert Image.open(io.BytesIO(transcode(encoded(mode="RGBA", color=(255, 0, 0, 128)), CONFIG).full.data)).mode == "RGBA"
+
+
+def test_applies_exif_orientation():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotate 90 degrees clockwise when displayed
+    processed = transcode(encoded((40, 20), "JPEG", exif=exif.tobytes()), CONFIG)
+    assert (processed.full.width, processed.full.height) == (20, 40)
+    assert decoded_size(processed.full) == (20, 40)
+
+
+@pytest.mark.parametrize("data,status", [
+    (b"x" * 200_001, 413),                # over max_bytes
+    (encoded((201, 10)), 413),            # over max_dimension, rejected from the header
+    (b"not an image", 422),
+    (encoded(fmt="BMP"), 422),            # decodable by Pillow but not an accepted format
+    (encoded(fmt="TIFF"), 422),
+])
+def test_rejections(data, status):
+    with pytest.raises(ImageRejected) as rejected:
+        transcode(data, CONFIG)
+    assert rejected.value.status_code == status
+
+
+def test_pool_round_trip_keeps_status_codes():
+    pipeline = ImagePipeline(CONFIG)
+
+    async def run():
+        try:
+            processed = await pipeline.process(encoded((100, 50)))
+            with pytest.raises(ImageRejected) as rejected:
+                await pipeline.process(encoded((201, 10)))
+            return processed, rejected.value
+        finally:
+            pipeline.close()
+
+    processed, rejected = asyncio.run(run())
+    assert pipeline._pool is None
+    assert processed.full.width == 100 and rejected.status_code == 413
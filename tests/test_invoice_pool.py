@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from invoice_pool import LOCKS_COLLECTION, InvoicePool
+
+ITEM = {"id": "brush", "name": "Brush", "description": "A brush", "price_stars": 10, "image_url": None, "is_active": True}
+
+
+class FakeBotAPI:
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.payloads = []
+
+    async def create_link(self, item, payload):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        self.payloads.append(payload)
+        return f"https://t.me/$invoice-{payload}"
+
+
+def make_pool(api, **kwargs):
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    return InvoicePool(db, api.create_link, **kwargs)
+
+
+def test_refill_is_bounded_and_claims_are_unique():
+    api = FakeBotAPI()
+    # Claims would schedule background refills; keep this test about the claims.
+    pool = make_pool(api, target_size=8, concurrency=3, refill_on_claim=False)
+
+    async def scenario():
+        created = await pool.refill_item(ITEM)
+        claims = await asyncio.gather(*(pool.claim(ITEM, f"user-{i}") for i in range(10)))
+        return created, claims
+
+    created, claims = asyncio.run(scenario())
+    assert created == 8
+    assert api.max_in_flight <= 3
+    payloads = [c["_id"] for c in claims if c]
+    assert len(payloads) == 8 and len(set(payloads)) == 8
+    assert claims.count(None) == 2
+
+
+def test_changed_item_invalidates_pooled_links():
+    api = FakeBotAPI(delay=0)
+    pool = make_pool(api, target_size=2, refill_on_claim=False)
+
+    async def scenario():
+        await pool.refill_item(ITEM)
+        repriced = {**ITEM, "price_stars": 20}
+        claim = await pool.claim(repriced, "user-1")
+        removed = await pool.expire_stale([repriced])
+        return claim, removed, await pool.collection.count_documents({})
+
+    claim, removed, left = asyncio.run(scenario())
+    assert claim is None
+    assert removed == 2
+    assert left == 0
+
+
+
+def test_expired_lock_holder_does_not_release_the_new_lease():
+    pool = make_pool(FakeBotAPI(delay=0))
+    locks = pool.db[LOCKS_COLLECTION]
+
+    async def scenario():
+        first = await pool._acquire_lock("brush")
+        blocked = await pool._acquire_lock("brush")
+        await locks.update_one({"_id": "brush"}, {"$set": {"locked_until": datetime.utcnow() - timedelta(seconds=1)}})
+        second = await pool._acquire_lock("brush")
+        await pool._release_lock("brush", first)
+        still_held = await locks.find_one({"_id": "brush"})
+        await pool._release_lock("brush", second)
+        return first, blocked, second, still_held, await locks.count_documents({})
+
+    first, blocked, second, still_held, left = asyncio.run(scenario())
+    assert first and second and first != second
+    assert blocked is None
+    assert still_held["owner"] == second
+    assert left == 0
+
+
+def test_late_lock_holder_does_not_overfill_the_pool():
+    api = FakeBotAPI(delay=0)
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    first_done = None
+
+    class LateWorker(InvoicePool):
+        async def _acquire_lock(self, item_id):
+            # Counted an empty pool, then lost the race to the first worker.
+            await first_done.wait()
+            return await super()._acquire_lock(item_id)
+
+    first = InvoicePool(db, api.create_link, target_size=3)
+    late = LateWorker(db, api.create_link, target_size=3)
+
+    async def scenario():
+        nonlocal first_done
+        first_done = asyncio.Event()
+        late_refill = asyncio.create_task(late.refill_item(ITEM))
+        await asyncio.sleep(0)
+        created = await first.refill_item(ITEM)
+        first_done.set()
+        return created, await late_refill, await first.collection.count_documents({})
+
+    assert asyncio.run(scenario()) == (3, 0, 3)
+    assert len(api.payloads) == 3
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from pymongo.errors import BulkWriteError, ServerSelectionTimeoutError
+
+from likes import LikeCounterBuffer, like_count, like_post, unlike_post
+from migrations import run_migrations
+
+USERS = 300
+
+
+class YieldingCollection:
+    """Yields to the event loop around every call so concurrent likes interleave.
+
+    mongomock runs each call synchronously; without this, gather() would run
+    every like_post to completion before starting the next one.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            result = await attr(*args, **kwargs)
+            await asyncio.sleep(0)
+            return result
+        return call
+
+
+class YieldingDB:
+    def __init__(self, db):
+        self._db = db
+        self.likes = YieldingCollection(db.likes)
+        self.posts = YieldingCollection(db.posts)
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+async def make_db():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    await run_migrations(db)
+    await db.posts.insert_one({"id": "viral", "user_id": "author", "likes": 0})
+    return YieldingDB(db)
+
+
+async def hammer(db, buffer=None):
+    # Every user likes the post three times concurrently and a third of them
+    # unlike it again; only one like per user may count.
+    likes = [like_post(db, "viral", f"user-{i}", buffer) for i in range(USERS) for _ in range(3)]
+    await asyncio.gather(*likes)
+    await asyncio.gather(*(unlike_post(db, "viral", f"user-{i}", buffer) for i in range(0, USERS, 3)))
+
+
+def test_concurrent_likes_count_exactly_once_per_user():
+    async def scenario():
+        db = await make_db()
+        await hammer(db)
+        return await like_count(db, "viral"), await db.likes.count_documents({"post_id": "viral"})
+
+    count, documents = asyncio.run(scenario())
+    assert count == documents == USERS - USERS // 3
+
+
+def test_write_behind_buffer_coalesces_and_flushes_exact_count():
+    async def scenario():
+        db = await make_db()
+        buffer = LikeCounterBuffer(db, flush_interval=0.01)
+        buffer.start()
+        await hammer(db, buffer)
+        visible_before_flush = await like_count(db, "viral", buffer)
+        await buffer.close()
+        stored = (await db.posts.find_one({"id": "viral"}))["likes"]
+        return visible_before_flush, stored, buffer.flushed_writes
+
+    visible, stored, writes = asyncio.run(scenario())
+    assert visible == stored == USERS - USERS // 3
+    assert writes < USERS
+
+
+class FailingPosts:
+    def __init__(self, error):
+        self.error = error
+        self.batches = []
+
+    async def bulk_write(self, ops, ordered=True):
+        self.batches.append(ops)
+        raise self.error
+
+
+def flush_against(error):
+    async def scenario():
+        db = type("DB", (), {})()
+        db.posts = FailingPosts(error)
+        buffer = LikeCounterBuffer(db)
+        for post_id, delta in (("a", 3), ("b", 2), ("c", -1)):
+            buffer.add(post_id, delta)
+        with pytest.raises(type(error)):
+            await buffer.flush()
+        return buffer
+
+    return asyncio.run(scenario())
+
+
+def test_partial_bulk_failure_requeues_only_retryable_failed_ops():
+    error = BulkWriteError({"writeErrors": [
+        {"index": 1, "code": 189, "errmsg": "primary stepped down"},
+        {"index": 2, "code": 121, "errmsg": "document failed validation"},
+    ]})
+    buffer = flush_against(error)
+    # "a" was applied, "b" goes back for the next flush, "c" can't succeed.
+    assert dict(buffer._pending) == {"b": 2}
+    assert buffer.flushed_writes == 1 and buffer.dropped_writes == 1
+
+
+def test_unreachable_server_requeues_and_ambiguous_errors_drop():
+    assert dict(flush_against(ServerSelectionTimeoutError("no primary"))._pending) == {"a": 3, "b": 2, "c": -1}
+    dropped = flush_against(RuntimeError("connection reset mid-batch"))
+    assert dict(dropped._pending) == {} and dropped.dropped_writes == 3
+
+
+def test_size_triggered_flush_is_tracked_and_logged(caplog):
+    async def scenario():
+        db = type("DB", (), {})()
+        db.posts = FailingPosts(RuntimeError("boom"))
+        buffer = LikeCounterBuffer(db, max_pending_posts=2)
+        buffer.add("a", 1)
+        buffer.add("b", 1)
+        task = buffer._flush_task
+        buffer.add("c", 1)  # a flush is already running; no second task
+        assert buffer._flush_task is task
+        await task
+        return buffer
+
+    buffer = asyncio.run(scenario())
+    assert "Failed to flush like counters: boom" in caplog.text
+    assert buffer.dropped_writes == 3  # "c" joined the batch before the task ran
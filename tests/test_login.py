@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from pymongo.errors import DuplicateKeyError
+
+import server
+from migrations import run_migrations
+from settings import Settings
+
+
+class CountingCollection:
+    """Wraps a collection, counting calls and optionally failing the first upsert."""
+
+    def __init__(self, collection, lose_first_race=False):
+        self._collection = collection
+        self.calls = []
+        self.lose_first_race = lose_first_race
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            self.calls.append(name)
+            if name == "find_one_and_update" and self.lose_first_race:
+                # Simulate another worker inserting the same telegram_id between
+                # our query and our insert.
+                self.lose_first_race = False
+                await attr(*args, **kwargs)
+                raise DuplicateKeyError("E11000 duplicate key error")
+            return await attr(*args, **kwargs)
+        return call
+
+
+class CountingDB:
+    def __init__(self, db, users):
+        self._db = db
+        self.users = users
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+@pytest.fixture
+def db():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    asyncio.run(run_migrations(db))
+    return db
+
+
+@pytest.fixture
+def users(db):
+    return CountingCollection(db.users)
+
+
+@pytest.fixture
+def resources(db, users):
+    return server.Resources(Settings(), CountingDB(db, users))
+
+
+def tg_user(**overrides):
+    data = {"id": "42", "first_name": "Ada", "last_name": "Lovelace", "username": "ada", "auth_date": 0}
+    data.update(overrides)
+    return server.TelegramUserFromInitData(**data)
+
+
+def test_login_is_a_single_round_trip_and_refreshes_profile(users, resources):
+    first = asyncio.run(server.upsert_telegram_user(resources, tg_user()))
+    second = asyncio.run(server.upsert_telegram_user(resources, tg_user(username=None, first_name="Augusta")))
+    assert users.calls == ["find_one_and_update", "find_one_and_update"]
+    assert second.id == first.id and second.created_at == first.created_at
+    assert second.username is None and second.name == "Augusta Lovelace"
+
+
+def test_concurrent_first_logins_create_one_user(users, resources):
+    async def scenario():
+        return await asyncio.gather(*(server.upsert_telegram_user(resources, tg_user()) for _ in range(50)))
+
+    profiles = asyncio.run(scenario())
+    assert len({p.id for p in profiles}) == 1
+    assert asyncio.run(users.count_documents({"telegram_id": "42"})) == 1
+
+
+def test_lost_insert_race_retries_as_update(users, resources):
+    users.lose_first_race = True
+    profile = asyncio.run(server.upsert_telegram_user(resources, tg_user()))
+    assert users.calls == ["find_one_and_update", "find_one_and_update"]
+    assert asyncio.run(users.count_documents({})) == 1
+    assert profile.telegram_id == "42"
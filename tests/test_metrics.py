@@ -0,0 +1,152 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import metrics
+import server
+from settings import Settings
+from external_integrations.telegram_bot_api import TelegramAPIError
+from metrics import MongoCommandMetrics, Registry, SharedMetricsDir
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    hist = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        hist.observe(value, "/a")
+    counter = registry.counter("hits_total", "Hits.", ("route",))
+    counter.inc('/b"q')
+
+    text = registry.render()
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{route="/a",le="1"} 3' in text
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{route="/a"} 4' in text
+    assert 'hits_total{route="/b\\"q"} 1' in text
+    assert "# TYPE latency_seconds histogram" in text
+
+
+def worker_registry(requests, in_flight):
+    registry = Registry()
+    registry.counter("hits_total", "Hits.", ("route",)).inc("/a", amount=requests)
+    registry.histogram("latency_seconds", "Latency.", buckets=(0.1,)).observe(0.05)
+    registry.gauge("in_flight", "In flight.").set(in_flight)
+    return registry
+
+
+def test_shared_dir_sums_counters_and_labels_gauges_by_worker(tmp_path):
+    first = SharedMetricsDir(worker_registry(2, 1), str(tmp_path), worker_id="101", flush_interval=5)
+    second = SharedMetricsDir(worker_registry(3, 4), str(tmp_path), worker_id="102", flush_interval=5)
+    exited = SharedMetricsDir(worker_registry(5, 9), str(tmp_path), worker_id="103", flush_interval=5)
+    second.flush()
+    exited.flush()
+    os.utime(exited.path, (0, 0))
+
+    text = first.render()
+    assert 'hits_total{route="/a"} 10' in text
+    assert 'latency_seconds_bucket{le="0.1"} 3' in text
+    assert "latency_seconds_count 3" in text
+    assert 'in_flight{worker="101"} 1' in text and 'in_flight{worker="102"} 4' in text
+    # The exited worker's counters stay in the totals, its gauges don't.
+    assert 'worker="103"' not in text
+    assert text.count("# TYPE hits_total counter") == 1
+
+
+def test_metrics_endpoint_agrees_across_workers(tmp_path):
+    apps = []
+    for worker_id, requests, in_flight in (("201", 2, 1), ("202", 3, 0)):
+        app = server.create_app(Settings(metrics_dir=str(tmp_path)))
+        app.state.resources.shared_metrics = SharedMetricsDir(worker_registry(requests, in_flight), str(tmp_path), worker_id=worker_id)
+        app.state.resources.shared_metrics.flush()
+        apps.append(app)
+
+    async def scrape(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return (await client.get("/metrics")).text
+
+    first, second = (asyncio.run(scrape(app)) for app in apps)
+    assert first == second
+    assert 'hits_total{route="/a"} 5' in first
+    assert "latency_seconds_count 2" in first
+
+
+def test_middleware_labels_by_route_template():
+    async def run():
+        transport = httpx.ASGITransport(app=server.create_app(Settings()))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.get("/")
+            await client.get("/api/posts/does-not-matter/comments/x/y")
+            return await client.get("/metrics")
+
+    before = metrics.HTTP_LATENCY.count("GET", "/")
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert metrics.HTTP_LATENCY.count("GET", "/") == before + 1
+    assert metrics.HTTP_REQUESTS.value("GET", "unmatched", "404") >= 1
+    assert 'tgwall_http_requests_total{method="GET",route="/",status="200"}' in response.text
+    # Scrapes themselves aren't recorded.
+    assert metrics.HTTP_LATENCY.count("GET", "/metrics") == 0
+
+
+def test_metrics_token():
+    app = server.create_app(Settings(metrics_token="s3cret"))
+
+    async def run(headers):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/metrics", headers=headers)
+
+    assert asyncio.run(run({})).status_code == 401
+    assert asyncio.run(run({"Authorization": "Bearer s3cret"})).status_code == 200
+
+
+def test_mongo_listener_times_commands_and_flags_slow_ones(caplog):
+    listener = MongoCommandMetrics(slow_ms=50)
+    fast = metrics.MONGO_LATENCY.count("posts", "find")
+    slow = metrics.MONGO_SLOW.value("posts", "aggregate")
+
+    get_more = metrics.MONGO_LATENCY.count("posts", "getMore")
+
+    def run(command_name, request_id, micros, ok=True):
+        command = {command_name: 7781, "collection": "posts"} if command_name == "getMore" else {command_name: "posts", "filter": {}}
+        listener.started(SimpleNamespace(
+            command_name=command_name, request_id=request_id, connection_id=("db", 27017), command=command,
+        ))
+        event = SimpleNamespace(command_name=command_name, request_id=request_id, connection_id=("db", 27017), duration_micros=micros)
+        (listener.succeeded if ok else listener.failed)(event)
+
+    run("find", 1, 800)
+    run("aggregate", 2, 120_000)
+    run("find", 3, 900, ok=False)
+    run("getMore", 4, 300)
+
+    assert metrics.MONGO_LATENCY.count("posts", "find") == fast + 2
+    assert metrics.MONGO_SLOW.value("posts", "aggregate") == slow + 1
+    assert metrics.MONGO_COMMANDS.value("posts", "find", "error") >= 1
+    assert metrics.MONGO_LATENCY.count("posts", "getMore") == get_more + 1
+    assert "Slow MongoDB aggregate on posts" in caplog.text
+    assert listener._pending == {}
+
+
+def test_telegram_calls_counted_per_method_and_outcome():
+    class FakeClient:
+        async def call(self, method, data=None):
+            if method == "sendMessage":
+                raise TelegramAPIError(method, 400, "Bad Request: chat not found")
+            return {"ok": True}
+
+    ok = metrics.TELEGRAM_CALLS.value("getMe", "ok")
+    failed = metrics.TELEGRAM_CALLS.value("sendMessage", "api_error")
+
+    asyncio.run(server.call_telegram_api(FakeClient(), "getMe"))
+    with pytest.raises(HTTPException):
+        asyncio.run(server.call_telegram_api(FakeClient(), "sendMessage", {"chat_id": 1}))
+
+    assert metrics.TELEGRAM_CALLS.value("getMe", "ok") == ok + 1
+    assert metrics.TELEGRAM_CALLS.value("sendMessage", "api_error") == failed + 1
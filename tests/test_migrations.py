@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import migrations
+from migrations import MIGRATIONS, Migration, MigrationError, applied_versions, run_migrations
+
+T0 = datetime(2025, 1, 1)
+
+
+@pytest.fixture
+def db():
+    return mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+
+
+def test_runs_every_migration_once_in_order(db):
+    first = asyncio.run(run_migrations(db))
+    assert first == sorted(m.version for m in MIGRATIONS)
+    assert asyncio.run(run_migrations(db)) == []
+    assert sorted(asyncio.run(applied_versions(db))) == first
+
+
+def test_stops_at_a_failed_migration_and_retries_it(db, monkeypatch):
+    calls = []
+    failures = [RuntimeError("index build interrupted")]
+
+    async def ok(db):
+        calls.append("ok")
+
+    async def flaky(db):
+        calls.append("flaky")
+        if failures:
+            raise failures.pop()
+
+    async def later(db):
+        calls.append("later")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", [Migration(1, "ok", ok), Migration(2, "flaky", flaky), Migration(3, "later", later)])
+    with pytest.raises(RuntimeError):
+        asyncio.run(run_migrations(db))
+    assert sorted(asyncio.run(applied_versions(db))) == [1]
+    assert asyncio.run(run_migrations(db)) == [2, 3]
+    assert calls == ["ok", "flaky", "flaky", "later"]
+
+
+def test_merges_users_duplicated_by_the_login_race(db):
+    async def scenario():
+        await db.users.insert_many([
+            {"id": "keep", "telegram_id": "42", "name": "A", "created_at": T0},
+            {"id": "dupe", "telegram_id": "42", "name": "A", "created_at": T0 + timedelta(seconds=1)},
+            {"id": "other", "telegram_id": "7", "name": "B", "created_at": T0},
+        ])
+        await db.posts.insert_one({"id": "p1", "user_id": "dupe", "created_at": T0})
+        await db.user_inventory.insert_one({"id": "i1", "user_profile_id": "dupe"})
+        await run_migrations(db)
+        return (sorted(u["id"] for u in await db.users.find().to_list(None)),
+                await db.posts.find_one({"id": "p1"}), await db.user_inventory.find_one({"id": "i1"}))
+
+    users, post, item = asyncio.run(scenario())
+    assert users == ["keep", "other"]
+    assert post["user_id"] == "keep" and item["user_profile_id"] == "keep"
+
+
+def test_other_duplicates_fail_clearly_until_resolved(db):
+    async def scenario():
+        await db.posts.insert_many([{"id": "p1", "user_id": "u"}, {"id": "p1", "user_id": "u"}])
+        with pytest.raises(MigrationError, match="posts has 1 duplicated id values"):
+            await run_migrations(db)
+        recorded = await applied_versions(db)
+        await db.posts.delete_one({"id": "p1"})
+        return recorded, await run_migrations(db)
+
+    recorded, applied = asyncio.run(scenario())
+    assert recorded == {}
+    assert applied[0] == 1
@@ -0,0 +1,59 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+from offline import OfflineStack, replay, sign_init_data
+
+
+def test_synthetic_users_log_in_post_and_pay():
+    async def run():
+        async with OfflineStack() as stack:
+            recorder, _ = await replay(stack, users=4, concurrency=2)
+            await stack.drain()
+            transactions = await stack.db.payment_transactions.find({"user_profile_id": {"$in": recorder.user_ids}}).to_list(None)
+            return (recorder, stack.bot_api.calls, transactions,
+                    await stack.db.user_inventory.count_documents({}), await stack.db.posts.count_documents({}))
+
+    recorder, calls, transactions, granted, posts = asyncio.run(run())
+    assert dict(recorder.errors) == {}
+    assert {label: len(samples) for label, samples in recorder.latencies.items()} == {
+        "POST /api/auth/telegram_login": 4,
+        "POST /api/posts": 4,
+        "GET /api/users/{user_id}/posts": 4,
+        "POST /api/payments/create_invoice_link": 4,
+        "POST /api/payments/telegram_webhook (pre_checkout)": 4,
+        "POST /api/payments/telegram_webhook (payment)": 4,
+    }
+    answers = [body for method, body in calls if method == "answerPreCheckoutQuery"]
+    assert sorted(a["pre_checkout_query_id"] for a in answers) == ["pcq-0", "pcq-1", "pcq-2", "pcq-3"]
+    assert all(a["ok"] for a in answers)
+    assert any(method == "createInvoiceLink" for method, _ in calls)
+    assert [t["status"] for t in transactions] == ["completed"] * 4
+    assert granted == 4 and posts == 4
+
+
+def test_rejects_forged_login_and_unknown_checkout():
+    async def run():
+        async with OfflineStack() as stack:
+            forged = await stack.client.post("/api/auth/telegram_login",
+                                             json={"init_data_str": sign_init_data(7, bot_token="999:OTHER")})
+            checkout = await stack.client.post("/api/payments/telegram_webhook",
+                                               json={"update_id": 1, "pre_checkout_query": {"id": "pcq-x", "invoice_payload": "nope"}})
+            chat = await stack.client.post("/api/payments/telegram_webhook",
+                                           json={"update_id": 2, "message": {"message_id": 5, "text": "/start"}})
+            return forged.status_code, checkout.json(), chat, stack.bot_api.calls
+
+    forged, checkout, chat, calls = asyncio.run(run())
+    assert forged == 401
+    assert chat.status_code == 200 and chat.json() == {"status": "unhandled_update_type"}
+    assert checkout["status"] == "error"
+    assert ("answerPreCheckoutQuery", {"pre_checkout_query_id": "pcq-x", "ok": False,
+                                       "error_message": "Transaction not found or already processed."}) in calls
@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursor, build_projection, clamp_page_size,
+                        decode_cursor, encode_cursor, fetch_page, keyset_filter)
+from settings import Settings
+
+T0 = datetime(2025, 5, 1, 12, 0, 0, 250000)
+
+
+def test_cursor_round_trips_and_rejects_garbage():
+    cursor = encode_cursor(T0, "p-7")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (T0, "p-7")
+    for bad in ("", "not base64!", encode_cursor(T0, "x")[:-3], "eyJ0IjoxfQ"):
+        with pytest.raises(InvalidCursor):
+            decode_cursor(bad)
+
+
+def test_keyset_filter_breaks_created_at_ties_on_id():
+    assert keyset_filter({"user_id": "u1"}, None) == {"user_id": "u1"}
+    assert keyset_filter({"user_id": "u1"}, encode_cursor(T0, "p5")) == {
+        "user_id": "u1",
+        "$or": [{"created_at": {"$lt": T0}}, {"created_at": T0, "id": {"$lt": "p5"}}],
+    }
+    ascending = keyset_filter({}, encode_cursor(T0, "p5"), ascending=True, time_field="sent_at")
+    assert ascending["$or"] == [{"sent_at": {"$gt": T0}}, {"sent_at": T0, "id": {"$gt": "p5"}}]
+
+
+def test_clamp_page_size_and_projection():
+    assert [clamp_page_size(n) for n in (None, 0, 1, 50, 1000)] == [DEFAULT_PAGE_SIZE, DEFAULT_PAGE_SIZE, 1, 50, MAX_PAGE_SIZE]
+    assert build_projection("type, likes", ["type", "likes", "content"], ["id"]) == {"id": 1, "type": 1, "likes": 1, "_id": 0}
+    assert build_projection(None, ["type"], ["id"]) == {"id": 1, "type": 1, "_id": 0}
+    with pytest.raises(ValueError):
+        build_projection("type,password", ["type"], ["id"])
+
+
+def test_fetch_page_walks_ties_without_gaps_or_repeats():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    # Pairs of posts share a timestamp, so pages must split ties on id.
+    docs = [{"id": f"p{i:02d}", "user_id": "u1", "created_at": T0 + timedelta(seconds=i // 2)} for i in range(11)]
+    asyncio.run(db.posts.insert_many(docs))
+
+    async def walk():
+        seen, cursor = [], None
+        while True:
+            page, cursor = await fetch_page(db.posts, {"user_id": "u1"}, cursor, 3, {"_id": 0, "id": 1, "created_at": 1})
+            seen.append([d["id"] for d in page])
+            if not cursor:
+                return seen
+
+    pages = asyncio.run(walk())
+    assert [len(p) for p in pages] == [3, 3, 3, 2]
+    assert sum(pages, []) == [f"p{i:02d}" for i in reversed(range(11))]
+
+
+def test_wall_endpoints():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    asyncio.run(db.users.insert_many([{"id": "u1", "telegram_id": "1", "name": "A"}, {"id": "u2", "telegram_id": "2", "name": "B"}]))
+    asyncio.run(db.posts.insert_many([server.Post(user_id="u1", type="text", content=f"p{i}", created_at=T0 + timedelta(seconds=i)).dict()
+                                      for i in range(30)]))
+
+    async def run():
+        transport = httpx.ASGITransport(app=server.create_app(Settings(), db=db))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.get(path) for path in (
+                "/api/posts/u1", "/api/posts/u2", "/api/posts/nobody",
+                "/api/users/u1/posts?cursor=garbage", "/api/users/u1/posts?fields=password",
+            )]
+
+    legacy, empty, unknown, bad_cursor, bad_fields = asyncio.run(run())
+    # The legacy endpoint keeps its contract: up to 100 posts, 404 for unknown users.
+    assert len(legacy.json()) == 30
+    assert empty.json() == []
+    assert unknown.status_code == 404
+    assert bad_cursor.status_code == 400 and bad_fields.status_code == 400
+
+
+def test_profile_page_routes():
+    # The same three requests ProfilePage.js makes when it opens a profile.
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    asyncio.run(db.users.insert_many([{"id": "u1", "telegram_id": "1", "name": "A"}, {"id": "u2", "telegram_id": "2", "name": "B"}]))
+    asyncio.run(db.posts.insert_many([server.Post(user_id="u1", type="text", content=f"p{i}", created_at=T0 + timedelta(seconds=i)).dict()
+                                      for i in range(3)]))
+    asyncio.run(db.gifts.insert_one(server.Gift(type="star", sender_id="u2", sender_name="B", receiver_id="u1").dict()))
+
+    async def run():
+        transport = httpx.ASGITransport(app=server.create_app(Settings(), db=db))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.get(path) for path in ("/api/profile/u1", "/api/users/u1/posts", "/api/users/u1/gifts", "/api/profile/nobody")]
+
+    profile, posts, gifts, unknown = asyncio.run(run())
+    assert profile.status_code == 200
+    assert (profile.json()["id"], profile.json()["name"]) == ("u1", "A")
+    assert [p["content"] for p in posts.json()["items"]] == ["p2", "p1", "p0"]
+    assert [(g["type"], g["sender_name"]) for g in gifts.json()["items"]] == [("star", "B")]
+    assert unknown.status_code == 404
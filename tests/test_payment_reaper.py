@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from payment_reaper import ARCHIVE_COLLECTION, PaymentReaper
+from settings import Settings
+
+
+def transaction(tx_id, status, age, **extra):
+    created = datetime.utcnow() - age
+    return {"id": tx_id, "invoice_payload": f"payload-{tx_id}", "status": status,
+            "created_at": created, "updated_at": created, **extra}
+
+
+@pytest.fixture
+def reaper():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    return PaymentReaper(db, pending_ttl_seconds=60, archive_after_days=7, batch_size=2)
+
+
+def test_stale_pending_transactions_expire(reaper):
+    async def scenario():
+        await reaper.db.payment_transactions.insert_many([
+            transaction("old", "pending", timedelta(minutes=5)),
+            transaction("new", "pending", timedelta(0)),
+            transaction("paid", "completed", timedelta(minutes=5)),
+        ])
+        expired = await reaper.expire_pending()
+        docs = await reaper.db.payment_transactions.find({}, {"_id": 0, "id": 1, "status": 1}).to_list(None)
+        return expired, {d["id"]: d["status"] for d in docs}
+
+    expired, statuses = asyncio.run(scenario())
+    assert expired == 1
+    assert statuses == {"old": "expired", "new": "pending", "paid": "completed"}
+
+
+def test_old_finished_transactions_move_to_the_archive(reaper):
+    month = timedelta(days=30)
+
+    async def scenario():
+        await reaper.db.payment_transactions.insert_many([
+            transaction("done", "completed", month, inventory_granted=True),
+            transaction("failed", "failed", month),
+            transaction("expired", "expired", month),
+            transaction("ungranted", "completed", month, inventory_granted=False),
+            transaction("recent", "completed", timedelta(days=1), inventory_granted=True),
+            transaction("abandoned", "pending", month),
+        ])
+        result = await reaper.run_once()
+        hot = sorted(d["id"] for d in await reaper.db.payment_transactions.find({}).to_list(None))
+        cold = sorted(d["id"] for d in await reaper.db[ARCHIVE_COLLECTION].find({}).to_list(None))
+        return result, hot, cold
+
+    result, hot, cold = asyncio.run(scenario())
+    # The abandoned checkout is expired in this run and archived in a later one.
+    assert result == {"expired": 1, "archived": 3}
+    assert hot == ["abandoned", "recent", "ungranted"]
+    assert cold == ["done", "expired", "failed"]
+    assert reaper.stats.archived == 3 and reaper.stats.runs == 1
+
+
+def test_reaper_counters_are_exported(reaper):
+    resources = server.Resources(Settings(), reaper.db)
+    resources.payment_reaper = reaper
+
+    async def scenario():
+        await reaper.db.payment_transactions.insert_one(transaction("old", "pending", timedelta(minutes=5)))
+        await reaper.run_once()
+
+    asyncio.run(scenario())
+    families = {name: samples for name, _, _, samples in resources.service_metrics()}
+    assert families["tgwall_payment_reaper_total"] == [
+        ({"event": "run"}, 1), ({"event": "expired"}, 1), ({"event": "archived"}, 0), ({"event": "error"}, 0)]
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from migrations import run_migrations
+from settings import Settings
+
+
+@pytest.fixture
+def resources():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    item = server.StoreItem(id="brush", name="Brush", description="A brush", price_stars=10, item_type="brush")
+
+    async def seed():
+        await run_migrations(db)
+        await db.store_items.insert_one(item.dict())
+        await db.payment_transactions.insert_one(server.PaymentTransaction(
+            user_profile_id="user-1", store_item_id="brush", invoice_payload="payload-1", amount_stars=10).dict())
+
+    asyncio.run(seed())
+    return server.Resources(Settings(), db)
+
+
+def successful_payment_update(update_id, charge_id="charge-1"):
+    return {
+        "update_id": update_id,
+        "message": {"successful_payment": {"invoice_payload": "payload-1", "telegram_payment_charge_id": charge_id,
+                                           "total_amount": 10, "currency": "XTR"}},
+    }
+
+
+def test_concurrent_replays_grant_the_item_once(resources):
+    db = resources.db
+    async def scenario():
+        # The same update redelivered plus distinct updates for the same charge.
+        updates = [successful_payment_update(1)] * 50 + [successful_payment_update(i) for i in range(2, 52)]
+        await asyncio.gather(*(server.process_webhook_update(resources, u) for u in updates))
+        return (
+            await db.user_inventory.count_documents({}),
+            await db.payment_transactions.find_one({"invoice_payload": "payload-1"}),
+        )
+
+    granted, transaction = asyncio.run(scenario())
+    assert granted == 1
+    assert transaction["status"] == "completed"
+    assert transaction["inventory_granted"] is True
+    assert transaction["telegram_payment_charge_id"] == "charge-1"
+
+
+def test_redelivery_finishes_a_grant_interrupted_by_a_crash(resources):
+    db = resources.db
+    async def scenario():
+        # State left behind by a crash after the status transition.
+        await db.payment_transactions.update_one(
+            {"invoice_payload": "payload-1"},
+            {"$set": {"status": "completed", "telegram_payment_charge_id": "charge-1", "inventory_granted": False}},
+        )
+        completed = await server.fulfill_successful_payment(resources, "payload-1", "charge-1", 7)
+        await server.fulfill_successful_payment(resources, "payload-1", "charge-1", 7)
+        return completed, await db.user_inventory.count_documents({"user_profile_id": "user-1"})
+
+    completed, granted = asyncio.run(scenario())
+    assert completed is False
+    assert granted == 1
+
+
+def test_unknown_payload_grants_nothing(resources):
+    assert asyncio.run(server.fulfill_successful_payment(resources, "nope", "charge-9")) is False
+    assert asyncio.run(resources.db.user_inventory.count_documents({})) == 0
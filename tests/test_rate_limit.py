@@ -0,0 +1,112 @@
+import asyncio
+
+import httpx
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import rate_limit
+import server
+from auth_utils import issue_session_token, session_secret
+from rate_limit import Budget, MemoryRateLimitBackend, MongoRateLimitBackend, RateLimiter
+from settings import Settings
+
+
+def test_budget_parse():
+    assert Budget.parse("10/60") == Budget(10, 60)
+    assert Budget.parse("5") == Budget(5, 1)
+    assert Budget.parse("off") is None and Budget.parse("0") is None
+    with pytest.raises(ValueError):
+        Budget.parse("-1/60")
+
+
+def test_memory_bucket_refills_over_time(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    limiter = RateLimiter(MemoryRateLimitBackend(), {"posts": (Budget(2, 10), None)})
+
+    async def take():
+        return await limiter.check("posts", "u1", "1.2.3.4")
+
+    assert asyncio.run(take()).allowed
+    assert asyncio.run(take()).allowed
+    denied = asyncio.run(take())
+    assert not denied.allowed and denied.scope == "user"
+    assert denied.retry_after == pytest.approx(5.0)
+    assert denied.retry_after_header == "5"
+    # Other users have their own bucket.
+    assert asyncio.run(limiter.check("posts", "u2", "1.2.3.4")).allowed
+
+    now[0] += 5
+    assert asyncio.run(take()).allowed
+    assert not asyncio.run(take()).allowed
+
+
+def test_ip_bucket_spans_users():
+    limiter = RateLimiter(MemoryRateLimitBackend(), {"invoices": (Budget(5, 60), Budget(3, 60))})
+
+    async def run():
+        return [(await limiter.check("invoices", f"user-{i}", "10.0.0.1")) for i in range(4)]
+
+    decisions = asyncio.run(run())
+    assert [d.allowed for d in decisions] == [True, True, True, False]
+    assert decisions[-1].scope == "ip"
+
+
+def test_mongo_backend_shares_budget_between_workers():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    budgets = {"posts": (Budget(3, 60), None)}
+    workers = [RateLimiter(MongoRateLimitBackend(db), budgets) for _ in range(2)]
+
+    async def run():
+        return [(await workers[i % 2].check("posts", "u1", None)).allowed for i in range(5)]
+
+    assert asyncio.run(run()) == [True, True, True, False, False]
+    bucket = asyncio.run(db.rate_limits.find_one({"_id": "posts:user:u1"}))
+    assert bucket["tokens"] < 1 and bucket["expires_at"] > bucket["updated_at"]
+
+
+def test_create_post_returns_429_with_retry_after():
+    bot_token = "123:test"
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    app = server.create_app(Settings(telegram_bot_token=bot_token), db=db)
+    app.state.resources.rate_limiter = RateLimiter(MemoryRateLimitBackend(), {"posts": (Budget(2, 60), None)})
+    token, _ = issue_session_token("user-1", "42", session_secret(bot_token))
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [
+                await client.post("/api/posts", json={"content": f"hi {i}", "type": "text", "user_id": "user-1"},
+                                  headers={"Authorization": f"Bearer {token}"})
+                for i in range(3)
+            ]
+
+    responses = asyncio.run(run())
+    assert [r.status_code for r in responses] == [201, 201, 429]
+    assert responses[-1].headers["Retry-After"] == "30"
+    assert asyncio.run(db.posts.count_documents({})) == 2
+
+
+def test_spoofed_forwarded_for_does_not_reset_the_ip_bucket():
+    bot_token = "123:test"
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    app = server.create_app(Settings(telegram_bot_token=bot_token, trust_forwarded_for=True), db=db)
+    app.state.resources.rate_limiter = RateLimiter(MemoryRateLimitBackend(), {"posts": (None, Budget(2, 60))})
+
+    async def post(client, i, headers):
+        token, _ = issue_session_token(f"user-{i}", str(i), session_secret(bot_token))
+        return await client.post("/api/posts", json={"content": "hi", "type": "text", "user_id": f"user-{i}"},
+                                 headers={"Authorization": f"Bearer {token}", **headers})
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            # The client rotates the left-most entry; nginx appended the real peer.
+            forwarded = [await post(client, i, {"X-Forwarded-For": f"10.0.0.{i}, 203.0.113.9"}) for i in range(3)]
+            real_ip = [await post(client, i, {"X-Real-IP": "198.51.100.4", "X-Forwarded-For": f"10.0.1.{i}"}) for i in range(3, 6)]
+            return forwarded, real_ip
+
+    forwarded, real_ip = asyncio.run(run())
+    assert [r.status_code for r in forwarded] == [201, 201, 429]
+    assert [r.status_code for r in real_ip] == [201, 201, 429]
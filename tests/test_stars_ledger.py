@@ -0,0 +1,166 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server
+from auth_utils import issue_session_token, session_secret
+from migrations import run_migrations
+from settings import Settings
+from stars_ledger import InsufficientStars, StarsLedger, StarsSnapshotter
+
+
+@pytest.fixture
+def db():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    asyncio.run(run_migrations(db))
+    asyncio.run(db.users.insert_many([{"id": f"u{i}", "telegram_id": str(i), "name": f"User {i}"} for i in range(3)]))
+    return db
+
+
+def test_concurrent_debits_never_overspend(db):
+    ledger = StarsLedger(db)
+
+    async def run():
+        await ledger.post("u0", 10, "adjustment")
+
+        async def spend():
+            try:
+                return await ledger.post("u0", -3, "gift_sent")
+            except InsufficientStars:
+                return None
+        return await asyncio.gather(*(spend() for _ in range(8)))
+
+    results = asyncio.run(run())
+    assert sum(r is not None for r in results) == 3
+    assert asyncio.run(ledger.balance("u0")) == 1
+    entries = asyncio.run(db.stars_ledger.find({"user_id": "u0"}).sort("seq", 1).to_list(length=None))
+    assert [e["seq"] for e in entries] == [1, 2, 3, 4]
+    assert [e["balance_after"] for e in entries] == [10, 7, 4, 1]
+    with pytest.raises(InsufficientStars):
+        asyncio.run(ledger.post("u2", -1, "gift_sent"))
+
+
+def test_snapshotter_rolls_entries_into_user_balances(db):
+    ledger = StarsLedger(db)
+    snapshotter = StarsSnapshotter(ledger)
+    asyncio.run(ledger.post_many([("u0", 5, "adjustment", None), ("u1", 7, "adjustment", None), ("u0", -2, "gift_sent", "g1")]))
+
+    assert asyncio.run(snapshotter.run_once()) == 2
+    users = {u["id"]: u.get("stars_balance") for u in asyncio.run(db.users.find({}).to_list(length=None))}
+    assert users == {"u0": 3, "u1": 7, "u2": None}
+    # Nothing changed since: the next pass writes nothing.
+    assert asyncio.run(snapshotter.run_once()) == 0
+
+    asyncio.run(ledger.post("u1", 1, "adjustment"))
+    assert asyncio.run(snapshotter.run_once()) == 1
+    assert asyncio.run(db.stars_snapshots.find_one({"_id": "u1"}))["seq"] == 2
+
+
+def test_snapshotter_repairs_an_entry_lost_after_the_account_update(db):
+    ledger = StarsLedger(db)
+    asyncio.run(ledger.post("u0", 5, "adjustment"))
+    lost = asyncio.run(ledger.post("u0", -2, "gift_sent"))
+    # Simulate a crash between the account update and the ledger insert.
+    asyncio.run(db.stars_ledger.delete_one({"id": lost["id"]}))
+    asyncio.run(db.stars_accounts.update_one({"_id": "u0"}, {"$set": {"updated_at": datetime.utcnow() - timedelta(minutes=5)}}))
+
+    snapshotter = StarsSnapshotter(ledger, repair_after_seconds=30)
+    asyncio.run(snapshotter.run_once())
+    assert snapshotter.stats.repaired == 1 and snapshotter.stats.mismatches == 0
+    assert asyncio.run(db.stars_ledger.count_documents({"user_id": "u0"})) == 2
+    assert asyncio.run(db.users.find_one({"id": "u0"}))["stars_balance"] == 3
+    assert asyncio.run(ledger.reconcile()).problems == 0
+
+
+class GatedSnapshots:
+    """Holds bulk writes to stars_snapshots until `gate` opens."""
+
+    def __init__(self, db):
+        self._db = db
+        self.reached = asyncio.Event()
+        self.gate = asyncio.Event()
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    def __getitem__(self, name):
+        collection = self._db[name]
+        if name != "stars_snapshots":
+            return collection
+        outer = self
+
+        class Gated:
+            def __getattr__(self, attr):
+                return getattr(collection, attr)
+
+            async def bulk_write(self, ops, **kwargs):
+                outer.reached.set()
+                await outer.gate.wait()
+                return await collection.bulk_write(ops, **kwargs)
+        return Gated()
+
+
+def test_overlapping_snapshotters_never_roll_a_balance_back(db):
+    ledger = StarsLedger(db)
+    stale, current = StarsSnapshotter(ledger), StarsSnapshotter(ledger)
+    stale.db = GatedSnapshots(db)
+
+    async def scenario():
+        await ledger.post("u0", 5, "adjustment")
+        # The stale pass has read seq 1 and is about to write it...
+        slow = asyncio.create_task(stale.run_once())
+        await stale.db.reached.wait()
+        # ...while another worker rolls seq 2 all the way through.
+        await ledger.post("u0", 1, "adjustment")
+        written = await current.run_once()
+        stale.db.gate.set()
+        late = await slow
+        return written, late, await db.stars_snapshots.find_one({"_id": "u0"}), await db.users.find_one({"id": "u0"})
+
+    written, late, snapshot, user = asyncio.run(scenario())
+    assert written == 1 and late == 0
+    assert (snapshot["seq"], snapshot["balance"]) == (2, 6)
+    assert (user["stars_seq"], user["stars_balance"]) == (2, 6)
+
+
+def test_reconcile_flags_drift(db):
+    ledger = StarsLedger(db)
+    asyncio.run(ledger.post_many([("u0", 5, "adjustment", None), ("u1", 4, "adjustment", None), ("u1", -1, "gift_sent", None)]))
+    clean = asyncio.run(ledger.reconcile())
+    assert (clean.accounts, clean.entries, clean.problems) == (2, 3, 0)
+
+    asyncio.run(db.stars_accounts.update_one({"_id": "u0"}, {"$inc": {"balance": 5}}))
+    asyncio.run(db.stars_ledger.insert_one({"user_id": "ghost", "seq": 1, "delta": 3}))
+    report = asyncio.run(ledger.reconcile())
+    assert report.problems == 2
+    assert {(e["user_id"], e["problem"]) for e in report.examples} == {
+        ("u0", "balance differs from ledger"), ("ghost", "ledger entries without an account"),
+    }
+
+
+def test_balance_ledger_and_adjustment_endpoints(db):
+    bot_token = "123:test"
+    app = server.create_app(Settings(telegram_bot_token=bot_token, admin_api_token="admin"), db=db)
+    token, _ = issue_session_token("u0", "0", session_secret(bot_token))
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            adjust = lambda delta: client.post("/api/users/u0/stars/adjustments", json={"delta": delta}, headers={"X-Admin-Token": "admin"})
+            return [
+                await adjust(20), await adjust(-50),
+                await client.get("/api/users/u0/stars", headers={"Authorization": f"Bearer {token}"}),
+                await client.get("/api/users/u0/stars/ledger", headers={"Authorization": f"Bearer {token}"}),
+                await client.get("/api/users/u1/stars", headers={"Authorization": f"Bearer {token}"}),
+            ]
+
+    credit, overdraw, balance, history, other = asyncio.run(run())
+    assert credit.status_code == 201 and credit.json()["balance_after"] == 20
+    assert overdraw.status_code == 402
+    assert balance.json() == {"user_id": "u0", "balance": 20}
+    assert [e["delta"] for e in history.json()["items"]] == [20]
+    assert other.status_code == 403
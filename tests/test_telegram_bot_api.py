@@ -0,0 +1,204 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from external_integrations.telegram_bot_api import TelegramAPIError, TelegramBotAPIClient, TelegramClientConfig
+
+
+class StubBotAPI:
+    """Local stand-in for api.telegram.org that replays scripted responses per method."""
+
+    def __init__(self):
+        self.scripts = {}
+        self.trickle = {}  # method -> seconds between response body bytes
+        self.requests = []
+        self.connections = set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"null")
+                method = self.path.rsplit("/", 1)[-1]
+                stub.requests.append((self.path, body))
+                stub.connections.add(self.client_address)
+                script = stub.scripts.get(method) or [(200, {"ok": True, "result": True})]
+                status, payload = script.pop(0) if len(script) > 1 else script[0]
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                delay = stub.trickle.get(method)
+                try:
+                    if delay is None:
+                        self.wfile.write(data)
+                    for byte in data if delay is not None else b"":
+                        time.sleep(delay)
+                        self.wfile.write(bytes([byte]))
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    with StubBotAPI() as s:
+        yield s
+
+
+def make_client(stub, **overrides):
+    config = TelegramClientConfig(bot_token="123:TEST", base_url=stub.base_url, backoff_base=0.01, **overrides)
+    return TelegramBotAPIClient(config)
+
+
+def test_reuses_pooled_connection(stub):
+    async def scenario():
+        client = make_client(stub)
+        try:
+            for _ in range(5):
+                assert (await client.call("createInvoiceLink", {"payload": "p"}))["ok"] is True
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
+    assert [path for path, _ in stub.requests] == ["/bot123:TEST/createInvoiceLink"] * 5
+    assert len(stub.connections) == 1
+
+
+def test_retries_429_with_retry_after_and_5xx(stub):
+    stub.scripts["answerPreCheckoutQuery"] = [
+        (429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 0.01}}),
+        (502, {"ok": False}),
+        (200, {"ok": True, "result": True}),
+    ]
+
+    async def scenario():
+        client = make_client(stub)
+        try:
+            result = await client.call("answerPreCheckoutQuery", {"pre_checkout_query_id": "q", "ok": True})
+            return result, client.stats_snapshot()
+        finally:
+            await client.aclose()
+
+    result, stats = asyncio.run(scenario())
+    assert result == {"ok": True, "result": True}
+    assert len(stub.requests) == 3
+    assert stats["answerPreCheckoutQuery"]["calls"] == 1
+    assert stats["answerPreCheckoutQuery"]["retries"] == 2
+    assert stats["answerPreCheckoutQuery"]["errors"] == 0
+
+
+def test_gives_up_on_client_errors_and_long_retry_after(stub):
+    stub.scripts["createInvoiceLink"] = [(400, {"ok": False, "description": "Bad Request"})]
+    stub.scripts["sendMessage"] = [(429, {"ok": False, "parameters": {"retry_after": 60}})]
+
+    async def scenario():
+        client = make_client(stub)
+        try:
+            with pytest.raises(TelegramAPIError) as bad_request:
+                await client.call("createInvoiceLink", {})
+            with pytest.raises(TelegramAPIError) as flood:
+                await client.call("sendMessage", {})
+            return bad_request.value, flood.value, client.stats_snapshot()
+        finally:
+            await client.aclose()
+
+    bad_request, flood, stats = asyncio.run(scenario())
+    assert bad_request.status_code == 400
+    assert flood.status_code == 429
+    assert len(stub.requests) == 2
+    assert stats["createInvoiceLink"]["errors"] == 1
+    assert stats["sendMessage"]["errors"] == 1
+
+
+def test_retry_after_header_is_honoured_with_a_json_body():
+    responses = iter([
+        httpx.Response(429, json={"ok": False, "error_code": 429}, headers={"Retry-After": "60"}),
+        httpx.Response(200, json={"ok": True, "result": True}),
+    ])
+    transport = httpx.MockTransport(lambda request: next(responses))
+
+    async def scenario():
+        client = TelegramBotAPIClient(TelegramClientConfig(bot_token="123:TEST", backoff_base=0.01), transport=transport)
+        try:
+            with pytest.raises(TelegramAPIError) as flood:
+                await client.call("sendMessage", {})
+            return flood.value
+        finally:
+            await client.aclose()
+
+    # 60s is past max_retry_after, so the header (not backoff) decides: no retry.
+    assert asyncio.run(scenario()).status_code == 429
+
+
+def test_retries_stop_at_the_call_deadline():
+    attempts = []
+
+    async def slow_timeout(request):
+        attempts.append(request.extensions["timeout"]["read"])
+        await asyncio.sleep(0.05)
+        raise httpx.ReadTimeout("read timed out", request=request)
+
+    config = TelegramClientConfig(bot_token="123:TEST", max_retries=50, backoff_base=0.01, backoff_max=0.01,
+                                  method_deadlines={"answerPreCheckoutQuery": 0.3})
+
+    async def scenario():
+        client = TelegramBotAPIClient(config, transport=httpx.MockTransport(slow_timeout))
+        started = time.perf_counter()
+        try:
+            # The last attempt ends in the transport's ReadTimeout or is cut at the deadline.
+            with pytest.raises(httpx.TimeoutException):
+                await client.call("answerPreCheckoutQuery", {"pre_checkout_query_id": "q", "ok": True})
+            return time.perf_counter() - started
+        finally:
+            await client.aclose()
+
+    elapsed = asyncio.run(scenario())
+    assert elapsed < 0.5
+    assert 2 <= len(attempts) < 50
+    assert all(timeout <= 0.3 for timeout in attempts)
+
+
+def test_trickling_response_cannot_outlive_the_deadline(stub):
+    # Every byte arrives well inside read_timeout, so only the per-attempt
+    # deadline can stop this call.
+    stub.trickle["answerPreCheckoutQuery"] = 0.2
+
+    async def scenario():
+        client = make_client(stub, read_timeout=5.0, method_deadlines={"answerPreCheckoutQuery": 1.0})
+        started = time.perf_counter()
+        try:
+            with pytest.raises(httpx.TimeoutException):
+                await client.call("answerPreCheckoutQuery", {"pre_checkout_query_id": "q", "ok": True})
+        finally:
+            await client.aclose()
+        return time.perf_counter() - started
+
+    assert asyncio.run(scenario()) < 1.5
@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from user_search import UserSearchIndex, decode_offset, encode_offset
+
+USERS = [
+    {"id": "1", "name": "Anna Karenina", "username": "anna_k", "follower_count": 5},
+    {"id": "2", "name": "Annabel Lee", "username": "poe_fan", "follower_count": 50},
+    {"id": "3", "name": "Joanna Smith", "username": "anna", "follower_count": 0},
+    {"id": "4", "name": "Zoë Ånnesen", "username": None, "follower_count": 1},
+    {"id": "5", "name": "Bob", "username": "bobby", "follower_count": 0},
+]
+
+
+def ids(results):
+    return [user["id"] for user in results]
+
+
+def make_index():
+    index = UserSearchIndex()
+    index.build(USERS)
+    return index
+
+
+def test_ranking_and_normalization():
+    results, _ = make_index().search("ANNA", limit=10)
+    # Exact username, username prefix, then name/word prefixes by follower count.
+    assert ids(results) == ["3", "1", "2"]
+    assert ids(make_index().search("ånne")[0]) == ["4"]
+    assert ids(make_index().search("@bob")[0]) == ["5"]
+    assert ids(make_index().search("zoe")[0]) == ["4"]
+
+
+def test_multi_word_queries_match_every_word():
+    index = make_index()
+    assert ids(index.search("anna kar")[0]) == ["1"]
+    assert ids(index.search("lee ann")[0]) == ["2"]
+    assert index.search("anna bob")[0] == []
+
+
+def test_phrase_matches_do_not_hide_out_of_order_ones():
+    index = make_index()
+    index.upsert({"id": "6", "name": "Karla Annaeva", "username": None, "follower_count": 100})
+    # "anna kar" is a phrase prefix of Anna Karenina only; Karla Annaeva has both
+    # words out of order and still matches, after the in-order match.
+    assert ids(index.search("anna kar")[0]) == ["1", "6"]
+
+
+def test_pagination_walks_all_results_once():
+    index = make_index()
+    seen, cursor = [], None
+    while True:
+        page, next_offset = index.search("ann", limit=1, offset=decode_offset(cursor))
+        seen += ids(page)
+        if next_offset is None:
+            break
+        cursor = encode_offset(next_offset)
+    assert seen == ids(index.search("ann", limit=10)[0])
+    assert len(seen) == 4  # anna_k, anna, Annabel, Ånnesen
+
+
+def test_upsert_replaces_old_tokens():
+    index = make_index()
+    index.upsert({"id": "5", "name": "Robert Paulson", "username": "bobby"})
+    index.upsert({"id": "6", "name": "Anna New", "username": None})
+    assert index.search("bob")[0][0]["name"] == "Robert Paulson"
+    assert ids(index.search("paul")[0]) == ["5"]
+    assert "6" in ids(index.search("anna", limit=10)[0])
+    index.remove("6")
+    assert "6" not in ids(index.search("anna", limit=10)[0])
+    assert len(index._keys) == sum(len(u.tokens) for u in index._users if u)
+
+
+def test_follower_changes_reach_the_ranking_on_sync():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from feed import FeedService
+
+    long_ago = datetime(2020, 1, 1)
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+        await db.users.insert_many([
+            {"id": "a", "name": "Anna Alpha", "follower_count": 0, "updated_at": long_ago},
+            {"id": "b", "name": "Anna Beta", "follower_count": 1, "updated_at": long_ago},
+        ])
+        index = UserSearchIndex()
+        await index.load(db)
+        before = ids(index.search("anna")[0])
+        feed = FeedService(db)
+        await feed.follow("x", "a")
+        await feed.follow("y", "a")
+        synced = await index.sync(db)
+        return before, synced, ids(index.search("anna")[0])
+
+    before, synced, after = asyncio.run(scenario())
+    assert before == ["b", "a"]
+    assert synced == 1
+    assert after == ["a", "b"]
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from migrations import run_migrations
+from webhook_queue import DEAD_LETTER_COLLECTION, QUEUE_COLLECTION, WebhookQueue
+
+
+async def make_db():
+    db = mongomock_motor.AsyncMongoMockClient()["tgwall_test"]
+    await run_migrations(db)
+    return db
+
+
+def test_updates_are_deduplicated_and_processed_once():
+    handled = []
+
+    async def handler(update):
+        handled.append(update["update_id"])
+
+    async def scenario():
+        queue = WebhookQueue(await make_db(), handler, workers=4, poll_interval=0.01)
+        queue.start()
+        results = await asyncio.gather(*(queue.enqueue({"update_id": i % 50}) for i in range(100)))
+        await queue.drain()
+        await queue.close()
+        return results, queue.stats
+
+    results, stats = asyncio.run(scenario())
+    assert results.count(True) == 50
+    assert sorted(handled) == list(range(50))
+    assert stats.processed == 50 and stats.duplicates == 50
+
+
+def test_failures_retry_then_dead_letter():
+    attempts = {}
+
+    async def handler(update):
+        attempts[update["update_id"]] = attempts.get(update["update_id"], 0) + 1
+        if update["update_id"] == "poison" or attempts[update["update_id"]] < 2:
+            raise RuntimeError("boom")
+
+    async def scenario():
+        db = await make_db()
+        queue = WebhookQueue(db, handler, workers=2, max_attempts=3, backoff_base=0.0, poll_interval=0.01)
+        queue.start()
+        await queue.enqueue({"update_id": "flaky"})
+        await queue.enqueue({"update_id": "poison"})
+        await queue.drain()
+        await queue.close()
+        dead = await db[DEAD_LETTER_COLLECTION].find_one({"_id": "poison"})
+        flaky = await db[QUEUE_COLLECTION].find_one({"_id": "flaky"})
+        return queue.stats, dead, flaky
+
+    stats, dead, flaky = asyncio.run(scenario())
+    assert attempts == {"flaky": 2, "poison": 3}
+    assert flaky["status"] == "done"
+    assert dead["attempts"] == 3 and "boom" in dead["last_error"]
+    assert stats.dead_lettered == 1 and stats.retried == 3
+
+
+def test_worker_with_expired_lease_cannot_finish_the_job():
+    async def handler(update):
+        pass
+
+    async def scenario():
+        db = await make_db()
+        queue = WebhookQueue(db, handler, lease_seconds=-1, backoff_base=0.0)
+        await queue.enqueue({"update_id": 1})
+        stale = await queue.claim()
+        current = await queue.claim()
+        await queue._complete(stale)
+        await queue._fail(stale, RuntimeError("late"))
+        after_stale = await db[QUEUE_COLLECTION].find_one({"_id": 1})
+        await queue._complete(current)
+        return stale, current, after_stale, await db[QUEUE_COLLECTION].find_one({"_id": 1}), queue.stats
+
+    stale, current, after_stale, done, stats = asyncio.run(scenario())
+    assert stale["lease"] != current["lease"]
+    assert after_stale["status"] == "processing" and after_stale["lease"] == current["lease"]
+    assert "last_error" not in after_stale
+    assert done["status"] == "done"
+    assert stats.lease_lost == 2 and stats.processed == 1 and stats.retried == 0
+
+
+def test_enqueue_wakes_a_single_idle_worker():
+    handled = []
+
+    async def handler(update):
+        handled.append(update["update_id"])
+
+    class CountingQueue(WebhookQueue):
+        claims = 0
+
+        async def claim(self):
+            CountingQueue.claims += 1
+            return await super().claim()
+
+    async def scenario():
+        # With a poll interval this long, draining in time means enqueue woke a worker.
+        queue = CountingQueue(await make_db(), handler, workers=8, poll_interval=60)
+        queue.start()
+        await asyncio.sleep(0.05)
+        idle_claims = CountingQueue.claims
+        for i in range(5):
+            await queue.enqueue({"update_id": i})
+            await queue.drain(timeout=1)
+        await queue.close()
+        return idle_claims, CountingQueue.claims - idle_claims
+
+    idle_claims, claims = asyncio.run(scenario())
+    assert handled == list(range(5))
+    assert idle_claims == 8
+    assert claims <= 5 * 2